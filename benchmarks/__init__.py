@@ -0,0 +1,2 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""Benchmarks of the EasIlastik package."""
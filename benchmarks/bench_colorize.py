@@ -0,0 +1,112 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Compare the coloring engine with the previous implementation of the probability thresholding.
+
+Random probability maps of several sizes and numbers of channels are colored with the previous implementation
+(argmax, max, take, where, astype and RGB to BGR conversion) and with `ColorizeEngine`. The script reports the best
+duration of each one, the speedup, and fails if the two images differ.
+
+Usage: python -m benchmarks.bench_colorize [--sizes 1000 4000] [--channels 2 4 8] [--runs 5]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from collections.abc import Callable
+
+import cv2
+import numpy as np
+
+from easilastik.colorize import get_engine, get_palette
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+THRESHOLD = 0.5
+BELOW_THRESHOLD_COLOR = [255, 0, 0]
+
+
+def legacy_colorize(
+    data: np.ndarray, threshold: float, below_threshold_color: list, channel_colors: list
+) -> np.ndarray:
+    """Color probabilities as `color_treshold_probabilities` did before the coloring engine."""
+    indices = np.argmax(data, axis=-1)
+    indices = indices.astype(int)
+    max_values = np.max(data, axis=-1)
+    colors = np.array([below_threshold_color, *channel_colors])
+    below_threshold_color_array = np.array(below_threshold_color)[np.newaxis, np.newaxis, :]
+    color_map = np.take(colors, indices + 1, axis=0)
+    color_image = np.where(max_values[..., np.newaxis] > threshold, color_map, below_threshold_color_array)
+    return cv2.cvtColor(color_image.astype(np.uint8), cv2.COLOR_RGB2BGR)
+
+
+def best_time(function: Callable[[], np.ndarray], runs: int) -> tuple[float, np.ndarray]:
+    """
+    Return the best duration of a function over several runs, and its last result.
+
+    Parameters
+    ----------
+    function : Callable[[], np.ndarray]
+        The function to time.
+    runs : int
+        The number of runs.
+
+    Returns
+    -------
+    tuple[float, np.ndarray]
+        The best duration in seconds and the result of the last run.
+    """
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations), result
+
+
+def main() -> int:
+    """Run the benchmark and return the exit code."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000], help="side of the square images")
+    parser.add_argument("--channels", type=int, nargs="+", default=[2, 4, 8], help="numbers of channels")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs of each implementation")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    engine = get_engine()
+    failed = False
+    for size in args.sizes:
+        for channels in args.channels:
+            data = rng.dirichlet(np.ones(channels), size=(size, size)).astype(np.float32)
+            channel_colors = rng.integers(0, 256, size=(channels, 3)).tolist()
+            palette = get_palette(BELOW_THRESHOLD_COLOR, channel_colors)
+            out = np.empty((size, size, 3), dtype=np.uint8)
+
+            legacy_time, expected = best_time(
+                lambda: legacy_colorize(data, THRESHOLD, BELOW_THRESHOLD_COLOR, channel_colors),  # noqa: B023
+                args.runs,
+            )
+            engine_time, result = best_time(
+                lambda: engine.colorize(data, THRESHOLD, palette, out=out),  # noqa: B023
+                args.runs,
+            )
+
+            logger.info(
+                "%5dx%-5d %2d channels: previous %7.1f ms, engine %7.1f ms, speedup x%.1f",
+                size,
+                size,
+                channels,
+                legacy_time * 1000,
+                engine_time * 1000,
+                legacy_time / engine_time,
+            )
+            if not np.array_equal(expected, result):
+                logger.error("The engine and the previous implementation give different images.")
+                failed = True
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
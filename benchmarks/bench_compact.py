@@ -0,0 +1,105 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Compare the size and read speed of compacted probability files with the raw export of Ilastik.
+
+Smooth random probability maps of several sizes and numbers of channels are written as Ilastik writes them
+(uncompressed float32) and compacted to uint8 and float16 (see `compact_probabilities`). The script reports the
+bytes on disk of each file, the throughput of reading and coloring it, and fails if the colors of a compacted file
+differ from the raw ones on more than 1% of the pixels.
+
+The files are read from the page cache after the first run: on a network filesystem, the gain of the compacted
+files is closer to the ratio of the sizes.
+
+Usage: python -m benchmarks.bench_compact [--sizes 1000 4000] [--channels 2 4 8] [--runs 3] [--dir /tmp]
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import h5py
+import numpy as np
+
+from easilastik.compact import compact_probabilities
+from easilastik.run_ilastik import color_treshold_probabilities
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+THRESHOLD = 0.5
+BELOW_THRESHOLD_COLOR = [255, 0, 0]
+MAX_MISMATCH = 0.01
+VARIANTS = [("raw float32", None, None), ("uint8 lzf", "uint8", "lzf"), ("float16 lzf", "float16", "lzf")]
+
+
+def make_probabilities(rng: np.random.Generator, size: int, channels: int) -> np.ndarray:
+    """Return smooth probabilities, closer to the output of a classifier than independent random values."""
+    noise = rng.standard_normal((size, size, channels)).astype(np.float32)
+    logits = np.stack([cv2.GaussianBlur(noise[..., c], (0, 0), sigmaX=8) for c in range(channels)], axis=-1) * 40
+    logits -= logits.max(axis=-1, keepdims=True)
+    probabilities = np.exp(logits)
+    probabilities /= probabilities.sum(axis=-1, keepdims=True)
+    return probabilities
+
+
+def main() -> int:
+    """Run the benchmark and return the exit code."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000], help="side of the square images")
+    parser.add_argument("--channels", type=int, nargs="+", default=[2, 4, 8], help="numbers of channels")
+    parser.add_argument("--runs", type=int, default=3, help="number of reads of each file")
+    parser.add_argument("--dir", default=None, help="directory of the temporary files, e.g. on a network share")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    failed = False
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        for size in args.sizes:
+            for channels in args.channels:
+                probabilities = make_probabilities(rng, size, channels)
+                channel_colors = rng.integers(0, 256, size=(channels, 3)).tolist()
+                raw_path = Path(tmp_dir) / "raw.h5"
+                with h5py.File(raw_path, "w") as f:
+                    f.create_dataset("exported_data", data=probabilities)
+
+                expected = None
+                for name, dtype, compression in VARIANTS:
+                    file_path = raw_path
+                    if dtype is not None:
+                        file_path = Path(tmp_dir) / f"{dtype}.h5"
+                        compact_probabilities(str(raw_path), dtype, compression=compression, output_path=file_path)
+
+                    durations = []
+                    for _ in range(args.runs):
+                        start_time = time.perf_counter()
+                        image = color_treshold_probabilities(
+                            str(file_path), THRESHOLD, BELOW_THRESHOLD_COLOR, channel_colors
+                        )
+                        durations.append(time.perf_counter() - start_time)
+
+                    if expected is None:
+                        expected = image.copy()
+                    mismatch = np.mean(np.any(image != expected, axis=-1))
+                    logger.info(
+                        "%5dx%-5d %2d channels %-12s: %8.1f MB on disk, %7.1f Mpixels/s, %.3f%% pixels differ",
+                        size,
+                        size,
+                        channels,
+                        name,
+                        file_path.stat().st_size / 2**20,
+                        size * size / min(durations) / 1e6,
+                        mismatch * 100,
+                    )
+                    if mismatch > MAX_MISMATCH:
+                        logger.error("The colors of the %s file differ from the raw export.", name)
+                        failed = True
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Check that `import easilastik` stays within a fixed time budget.
+
+The import is timed in fresh interpreters and compared to the startup of an interpreter that imports nothing, so
+that the budget only covers the cost of the package itself. The script also checks that the import does not load
+any heavy dependency.
+
+Usage: python -m benchmarks.bench_import [--budget-ms 50] [--runs 20]
+"""
+
+import argparse
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Modules that must not be loaded by `import easilastik`
+HEAVY_MODULES = ["cv2", "h5py", "numpy", "requests"]
+
+
+def time_command(code: str, runs: int) -> float:
+    """
+    Return the median duration of a Python command run in fresh interpreters.
+
+    Parameters
+    ----------
+    code : str
+        The Python code to run.
+    runs : int
+        The number of runs.
+
+    Returns
+    -------
+    float
+        The median duration in seconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdin=subprocess.DEVNULL)  # noqa: S603
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations)
+
+
+def main() -> int:
+    """Run the benchmark and return the exit code."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="maximum import overhead in milliseconds")
+    parser.add_argument("--runs", type=int, default=20, help="number of interpreters started for each measure")
+    args = parser.parse_args()
+
+    baseline = time_command("pass", args.runs)
+    with_import = time_command("import easilastik", args.runs)
+    overhead_ms = (with_import - baseline) * 1000
+
+    loaded = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", f"import easilastik, sys; print(*(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        check=True,
+        capture_output=True,
+        stdin=subprocess.DEVNULL,
+        text=True,
+    ).stdout.split()
+
+    logger.info("Interpreter startup: %.1f ms", baseline * 1000)
+    logger.info(
+        "import easilastik:   %.1f ms (+%.1f ms, budget %.1f ms)", with_import * 1000, overhead_ms, args.budget_ms
+    )
+
+    failed = False
+    if loaded:
+        logger.error("import easilastik loaded heavy modules: %s", ", ".join(loaded))
+        failed = True
+    if overhead_ms > args.budget_ms:
+        logger.error("import easilastik is over budget.")
+        failed = True
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Measure the overhead of EasIlastik around Ilastik with a fake Ilastik launcher.
+
+Ilastik is replaced by `run_ilastik.sh` (see `fake_ilastik.py`), which writes synthetic outputs of the requested
+size after a configurable delay, so that the time measured is the one of EasIlastik: discovery of the images,
+command lines, wait for the subprocess, reading of the probabilities, coloring and writing of the images. Each case
+runs in a fresh interpreter, and the script reports its duration, its throughput, its overhead (the duration minus
+the delays of the fake Ilastik, so including the start of its interpreter) and the peak resident memory of the
+Python process and of its children.
+
+Usage: python -m benchmarks.bench_pipeline [--cases run_ilastik treshold_probabilities] [--sizes 512 2048]
+       [--counts 10 100] [--channels 3] [--delay 0] [--startup 0] [--json results.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+FAKE_ILASTIK = Path(__file__).with_name("run_ilastik.sh")
+CASES = ["run_ilastik", "run_ilastik_probabilities", "treshold_probabilities"]
+THRESHOLD = 0.5
+BELOW_THRESHOLD_COLOR = [255, 0, 0]
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_BYTES = 1 if sys.platform == "darwin" else 1024  # noqa: PLR2004
+
+
+def get_peak_rss_mb(who: int) -> float:
+    """Return the peak resident memory in MB of the process (RUSAGE_SELF) or of its children (RUSAGE_CHILDREN)."""
+    return resource.getrusage(who).ru_maxrss * MAXRSS_BYTES / 2**20
+
+
+def run_case(case: str, count: int, channels: int, tmp_dir: str) -> float:
+    """
+    Prepare and run one case of the benchmark.
+
+    Parameters
+    ----------
+    case : str
+        The function benchmarked, one of CASES.
+    count : int
+        The number of images.
+    channels : int
+        The number of labels of the fake project.
+    tmp_dir : str
+        The directory of the inputs and outputs.
+
+    Returns
+    -------
+    float
+        The duration of the benchmarked call in seconds, preparation excluded.
+    """
+    from easilastik.run_ilastik import (  # noqa: PLC0415
+        run_ilastik,
+        run_ilastik_probabilities,
+        treshold_probabilities,
+    )
+
+    input_dir = Path(tmp_dir) / "inputs"
+    input_dir.mkdir()
+    for index in range(count):
+        # The fake Ilastik does not read the images, only their names matter
+        (input_dir / f"image_{index:06d}.png").write_bytes(os.urandom(1024))
+    model_path = Path(tmp_dir) / "model.ilp"
+    model_path.write_bytes(b"")
+    result_base_path = str(Path(tmp_dir) / "results") + os.sep
+    channel_colors = [[(37 * c) % 256, (91 * c) % 256, (157 * c) % 256] for c in range(channels)]
+
+    if case == "treshold_probabilities":  # noqa: PLR2004
+        run_ilastik(str(input_dir), str(model_path), result_base_path, str(FAKE_ILASTIK), "Probabilities", "hdf5")
+        start_time = time.perf_counter()
+        treshold_probabilities(result_base_path, THRESHOLD, BELOW_THRESHOLD_COLOR, channel_colors)
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if case == "run_ilastik":  # noqa: PLR2004
+        run_ilastik(str(input_dir), str(model_path), result_base_path, str(FAKE_ILASTIK))
+    else:
+        run_ilastik_probabilities(
+            str(input_dir),
+            str(model_path),
+            result_base_path,
+            THRESHOLD,
+            BELOW_THRESHOLD_COLOR,
+            channel_colors,
+            ilastik_script_path=str(FAKE_ILASTIK),
+        )
+    return time.perf_counter() - start_time
+
+
+def run_child(args: argparse.Namespace) -> int:
+    """Run a single case in this interpreter and print its measures as JSON."""
+    logging.getLogger("easilastik").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        duration = run_case(args.child, args.counts[0], args.channels, tmp_dir)
+    result = {
+        "duration": duration,
+        "peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_SELF),
+        "children_peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    sys.stdout.write(json.dumps(result) + "\n")
+    return 0
+
+
+def main() -> int:
+    """Run the benchmark and return the exit code."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES, help="functions to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048], help="side of the square outputs")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100], help="numbers of images")
+    parser.add_argument("--channels", type=int, default=3, help="number of labels of the fake project")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds spent by the fake Ilastik on each image")
+    parser.add_argument("--startup", type=float, default=0.0, help="seconds spent by the fake Ilastik to start")
+    parser.add_argument("--json", help="file where the results are saved, to compare them between versions")
+    parser.add_argument("--child", choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return run_child(args)
+
+    results = []
+    for case in args.cases:
+        for size in args.sizes:
+            for count in args.counts:
+                env = {
+                    **os.environ,
+                    "FAKE_ILASTIK_PYTHON": sys.executable,
+                    "FAKE_ILASTIK_SIZE": str(size),
+                    "FAKE_ILASTIK_CHANNELS": str(args.channels),
+                    "FAKE_ILASTIK_DELAY": str(args.delay),
+                    "FAKE_ILASTIK_STARTUP": str(args.startup),
+                }
+                command = [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.bench_pipeline",
+                    "--child",
+                    case,
+                    "--counts",
+                    str(count),
+                    "--channels",
+                    str(args.channels),
+                ]
+                completed = subprocess.run(command, check=True, env=env, capture_output=True, text=True)  # noqa: S603
+                output = completed.stdout
+                result = {"case": case, "size": size, "count": count, **json.loads(output.splitlines()[-1])}
+                # Ilastik runs once, except for treshold_probabilities whose inputs are prepared before the timing
+                ilastik_timed = case != "treshold_probabilities"  # noqa: PLR2004
+                waited = args.startup + count * args.delay if ilastik_timed else 0.0
+                result["overhead"] = result["duration"] - waited
+                result["images_per_second"] = count / result["duration"]
+                results.append(result)
+                logger.info(
+                    "%-26s %5dx%-5d %5d images: %7.2f s, %7.1f images/s, overhead %7.2f s, "
+                    "peak RSS %6.0f MB (children %6.0f MB)",
+                    case,
+                    size,
+                    size,
+                    count,
+                    result["duration"],
+                    result["images_per_second"],
+                    result["overhead"],
+                    result["peak_rss_mb"],
+                    result["children_peak_rss_mb"],
+                )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Stand-in for Ilastik in headless mode, to measure the overhead of EasIlastik without Ilastik.
+
+It accepts the command line built by `build_ilastik_args` (`--headless --readonly --project --export_source
+--output_format --output_filename_format` followed by the input images) and writes a synthetic output for each
+input, in the order of the command line, like Ilastik does. It is configured by environment variables:
+
+- FAKE_ILASTIK_STARTUP: seconds spent before the first image, like the loading of the project. Default is 0.
+- FAKE_ILASTIK_DELAY: seconds spent on each image before its output is written. Default is 0.
+- FAKE_ILASTIK_SIZE: side in pixels of the square outputs. Default is 512. With 0, the outputs have the size of
+  their input and are computed pixel by pixel from its first channel, so that they do not depend on how the
+  images are batched or tiled.
+- FAKE_ILASTIK_CHANNELS: number of labels of the project, i.e. channels of the probabilities. Default is 3.
+- FAKE_ILASTIK_FAIL_ON: if set, the process exits with code 1 when it reaches an input whose name contains it.
+
+It is run through `run_ilastik.sh`, next to it, and must not import anything from easilastik.
+
+Usage: run_ilastik.sh --headless --readonly --project=model.ilp --export_source="Probabilities" --output_format=hdf5
+       --output_filename_format=results/{nickname}_Probabilities image_1.png image_2.png
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+# Extensions of the single file formats, as added by Ilastik to the output filename format
+EXTENSIONS = {
+    "bmp": ".bmp",
+    "jpeg": ".jpeg",
+    "jpg": ".jpg",
+    "png": ".png",
+    "tif": ".tif",
+    "tiff": ".tiff",
+    "multipage tiff": ".tiff",
+    "hdf5": ".h5",
+    "compressed hdf5": ".h5",
+}
+
+
+def make_output(export_source: str, size: int, channels: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Return a synthetic result of Ilastik.
+
+    Parameters
+    ----------
+    export_source : str
+        The type of data exported.
+    size : int
+        The side of the square result.
+    channels : int
+        The number of labels of the project.
+    rng : np.random.Generator
+        The random generator.
+
+    Returns
+    -------
+    np.ndarray
+        float32 probabilities of shape (size, size, channels) summing to 1 for "Probabilities", else uint8 labels
+        between 1 and channels of shape (size, size, 1).
+    """
+    if export_source == "Probabilities":  # noqa: PLR2004
+        probabilities = rng.random((size, size, channels), dtype=np.float32)
+        probabilities /= probabilities.sum(axis=-1, keepdims=True)
+        return probabilities
+    return rng.integers(1, channels + 1, size=(size, size, 1), dtype=np.uint8)
+
+
+def make_output_from_input(input_path: str, export_source: str, channels: int) -> np.ndarray:
+    """
+    Return a result of Ilastik computed pixel by pixel from an input image, see `make_output`.
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the input image.
+    export_source : str
+        The type of data exported.
+    channels : int
+        The number of labels of the project.
+
+    Returns
+    -------
+    np.ndarray
+        The result, with the size of the input: the label of a pixel is given by the value of its first channel,
+        and its probabilities are 0.9 for this label and an equal share of the rest for the other ones.
+    """
+    import cv2  # noqa: PLC0415
+
+    image = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
+    values = image if image.ndim == 2 else image[..., 0]
+    labels = (values.astype(np.uint16) * channels // 256).astype(np.uint8)
+    if export_source == "Probabilities":  # noqa: PLR2004
+        probabilities = np.full((*labels.shape, channels), 0.1 / max(1, channels - 1), dtype=np.float32)
+        np.put_along_axis(probabilities, labels[..., None], np.float32(0.9), axis=-1)
+        return probabilities
+    return labels[..., None] + np.uint8(1)
+
+
+def write_output(output_path: str, output_format: str, data: np.ndarray) -> None:
+    """
+    Write a result in the format requested on the command line.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output file.
+    output_format : str
+        The format of the output file.
+    data : np.ndarray
+        The result, as returned by `make_output`.
+    """
+    if output_format in {"hdf5", "compressed hdf5"}:
+        import h5py  # noqa: PLC0415
+
+        compression = None if output_format == "hdf5" else "gzip"  # noqa: PLR2004
+        with h5py.File(output_path, "w") as f:
+            f.create_dataset("exported_data", data=data, compression=compression)
+        return
+
+    import cv2  # noqa: PLC0415
+
+    if data.dtype != np.uint8:
+        data = (data * 255).astype(np.uint8)
+    cv2.imwrite(output_path, data[..., 0] if data.shape[-1] == 1 else data[..., :3])
+
+
+def main() -> int:
+    """Process the images of the command line and return the exit code."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--readonly", action="store_true")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--export_source", default="Simple Segmentation")
+    parser.add_argument("--output_format", default="png")
+    parser.add_argument("--output_filename_format", required=True)
+    parser.add_argument("inputs", nargs="*")
+    args, _ = parser.parse_known_args()
+
+    if args.output_format not in EXTENSIONS:
+        sys.stderr.write(f"fake_ilastik: unsupported output format '{args.output_format}'\n")
+        return 2
+
+    startup = float(os.environ.get("FAKE_ILASTIK_STARTUP", "0"))
+    delay = float(os.environ.get("FAKE_ILASTIK_DELAY", "0"))
+    size = int(os.environ.get("FAKE_ILASTIK_SIZE", "512"))
+    channels = int(os.environ.get("FAKE_ILASTIK_CHANNELS", "3"))
+    fail_on = os.environ.get("FAKE_ILASTIK_FAIL_ON")
+
+    rng = np.random.default_rng(0)
+    time.sleep(startup)
+    for input_path in args.inputs:
+        if fail_on and fail_on in Path(input_path).name:
+            sys.stderr.write(f"fake_ilastik: could not read {input_path}\n")
+            return 1
+        time.sleep(delay)
+        nickname = Path(input_path).stem
+        output_path = args.output_filename_format.replace("{nickname}", nickname) + EXTENSIONS[args.output_format]
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        if size == 0:
+            output = make_output_from_input(input_path, args.export_source, channels)
+        else:
+            output = make_output(args.export_source, size, channels, rng)
+        write_output(output_path, args.output_format, output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
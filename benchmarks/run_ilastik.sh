@@ -0,0 +1,5 @@
+#!/bin/sh
+# Copyright (C) 2026 Titouan Le Gourrierec
+# Fake Ilastik launcher used by the benchmarks, see fake_ilastik.py.
+# The Python interpreter running it can be set with FAKE_ILASTIK_PYTHON.
+exec "${FAKE_ILASTIK_PYTHON:-python3}" "$(dirname "$0")/fake_ilastik.py" "$@"
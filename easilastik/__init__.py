@@ -12,37 +12,131 @@ How to use the documentation
 ----------------------------
 Documentation is available in two forms: docstrings provided with the code, and a standalone reference guide
 available from the `EasIlastik homepage : https://github.com/titouanlegourrierec/EasIlastik/wiki`.
+
+Importing the package is cheap: the submodules (and their dependencies such as OpenCV or h5py) are only imported
+when one of their functions is first accessed, and no update check is made unless `check_for_update` is called or
+the `EASILASTIK_CHECK_UPDATES` environment variable is set to 1.
 """
 
 __author__ = "Titouan Le Gourrierec"
 __email__ = "titouanlegourrierec@icloud.com"
 
+import importlib
 import logging
+import os
 import subprocess
 import sys
-from importlib.metadata import version
-
-import requests
-
-from .run_ilastik import (
-    color_treshold_probabilities,
-    run_ilastik,
-    run_ilastik_probabilities,
-)
+import threading
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from .aio import run_ilastik_async, run_ilastik_probabilities_async, set_max_processes
+    from .arrays import color_treshold_array, segment_arrays
+    from .cache import ResultCache
+    from .compact import compact_probabilities
+    from .errors import BatchError
+    from .isolation import FailureIsolation
+    from .metrics import RunMetrics
+    from .multi_model import run_ilastik_models
+    from .run_ilastik import color_treshold_probabilities, run_ilastik, run_ilastik_probabilities
+    from .session import IlastikSession
+    from .statistics import BatchStatistics
+    from .stream import iter_ilastik
+    from .sweep import compute_sidecar, sweep_thresholds
+    from .work_queue import WorkQueue
 
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
+CHECK_UPDATES_ENV = "EASILASTIK_CHECK_UPDATES"
+
+# Public names and the submodule defining them, imported on first access
+_LAZY_ATTRIBUTES = {
+    "BatchError": ".errors",
+    "BatchStatistics": ".statistics",
+    "FailureIsolation": ".isolation",
+    "IlastikSession": ".session",
+    "ResultCache": ".cache",
+    "RunMetrics": ".metrics",
+    "WorkQueue": ".work_queue",
+    "color_treshold_array": ".arrays",
+    "color_treshold_probabilities": ".run_ilastik",
+    "compact_probabilities": ".compact",
+    "compute_sidecar": ".sweep",
+    "iter_ilastik": ".stream",
+    "run_ilastik": ".run_ilastik",
+    "run_ilastik_async": ".aio",
+    "run_ilastik_models": ".multi_model",
+    "run_ilastik_probabilities": ".run_ilastik",
+    "run_ilastik_probabilities_async": ".aio",
+    "segment_arrays": ".arrays",
+    "set_max_processes": ".aio",
+    "sweep_thresholds": ".sweep",
+}
+
+__all__ = [
+    "BatchError",
+    "BatchStatistics",
+    "FailureIsolation",
+    "IlastikSession",
+    "ResultCache",
+    "RunMetrics",
+    "WorkQueue",
+    "check_for_update",
+    "color_treshold_array",
+    "color_treshold_probabilities",
+    "compact_probabilities",
+    "compute_sidecar",
+    "iter_ilastik",
+    "run_ilastik",
+    "run_ilastik_async",
+    "run_ilastik_models",
+    "run_ilastik_probabilities",
+    "run_ilastik_probabilities_async",
+    "segment_arrays",
+    "set_max_processes",
+    "sweep_thresholds",
+]
+
+
+def __getattr__(name: str) -> object:
+    """Import the submodule defining a public name the first time it is accessed."""
+    if name == "__version__":  # noqa: PLR2004
+        from importlib.metadata import version  # noqa: PLC0415
+
+        value = version(__name__)
+    elif name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    else:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    """List the public names, including the ones not imported yet."""
+    return sorted({*globals(), *_LAZY_ATTRIBUTES, "__version__"})
+
+
+def check_for_update(*, interactive: bool = True) -> None:
+    """
+    Check if an update is available.
+
+    Parameters
+    ----------
+    interactive : bool, optional
+        Whether to offer to install the update. The question is only asked if the standard input is a terminal.
+        Default is True.
+    """
+    try:
+        from importlib.metadata import version  # noqa: PLC0415
 
-__version__ = version(__name__)
-__all__ = ["color_treshold_probabilities", "run_ilastik", "run_ilastik_probabilities"]
-
+        import requests  # noqa: PLC0415
 
-def check_for_update() -> None:
-    """Check if an update is available."""
-    try:
-        current_version = __version__
+        current_version = version(__name__)
         if current_version == "unknown":  # noqa: PLR2004
             return  # Exit if the installed version cannot be obtained
 
@@ -52,7 +146,9 @@ def check_for_update() -> None:
         latest_version = package_data["info"]["version"]
 
         if latest_version != current_version:
-            logger.info("A new version of your package is available!")
+            logger.info("A new version of your package is available! (%s -> %s)", current_version, latest_version)
+            if not interactive or not sys.stdin.isatty():
+                return
             user_input = input("Do you want to install the update? (yes/y to confirm): ").strip().lower()
             if user_input in {"yes", "y"}:
                 subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "easilastik"])  # noqa: S603
@@ -63,5 +159,6 @@ def check_for_update() -> None:
         logger.exception("An error occurred while checking for updates")
 
 
-# Call the update check function at the start of the package
-check_for_update()
+# Opt-in update check, in the background so that the import never waits for the network
+if os.environ.get(CHECK_UPDATES_ENV) == "1":  # noqa: PLR2004
+    threading.Thread(target=check_for_update, kwargs={"interactive": False}, daemon=True).start()
@@ -0,0 +1,518 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Run Ilastik from an asyncio event loop.
+
+`run_ilastik_async` and `run_ilastik_probabilities_async` are the counterparts of `run_ilastik` and
+`run_ilastik_probabilities` for asyncio applications. Ilastik runs in asyncio subprocesses, and the discovery of the
+images, the checks of the outputs and the coloring of the probabilities run in threads, so that the event loop is
+never blocked. The number of Ilastik processes running at the same time is limited by a semaphore shared by all the
+calls made from the same event loop, one by default (see `set_max_processes`). Cancelling a call terminates its
+Ilastik processes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.discovery import IMAGE_EXTENSIONS
+from easilastik.errors import BatchError
+from easilastik.find_ilastik import find_ilastik
+from easilastik.metrics import measure_run
+from easilastik.parallel import get_shard_env, shard_paths
+from easilastik.pipeline import POLL_INTERVAL, OutputWatcher
+from easilastik.run_ilastik import (
+    build_ilastik_args,
+    check_arguments,
+    get_probability_files,
+    get_probability_processor,
+    prepare_images,
+)
+from easilastik.utils import get_output_path, split_command_line
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    from easilastik.cache import ResultCache
+    from easilastik.metrics import RunMetrics
+    from easilastik.statistics import BatchStatistics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Ilastik processes running at the same time for all the calls of an event loop, see `set_max_processes`. Each one
+# uses all the CPUs and RAM by default, so the default is conservative.
+DEFAULT_MAX_PROCESSES = 1
+
+# Seconds given to Ilastik to exit once asked to, before it is killed
+TERMINATE_TIMEOUT = 10.0
+
+_max_processes = DEFAULT_MAX_PROCESSES
+_limiters = weakref.WeakKeyDictionary()
+
+
+def set_max_processes(max_processes: int) -> None:
+    """
+    Set the number of Ilastik processes the calls of an event loop may run at the same time.
+
+    Parameters
+    ----------
+    max_processes : int
+        The number of Ilastik processes. Default is 1. Calls already waiting for a process keep the previous limit.
+
+    Raises
+    ------
+    ValueError
+        If max_processes is less than 1.
+    """
+    global _max_processes  # noqa: PLW0603
+
+    if max_processes < 1:
+        msg = f"max_processes must be a positive integer, got {max_processes}"
+        raise ValueError(msg)
+    _max_processes = max_processes
+    _limiters.clear()
+
+
+def get_limiter() -> asyncio.Semaphore:
+    """
+    Return the semaphore shared by the calls of the running event loop.
+
+    Returns
+    -------
+    asyncio.Semaphore
+        The semaphore limiting the number of Ilastik processes of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = asyncio.Semaphore(_max_processes)
+    return limiter
+
+
+async def terminate_process(process: asyncio.subprocess.Process) -> None:
+    """
+    Ask a process to exit, and kill it if it does not within TERMINATE_TIMEOUT seconds.
+
+    Parameters
+    ----------
+    process : asyncio.subprocess.Process
+        The process.
+    """
+    if process.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError):
+        process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Ilastik did not exit within %s seconds, killing it.", TERMINATE_TIMEOUT)
+        process.kill()
+        await process.wait()
+    except asyncio.CancelledError:
+        # Cancelled again while waiting, do not wait any longer
+        process.kill()
+        raise
+
+
+def report_complete(watcher: OutputWatcher, returncode: int | None, on_output: Callable[[str], object]) -> None:
+    """Call on_output with the path of each output completed since the last check."""
+    for index in watcher.poll(returncode):
+        on_output(watcher.output_paths[index])
+
+
+async def run_process_async(
+    ilastik_args: list,
+    *,
+    env: dict | None = None,
+    limiter: asyncio.Semaphore | None = None,
+    output_paths: list | None = None,
+    on_output: Callable[[str], object] | None = None,
+    poll_interval: float = POLL_INTERVAL,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Execute an Ilastik command line in an asyncio subprocess.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line, as built by `build_ilastik_args`.
+    env : dict, optional
+        The environment of the Ilastik process. Default is the current environment.
+    limiter : asyncio.Semaphore, optional
+        The semaphore held while the process runs. Default is the one shared by the calls of the event loop.
+    output_paths : list, optional
+        The paths of the files Ilastik writes, in the order of the images on the command line. Required with
+        on_output.
+    on_output : Callable[[str], object], optional
+        Called in a thread with the path of each output file as soon as it is complete (see `run_watched`).
+    poll_interval : float, optional
+        The number of seconds between two checks of the output files. Default is 0.2.
+    metrics : RunMetrics, optional
+        The metrics receiving the duration of the process.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution. The outputs of the images processed before the error
+        have already been reported.
+    asyncio.CancelledError
+        If the call is cancelled, once Ilastik is terminated.
+    """
+    async with limiter or get_limiter():
+        # Files left by a previous run must not be taken for the outputs of this run
+        watcher = None if on_output is None else await asyncio.to_thread(OutputWatcher, output_paths)
+        start_time = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(*ilastik_args, env=env)
+        wait_task = asyncio.ensure_future(process.wait())
+        try:
+            while True:
+                await asyncio.wait({wait_task}, timeout=None if watcher is None else poll_interval)
+                returncode = wait_task.result() if wait_task.done() else None
+                if watcher is not None:
+                    await asyncio.to_thread(report_complete, watcher, returncode, on_output)
+                if returncode is not None:
+                    break
+        finally:
+            # Do not leave Ilastik running if the call failed or was cancelled
+            await terminate_process(process)
+            wait_task.cancel()
+
+    if metrics is not None:
+        n_images = 0 if output_paths is None else len(output_paths)
+        metrics.add_process(n_images, returncode, time.perf_counter() - start_time, None)
+    if returncode != 0:
+        logger.error("Error during conversion: Ilastik exited with code %d", returncode)
+        msg = "Error during Ilastik execution. See console output for details."
+        raise RuntimeError(msg)
+
+
+async def run_ilastik_async(  # noqa: PLR0913
+    input_path: str,
+    model_path: str,
+    result_base_path: str,
+    ilastik_script_path: str | None = None,
+    export_source: str = "Simple Segmentation",
+    output_format: str = "png",
+    *,
+    workers: int = 1,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    on_output: Callable[[str], object] | None = None,
+    cache: ResultCache | None = None,
+    resume: bool = False,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    limiter: asyncio.Semaphore | None = None,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Execute Ilastik in headless mode without blocking the event loop, see `run_ilastik`.
+
+    The session, tile_size, tile_halo and isolation arguments of `run_ilastik` are not supported, nor workers='auto'.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the result will be saved.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    export_source : str, optional
+        The type of data to export. Default is "Simple Segmentation".
+    output_format : str, optional
+        The format of the output file. Default is "png".
+    workers : int, optional
+        The number of shards of the images, each one processed by its own Ilastik process. Default is 1. The
+        processes also wait for the limiter, so at most `set_max_processes` of them run at the same time: raise it
+        for the shards to run in parallel.
+    threads_per_worker : int, optional
+        The number of threads of each Ilastik process when workers is greater than 1, see `run_ilastik`.
+    ram_per_worker_mb : int, optional
+        The amount of RAM in MB of each Ilastik process when workers is greater than 1, see `run_ilastik`.
+    on_output : Callable[[str], object], optional
+        Called in the event loop with the path of each output file as soon as it is complete, while Ilastik
+        processes the next images. It should return quickly, e.g. by creating a task; the errors it raises are
+        reported by the event loop.
+    cache : ResultCache, optional
+        A cache of the outputs, see `run_ilastik`.
+    resume : bool, optional
+        Whether to skip the images already processed by a previous run, see `run_ilastik`. Default is False.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the input folder to process, see `run_ilastik`.
+    limiter : asyncio.Semaphore, optional
+        The semaphore held by each Ilastik process. Default is the one shared by the calls of the event loop.
+    metrics : RunMetrics, optional
+        Collects the duration of each stage of the run, see `run_ilastik`. The resource usage of the Ilastik
+        processes is not available with asyncio subprocesses.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the input_path does not exist.
+    ValueError
+        If the export_source or output_format is not valid, or if on_output, cache or resume is combined with a
+        format written as several files.
+    RuntimeError
+        If there is an error during the Ilastik execution. With several workers, a `BatchError` listing the
+        failed shards is raised once all the shards are done.
+    asyncio.CancelledError
+        If the call is cancelled, once its Ilastik processes are terminated.
+    """
+    if workers < 1:
+        msg = f"workers must be a positive integer, got {workers}"
+        raise ValueError(msg)
+
+    ilastik_script_path = ilastik_script_path or await asyncio.to_thread(find_ilastik)
+    if ilastik_script_path is None:
+        logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
+        return
+
+    # The input path is checked on the file system
+    await asyncio.to_thread(
+        check_arguments,
+        input_path,
+        export_source,
+        output_format,
+        single_file=on_output is not None or cache is not None or resume,
+    )
+
+    # Create result_base_path if it does not exist
+    await asyncio.to_thread(Path(result_base_path).mkdir, parents=True, exist_ok=True)
+
+    if on_output is not None:
+        # The outputs are checked in threads, the function is called back in the event loop
+        on_output = functools.partial(asyncio.get_running_loop().call_soon_threadsafe, on_output)
+
+    with measure_run(metrics, result_base_path):
+        image_arg, on_output = await asyncio.to_thread(
+            prepare_images,
+            input_path,
+            model_path,
+            result_base_path,
+            export_source,
+            output_format,
+            on_output,
+            cache=cache,
+            resume=resume,
+            extensions=extensions,
+            metrics=metrics,
+        )
+        logger.info("Processing %d images.", len(image_arg))
+        logger.debug("image_arg: %s", image_arg)
+
+        if image_arg:
+            ilastik_args = build_ilastik_args(
+                ilastik_script_path, model_path, result_base_path, export_source, output_format, []
+            )
+
+            async def run_shard(shard: list, env: dict | None = None) -> None:
+                for batch in split_command_line(ilastik_args, shard):
+                    output_paths = [
+                        get_output_path(result_base_path, path, export_source, output_format) for path in batch
+                    ]
+                    await run_process_async(
+                        [*ilastik_args, *(str(path) for path in batch)],
+                        env=env,
+                        limiter=limiter,
+                        output_paths=output_paths,
+                        on_output=on_output,
+                        metrics=metrics,
+                    )
+
+            if workers > 1 and len(image_arg) > 1:
+                shards = shard_paths(image_arg, workers)
+                env = get_shard_env(len(shards), threads_per_worker, ram_per_worker_mb)
+                await gather_shards(shards, [run_shard(shard, env) for shard in shards])
+            else:
+                await run_shard(image_arg)
+
+    msg = f"Conversion of {input_path} completed successfully."
+    logger.info(msg)
+
+
+async def gather_shards(shards: list, coroutines: list) -> None:
+    """
+    Run the coroutines processing the shards of the images concurrently, and wait for all of them.
+
+    Parameters
+    ----------
+    shards : list
+        The paths of the images of each shard.
+    coroutines : list
+        The coroutine processing each shard.
+
+    Raises
+    ------
+    BatchError
+        If some of the shards failed, once all the shards are done.
+    """
+    # Cancelling the call cancels every shard, each one terminating its Ilastik process
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    errors = {}
+    for index, (shard, result) in enumerate(zip(shards, results, strict=True)):
+        if isinstance(result, BaseException):
+            logger.error("Error during conversion of shard %d: %s", index, result)
+            errors[tuple(str(path) for path in shard)] = result
+    if errors:
+        msg = f"Error during Ilastik execution of {len(errors)}/{len(shards)} shards. See console output for details."
+        raise BatchError(msg, errors)
+
+
+def get_other_files(result_base_path: str, colored_paths: list) -> list:
+    """Return the probability files of result_base_path which are not in colored_paths."""
+    colored = {Path(path).resolve() for path in colored_paths}
+    return [file for file in get_probability_files(result_base_path) if Path(file).resolve() not in colored]
+
+
+async def run_ilastik_probabilities_async(  # noqa: PLR0913
+    input_path: str,
+    model_path: str,
+    result_base_path: str,
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    *,
+    deletion: bool = True,
+    ilastik_script_path: str | None = None,
+    workers: int = 1,
+    max_memory_mb: float | None = None,
+    threshold_workers: int = 1,
+    cache: ResultCache | None = None,
+    resume: bool = False,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    compact: str | None = None,
+    limiter: asyncio.Semaphore | None = None,
+    statistics: BatchStatistics | None = None,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Execute Ilastik and color the probabilities without blocking the event loop, see `run_ilastik_probabilities`.
+
+    Each probability file is colored in a thread pool as soon as Ilastik has written it. The session, color_format,
+    png_compression, encode_workers, tile_size, tile_halo and isolation arguments of `run_ilastik_probabilities` are
+    not supported, nor workers='auto'.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the result will be saved.
+    threshold : float
+        The threshold above which a channel's value must be for the pixel to take its color.
+    below_threshold_color : list
+        The color for pixels where the maximum value is below the threshold.
+    channel_colors : list
+        The colors for the channels.
+    deletion : bool, optional
+        If True, each probability file is deleted once colored. Default is True.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    workers : int, optional
+        The number of shards of the images, see `run_ilastik_async`. Default is 1.
+    max_memory_mb : float, optional
+        The memory budget of the coloring, see `process_single_file`. Default is None.
+    threshold_workers : int, optional
+        The number of threads coloring the probability files. Default is 1.
+    cache : ResultCache, optional
+        A cache of the probability files, see `run_ilastik`.
+    resume : bool, optional
+        Whether to skip the images already processed by a previous run, see `run_ilastik_probabilities`.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the input folder to process, see `run_ilastik`.
+    compact : str, optional
+        The data type the probability files are compacted to before being colored, see
+        `run_ilastik_probabilities`. Default is None.
+    limiter : asyncio.Semaphore, optional
+        The semaphore held by each Ilastik process. Default is the one shared by the calls of the event loop.
+    statistics : BatchStatistics, optional
+        Collects the pixel statistics of each image, see `run_ilastik_probabilities`.
+    metrics : RunMetrics, optional
+        Collects the duration of each stage, see `run_ilastik_probabilities`.
+
+    Raises
+    ------
+    ValueError
+        If the colors or compact are not valid.
+    BatchError
+        If some probability files could not be colored. The `errors` attribute maps each failed file to its error.
+    asyncio.CancelledError
+        If the call is cancelled, once its Ilastik processes are terminated and the files being colored are
+        done. The files not colored yet are left for the next run.
+    """
+    from easilastik.encoder import ColorOutput  # noqa: PLC0415
+
+    # Check the colors before running Ilastik rather than once the probabilities are computed
+    process_file = get_probability_processor(
+        threshold,
+        below_threshold_color,
+        channel_colors,
+        deletion=deletion,
+        max_memory_mb=max_memory_mb,
+        output=ColorOutput(statistics=statistics),
+        compact=compact,
+        metrics=metrics,
+    )
+
+    loop = asyncio.get_running_loop()
+    submitted = {}
+    executor = ThreadPoolExecutor(max_workers=threshold_workers)
+
+    def on_output(output_path: str) -> None:
+        submitted[loop.run_in_executor(executor, process_file, output_path)] = output_path
+
+    with measure_run(metrics, result_base_path):
+        try:
+            # Run Ilastik to create h5 files, each one being colored as soon as it is complete
+            await run_ilastik_async(
+                input_path,
+                model_path,
+                result_base_path,
+                ilastik_script_path,
+                export_source="Probabilities",
+                output_format="hdf5",
+                workers=workers,
+                on_output=on_output,
+                cache=cache,
+                resume=resume,
+                extensions=extensions,
+                limiter=limiter,
+                metrics=metrics,
+            )
+
+            # Also color the other h5 files of the folder, e.g. the ones left by a previous run
+            for file in await asyncio.to_thread(get_other_files, result_base_path, list(submitted.values())):
+                on_output(file)
+        except asyncio.CancelledError:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            # Like run_ilastik_probabilities, wait for the files being colored even if Ilastik failed. The files
+            # are taken before awaiting, as outputs reported meanwhile would be added to submitted.
+            futures, output_paths = list(submitted), list(submitted.values())
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            executor.shutdown(wait=False)
+
+        errors = {}
+        for output_path, result in zip(output_paths, results, strict=True):
+            if isinstance(result, Exception):
+                logger.error("Error while processing %s: %s", output_path, result)
+                errors[output_path] = result
+        if errors:
+            msg = f"Error during the thresholding of {len(errors)} files. See console output for details."
+            raise BatchError(msg, errors)
@@ -0,0 +1,183 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Segment images held in memory as NumPy arrays.
+
+The arrays are staged as uncompressed .npy files in a temporary directory, in RAM (`/dev/shm`) when available, and
+Ilastik exports its results to uncompressed HDF5 files in the same directory. Each result is read back as soon as
+Ilastik has written it and its file is deleted, so that no image is encoded or decoded on the way and the staging
+directory never holds more than the inputs and one result. The directory is removed when the call returns.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import h5py
+import numpy as np
+
+from easilastik.colorize import check_colors, get_engine, get_palette
+from easilastik.run_ilastik import run_ilastik
+from easilastik.utils import get_output_path
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from easilastik.session import IlastikSession
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+RAM_DIRECTORIES = ["/dev/shm"]  # noqa: S108
+
+
+def get_staging_root() -> str | None:
+    """
+    Return the directory in which the temporary files are staged.
+
+    Returns
+    -------
+    str | None
+        A RAM-backed directory if one is available and writable, else None (the default temporary directory).
+    """
+    for directory in RAM_DIRECTORIES:
+        if Path(directory).is_dir() and os.access(directory, os.W_OK):
+            return directory
+    return None
+
+
+def segment_arrays(
+    arrays: Iterable[np.ndarray],
+    model_path: str,
+    export_source: str = "Simple Segmentation",
+    *,
+    ilastik_script_path: str | None = None,
+    session: IlastikSession | None = None,
+    workers: int = 1,
+    staging_dir: str | None = None,
+) -> list:
+    """
+    Process images held in memory with Ilastik.
+
+    Parameters
+    ----------
+    arrays : Iterable[np.ndarray]
+        The images, with the same axes as the images the project was trained on (e.g. (y, x) for grayscale
+        images or (y, x, c) for color images).
+    model_path : str
+        The path to the Ilastik project file.
+    export_source : str, optional
+        The type of data to export. Default is "Simple Segmentation". Must be one of
+        ["Probabilities", "Simple Segmentation", "Uncertainty", "Features", "Labels"].
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    session : IlastikSession, optional
+        A running Ilastik session with the project already loaded, used instead of a new Ilastik process.
+    workers : int, optional
+        The number of Ilastik processes to run concurrently. Default is 1.
+    staging_dir : str, optional
+        The directory in which the temporary files are created. Default is `/dev/shm` if available, else the
+        default temporary directory.
+
+    Returns
+    -------
+    list
+        The arrays exported by Ilastik, in the order of the input arrays, with the channels on the last axis
+        (e.g. (y, x, 1) uint8 labels for "Simple Segmentation" or (y, x, n_labels) float32 probabilities for
+        "Probabilities").
+
+    Raises
+    ------
+    RuntimeError
+        If Ilastik did not export the result of some of the arrays.
+    """
+    with tempfile.TemporaryDirectory(prefix="easilastik-", dir=staging_dir or get_staging_root()) as tmp_dir:
+        input_dir = Path(tmp_dir) / "inputs"
+        input_dir.mkdir()
+        result_base_path = str(Path(tmp_dir) / "outputs") + os.sep
+
+        # Uncompressed .npy files are written at memory speed and read by Ilastik without decoding
+        input_paths = []
+        for index, array in enumerate(arrays):
+            input_path = input_dir / f"{index:08d}.npy"
+            np.save(input_path, np.asarray(array), allow_pickle=False)
+            input_paths.append(input_path)
+        if not input_paths:
+            return []
+
+        results = {}
+
+        def read_output(output_path: str) -> None:
+            with h5py.File(output_path, "r") as f:
+                results[output_path] = f["exported_data"][()]
+            Path(output_path).unlink()
+
+        run_ilastik(
+            str(input_dir),
+            model_path,
+            result_base_path,
+            ilastik_script_path,
+            export_source=export_source,
+            output_format="hdf5",
+            session=session,
+            workers=workers,
+            on_output=read_output,
+        )
+
+        outputs = []
+        for index, input_path in enumerate(input_paths):
+            output_path = get_output_path(result_base_path, input_path, export_source, "hdf5")
+            if output_path not in results:
+                msg = f"Ilastik did not export the result of array {index}. See console output for details."
+                raise RuntimeError(msg)
+            outputs.append(results.pop(output_path))
+    return outputs
+
+
+def color_treshold_array(
+    probabilities: np.ndarray, threshold: float, below_threshold_color: list, channel_colors: list
+) -> np.ndarray:
+    """
+    Create a color image from probabilities held in memory.
+
+    Parameters
+    ----------
+    probabilities : np.ndarray
+        The probabilities, with the channels on the last axis (e.g. as returned by `segment_arrays` with
+        export_source="Probabilities").
+    threshold : float
+        Threshold value for color mapping. Pixels with maximum value greater than this threshold will be colored
+        according to the color map.
+    below_threshold_color : list
+        RGB color for values below the threshold. Must be a list of 3 integers between 0 and 255.
+    channel_colors : list
+        List of RGB colors for each channel. Each color must be a list of 3 integers between 0 and 255.
+
+    Returns
+    -------
+    np.ndarray
+        The color image as a numpy array in uint8 format, in BGR format like `color_treshold_probabilities`.
+
+    Raises
+    ------
+    ValueError
+        If below_threshold_color or channel_colors are not in the correct format, or if the length of
+        channel_colors does not match the number of channels of the probabilities.
+    """
+    check_colors(below_threshold_color, channel_colors)
+    if len(channel_colors) != probabilities.shape[-1]:
+        msg = (
+            "The length of channel_colors must be equal to the number of channels in the data (there must be as many "
+            f"colors as labels annotated in the Ilastik project). Expected {probabilities.shape[-1]}, "
+            f"got {len(channel_colors)}"
+        )
+        raise ValueError(msg)
+
+    color_image = np.empty((*probabilities.shape[:-1], 3), dtype=np.uint8)
+    palette = get_palette(below_threshold_color, channel_colors)
+    return get_engine().colorize(probabilities, threshold, palette, out=color_image)
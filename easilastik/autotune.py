@@ -0,0 +1,474 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Choose the number of Ilastik processes and their limits from the resources of the machine.
+
+With `workers="auto"`, the CPUs and memory available to the process are read (including the limits of the cgroup
+when running in a container), and the memory an Ilastik process needs is estimated from the dimensions of the
+largest images and from the project (number of labels and of selected features). The images are then processed in
+small batches by a pool of Ilastik processes whose size follows the estimate: each process gets its share of the
+CPUs (LAZYFLOW_THREADS) and the estimated memory (LAZYFLOW_TOTAL_RAM_MB). As processes exit, their peak memory
+replaces the estimate, so that the number of processes decreases if they need more memory than estimated and
+increases if they need less.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.errors import BatchError
+from easilastik.metrics import MAXRSS_BYTES, run_process
+from easilastik.parallel import get_total_ram_mb, get_worker_env
+from easilastik.utils import split_command_line
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from easilastik.metrics import RunMetrics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+# Memory of an Ilastik process before it loads any image, and share of the memory left to the rest of the system
+BASE_PROCESS_MB = 1024
+MEMORY_RESERVE = 0.1
+
+# Datasets of a pixel classification project holding its labels and its selected features, and defaults when the
+# project cannot be read
+LABEL_NAMES_KEY = "PixelClassification/LabelNames"
+SELECTION_MATRIX_KEY = "FeatureSelections/SelectionMatrix"
+DEFAULT_LABELS = 2
+DEFAULT_FEATURES = 13
+
+# Bytes per value of the features and predictions computed by Ilastik, and safety factor on the estimates
+FEATURE_BYTES = 4
+ESTIMATE_FACTOR = 1.5
+
+# Number of the largest images whose dimensions are read to estimate the memory of a process
+SAMPLE_SIZE = 8
+
+# Minimum number of threads of an Ilastik process, and number of batches per process so that the pool can adapt
+MIN_THREADS = 2
+BATCHES_PER_WORKER = 4
+
+# PNG color types and their number of channels
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+# JPEG markers starting a frame, whose header holds the dimensions of the image
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# TIFF tags holding the dimensions of the image, and the TIFF types of their values
+TIFF_WIDTH, TIFF_HEIGHT, TIFF_SAMPLES = 256, 257, 277
+TIFF_SHORT, TIFF_LONG, TIFF_LONG8 = 3, 4, 16
+
+
+def read_cgroup_file(name: str) -> str | None:
+    """
+    Read a file of the cgroup of the process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the file, relative to the cgroup folder (e.g. 'cpu.max' for cgroup v2 or
+        'cpu/cpu.cfs_quota_us' for cgroup v1).
+
+    Returns
+    -------
+    str | None
+        The content of the file, or None if there is no such file (e.g. outside of Linux).
+    """
+    folders = []
+    try:
+        for line in Path("/proc/self/cgroup").read_text(encoding="utf-8").splitlines():
+            hierarchy, _, path = line.split(":", 2)
+            if hierarchy == "0":  # noqa: PLR2004
+                folders.append(CGROUP_ROOT / path.lstrip("/"))
+    except (OSError, ValueError):
+        pass
+    # Inside a container, the cgroup of the process is mounted as the root
+    folders.append(CGROUP_ROOT)
+    paths = [folder / name for folder in folders if (folder / name).is_file()]
+    try:
+        return paths[0].read_text(encoding="utf-8").strip() if paths else None
+    except OSError:
+        return None
+
+
+def get_available_cpus() -> int:
+    """
+    Return the number of CPUs the process may use.
+
+    Returns
+    -------
+    int
+        The number of CPUs of the machine, limited to the affinity of the process and to the CPU quota of its
+        cgroup.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+    quota = period = None
+    if (cpu_max := read_cgroup_file("cpu.max")) is not None:
+        quota, _, period = cpu_max.partition(" ")
+    elif (cfs_quota := read_cgroup_file("cpu/cpu.cfs_quota_us")) is not None:
+        quota, period = cfs_quota, read_cgroup_file("cpu/cpu.cfs_period_us")
+    try:
+        if quota not in {None, "max", "-1"} and period:
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except ValueError:
+        pass
+    return cpus
+
+
+def get_available_memory_mb() -> int | None:
+    """
+    Return the amount of memory the process may use.
+
+    Returns
+    -------
+    int | None
+        The available memory of the machine in MB, limited to the memory left by the limit of the cgroup, or None
+        if it cannot be determined.
+    """
+    available_mb = None
+    try:
+        for line in Path("/proc/meminfo").read_text(encoding="utf-8").splitlines():
+            if line.startswith("MemAvailable:"):
+                available_mb = int(line.split()[1]) // 1024
+                break
+    except (OSError, ValueError):
+        available_mb = get_total_ram_mb()
+
+    limit = read_cgroup_file("memory.max") or read_cgroup_file("memory/memory.limit_in_bytes")
+    usage = read_cgroup_file("memory.current") or read_cgroup_file("memory/memory.usage_in_bytes")
+    try:
+        # cgroup v1 reports a huge number instead of "max" when there is no limit
+        if limit not in {None, "max"} and int(limit) < 2**60:
+            cgroup_mb = (int(limit) - int(usage or 0)) // 2**20
+            available_mb = cgroup_mb if available_mb is None else min(available_mb, cgroup_mb)
+    except ValueError:
+        pass
+    return available_mb
+
+
+def read_image_header(image_path: str) -> tuple | None:
+    """
+    Read the dimensions of an image from its header, without decoding it.
+
+    Parameters
+    ----------
+    image_path : str
+        The path of the image.
+
+    Returns
+    -------
+    tuple | None
+        The height, width and number of channels of PNG, JPEG, BMP and TIFF (including BigTIFF) images, or None for
+        the other formats or if the header cannot be read.
+    """
+    try:
+        with Path(image_path).open("rb") as f:
+            header = f.read(32)
+            if header.startswith(b"\x89PNG\r\n\x1a\n"):
+                width, height = struct.unpack(">II", header[16:24])
+                return height, width, PNG_CHANNELS.get(header[25], 1)
+            if header.startswith(b"BM"):
+                width, height = struct.unpack("<ii", header[18:26])
+                return abs(height), width, max(1, struct.unpack("<H", header[28:30])[0] // 8)
+            if header.startswith(b"\xff\xd8"):
+                return read_jpeg_header(f)
+            if header[:4] in {b"II*\x00", b"MM\x00*"}:
+                return read_tiff_header(f, "<" if header[:2] == b"II" else ">")  # noqa: PLR2004
+            if header[:4] in {b"II+\x00", b"MM\x00+"}:
+                return read_tiff_header(f, "<" if header[:2] == b"II" else ">", bigtiff=True)  # noqa: PLR2004
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def read_jpeg_header(f: object) -> tuple | None:
+    """Read the dimensions of a JPEG image from the header of its first frame."""
+    f.seek(2)
+    while (marker := f.read(2)) and marker[0] == 0xFF:
+        (length,) = struct.unpack(">H", f.read(2))
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width, channels = struct.unpack(">BHHB", f.read(6))
+            return height, width, channels
+        f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+
+def read_tiff_header(f: object, byte_order: str, *, bigtiff: bool = False) -> tuple | None:
+    """
+    Read the dimensions of a TIFF image from its first image file directory.
+
+    BigTIFF files, the usual container of gigapixel images, have 8-byte offsets, counts and values in their
+    directories instead of 4-byte ones.
+    """
+    # Offset of the first directory, then the number of its entries and the layout of an entry (tag, type, count,
+    # value); BigTIFF headers hold the size of the offsets and a reserved field before the first offset
+    if bigtiff:
+        f.seek(8)
+        (offset,) = struct.unpack(byte_order + "Q", f.read(8))
+        count_format, entry_format = "Q", "HHQ8s"
+    else:
+        f.seek(4)
+        (offset,) = struct.unpack(byte_order + "I", f.read(4))
+        count_format, entry_format = "H", "HHI4s"
+    f.seek(offset)
+    (n_entries,) = struct.unpack(byte_order + count_format, f.read(struct.calcsize(count_format)))
+    entry_size = struct.calcsize(byte_order + entry_format)
+    values = {}
+    for _ in range(n_entries):
+        tag, value_type, _, value = struct.unpack(byte_order + entry_format, f.read(entry_size))
+        if value_type == TIFF_SHORT:
+            values[tag] = struct.unpack(byte_order + "H", value[:2])[0]
+        elif value_type == TIFF_LONG:
+            values[tag] = struct.unpack(byte_order + "I", value[:4])[0]
+        elif value_type == TIFF_LONG8:
+            values[tag] = struct.unpack(byte_order + "Q", value)[0]
+    if TIFF_WIDTH not in values or TIFF_HEIGHT not in values:
+        return None
+    return values[TIFF_HEIGHT], values[TIFF_WIDTH], values.get(TIFF_SAMPLES, 1)
+
+
+def get_image_shape(image_path: str) -> tuple:
+    """
+    Return the dimensions of an image.
+
+    Parameters
+    ----------
+    image_path : str
+        The path of the image.
+
+    Returns
+    -------
+    tuple
+        The height, width and number of channels of the image, read from its header if possible, else by decoding
+        it. If the image cannot be decoded either, its size in bytes is taken as its number of pixels.
+    """
+    if (shape := read_image_header(image_path)) is not None:
+        return shape
+
+    import cv2  # noqa: PLC0415
+
+    image = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
+    if image is not None:
+        return image.shape[0], image.shape[1], 1 if image.ndim == 2 else image.shape[2]
+    return 1, Path(image_path).stat().st_size, 1
+
+
+def read_project_sizes(model_path: str) -> tuple:
+    """
+    Read the number of labels and of selected features of a pixel classification project.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to the Ilastik project file.
+
+    Returns
+    -------
+    tuple
+        The number of labels and the number of selected (feature, scale) pairs, or DEFAULT_LABELS and
+        DEFAULT_FEATURES for the values which cannot be read.
+    """
+    n_labels, n_features = DEFAULT_LABELS, DEFAULT_FEATURES
+    try:
+        import h5py  # noqa: PLC0415
+
+        with h5py.File(model_path, "r") as f:
+            if LABEL_NAMES_KEY in f:
+                n_labels = max(1, len(f[LABEL_NAMES_KEY]))
+            if SELECTION_MATRIX_KEY in f:
+                n_features = max(1, int(f[SELECTION_MATRIX_KEY][()].sum()))
+    except (OSError, ValueError):
+        logger.debug("Could not read the project %s, using the default sizes.", model_path)
+    return n_labels, n_features
+
+
+def estimate_process_mb(image_arg: list, model_path: str) -> int:
+    """
+    Estimate the memory an Ilastik process needs for the largest images of a list.
+
+    Parameters
+    ----------
+    image_arg : list
+        The paths of the images.
+    model_path : str
+        The path to the Ilastik project file.
+
+    Returns
+    -------
+    int
+        The estimated peak memory of an Ilastik process in MB: BASE_PROCESS_MB plus the features and predictions
+        of the largest image, the dimensions of the SAMPLE_SIZE largest files being read.
+    """
+    n_labels, n_features = read_project_sizes(model_path)
+    largest = sorted(image_arg, key=lambda path: Path(path).stat().st_size, reverse=True)[:SAMPLE_SIZE]
+    image_mb = 0.0
+    for image_path in largest:
+        height, width, channels = get_image_shape(image_path)
+        # The features of each input channel, the predictions and the exported result of each label
+        values_per_pixel = channels * (1 + n_features) + 2 * n_labels
+        image_mb = max(image_mb, height * width * values_per_pixel * FEATURE_BYTES / 2**20)
+    return int(BASE_PROCESS_MB + ESTIMATE_FACTOR * image_mb)
+
+
+class AutoScheduler:
+    """
+    Size a pool of Ilastik processes from the CPUs and memory available and the memory each process needs.
+
+    Parameters
+    ----------
+    process_mb : int
+        The estimated peak memory of an Ilastik process in MB.
+    cpus : int, optional
+        The number of CPUs to use. Default is the number available to the process (see `get_available_cpus`).
+    memory_mb : int, optional
+        The memory to use in MB. Default is the memory available to the process (see `get_available_memory_mb`)
+        less MEMORY_RESERVE.
+    """
+
+    def __init__(self, process_mb: int, *, cpus: int | None = None, memory_mb: int | None = None) -> None:
+        self.cpus = cpus or get_available_cpus()
+        if memory_mb is None and (available_mb := get_available_memory_mb()) is not None:
+            memory_mb = int(available_mb * (1 - MEMORY_RESERVE))
+        self.memory_mb = memory_mb
+        self.process_mb = process_mb
+        self.observed_mb = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        """The number of Ilastik processes which fit in the CPUs and memory."""
+        workers = max(1, self.cpus // MIN_THREADS)
+        if self.memory_mb is not None:
+            workers = min(workers, max(1, self.memory_mb // self.process_mb))
+        return workers
+
+    def get_env(self, workers: int) -> dict:
+        """
+        Build the environment of an Ilastik process of a pool.
+
+        Parameters
+        ----------
+        workers : int
+            The number of Ilastik processes of the pool.
+
+        Returns
+        -------
+        dict
+            The environment giving the process its share of the CPUs and the estimated memory of a process.
+        """
+        return get_worker_env(max(1, self.cpus // workers), self.process_mb)
+
+    def observe(self, peak_rss_mb: float) -> None:
+        """
+        Update the memory estimate with the peak memory of a process which exited.
+
+        Parameters
+        ----------
+        peak_rss_mb : float
+            The peak resident memory of the process in MB.
+        """
+        with self._lock:
+            self.observed_mb = max(self.observed_mb or 0, peak_rss_mb)
+            process_mb = int(self.observed_mb * ESTIMATE_FACTOR)
+            if process_mb != self.process_mb:
+                logger.debug("Memory of an Ilastik process: %d MB (estimated %d MB).", process_mb, self.process_mb)
+            self.process_mb = max(1, process_mb)
+
+
+def run_auto(
+    ilastik_args: list,
+    image_arg: list,
+    model_path: str,
+    *,
+    on_batch: Callable[[list], object] | None = None,
+    metrics: RunMetrics | None = None,
+    cpus: int | None = None,
+    memory_mb: int | None = None,
+) -> None:
+    """
+    Execute Ilastik on a list of images with a pool of processes sized from the available resources.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line without the images.
+    image_arg : list
+        The paths of the images to process.
+    model_path : str
+        The path to the Ilastik project file, read to estimate the memory of a process.
+    on_batch : Callable[[list], object], optional
+        Called from the thread of a process with the paths of the images of each command line once Ilastik has
+        processed them.
+    metrics : RunMetrics, optional
+        The metrics receiving the resource usage of each Ilastik process.
+    cpus : int, optional
+        The number of CPUs to use, see `AutoScheduler`.
+    memory_mb : int, optional
+        The memory to use in MB, see `AutoScheduler`.
+
+    Raises
+    ------
+    BatchError
+        If Ilastik failed on some of the batches. The `errors` attribute maps each failed batch (a tuple of paths)
+        to its error, the other batches are processed completely.
+    """
+    scheduler = AutoScheduler(estimate_process_mb(image_arg, model_path), cpus=cpus, memory_mb=memory_mb)
+    # Small batches let the pool resize as processes exit, at the cost of loading the project more often
+    batch_size = max(1, -(-len(image_arg) // (scheduler.workers * BATCHES_PER_WORKER)))
+    batches = [
+        command_batch
+        for start in range(0, len(image_arg), batch_size)
+        for command_batch in split_command_line(ilastik_args, image_arg[start : start + batch_size])
+    ]
+    logger.info(
+        "Auto scheduling: %d CPUs, %s MB of memory, %d MB per Ilastik process, up to %d processes for %d batches.",
+        scheduler.cpus,
+        scheduler.memory_mb,
+        scheduler.process_mb,
+        scheduler.workers,
+        len(batches),
+    )
+
+    def run_batch(batch: list, env: dict) -> None:
+        batch_args = [*ilastik_args, *(str(path) for path in batch)]
+        usage = run_process(batch_args, env=env, metrics=metrics, n_images=len(batch))
+        if usage is not None:
+            scheduler.observe(usage.ru_maxrss * MAXRSS_BYTES / 2**20)
+        if on_batch is not None:
+            on_batch(batch)
+
+    errors = {}
+    running = {}
+    pending = iter(batches)
+    with ThreadPoolExecutor(max_workers=scheduler.cpus) as executor:
+        while True:
+            workers = scheduler.workers
+            while len(running) < workers and (batch := next(pending, None)) is not None:
+                running[executor.submit(run_batch, batch, scheduler.get_env(workers))] = batch
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = running.pop(future)
+                if (error := future.exception()) is not None:
+                    logger.error("Error during conversion of %d images: %s", len(batch), error)
+                    errors[tuple(str(path) for path in batch)] = error
+
+    if errors:
+        msg = (
+            f"Error during Ilastik execution of {len(errors)}/{len(batches)} batches. See console output for details."
+        )
+        raise BatchError(msg, errors)
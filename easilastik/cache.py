@@ -0,0 +1,406 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Keep the outputs of Ilastik on disk to skip the images already processed with the same project.
+
+Each output is stored under a key hashing the bytes of the input image, the bytes of the project file, the export
+source and the output format, so that renamed or moved images are still found and a retrained project never
+serves stale results. The stored files are indexed in a SQLite database recording their size, their checksum and
+when they were last used, which is used to evict the least recently used outputs beyond the size limit.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.find_ilastik import get_cache_file
+from easilastik.utils import get_output_path
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE_MB = 10240
+HASH_CHUNK_SIZE = 2**20
+KEY_VERSION = b"easilastik-cache-1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    suffix TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The hexadecimal checksum of the content of the file.
+    """
+    digest = hashlib.sha256()
+    with Path(file_path).open("rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of Ilastik outputs, keyed by the content of the images and of the project.
+
+    Pass it to `run_ilastik` (or `run_ilastik_probabilities`) with the `cache` argument: the outputs of the images
+    already processed are hard-linked (or copied) into the result folder, and only the other images are sent to
+    Ilastik, whose outputs are then added to the cache.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        The directory of the cache. Default is the `easilastik/results` folder of the user cache directory.
+    max_size_mb : float, optional
+        The maximum total size of the stored outputs in MB. The least recently used outputs are evicted beyond
+        it. Default is 10240.
+    link : bool, optional
+        Whether to serve the outputs as hard links to the stored files rather than copies, when the result folder
+        is on the same filesystem. Hard links are faster and do not use more space, but an output modified in
+        place also modifies the stored file (which is then detected and evicted by the integrity check).
+        Default is True.
+    verify : bool, optional
+        Whether to check the checksum of the stored files before serving them. Their size is always checked.
+        Default is True.
+
+    Examples
+    --------
+    >>> cache = ResultCache(max_size_mb=2000)
+    >>> run_ilastik("images/", "path/to/model.ilp", "results/", cache=cache)
+    >>> cache.stats()
+    {'hits': 120, 'misses': 3, 'bytes_saved': 251658240, 'entries': 123, 'size_bytes': 257949696}
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | None = None,
+        *,
+        max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+        link: bool = True,
+        verify: bool = True,
+    ) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_file().parent / "results"
+        self.max_size_bytes = int(max_size_mb * 2**20)
+        self.link = link
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        self._lock = threading.Lock()
+        self._model_digests = {}
+        (self.cache_dir / "objects").mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open the index, shared by all the processes using the cache directory, in a transaction."""
+        db = sqlite3.connect(self.cache_dir / "index.sqlite", timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _object_path(self, key: str, suffix: str) -> Path:
+        """Return the path of a stored output."""
+        return self.cache_dir / "objects" / key[:2] / f"{key}{suffix}"
+
+    def get_model_digest(self, model_path: str) -> str:
+        """
+        Return the checksum of a project file, computed once for each version of the file.
+
+        Parameters
+        ----------
+        model_path : str
+            The path to the Ilastik project file.
+
+        Returns
+        -------
+        str
+            The hexadecimal checksum of the project file.
+        """
+        stat = Path(model_path).stat()
+        version = (str(Path(model_path).resolve()), stat.st_size, stat.st_mtime_ns)
+        if version not in self._model_digests:
+            self._model_digests[version] = hash_file(model_path)
+        return self._model_digests[version]
+
+    def get_key(self, image_path: str, model_path: str, export_source: str, output_format: str) -> str:
+        """
+        Return the key of the output of an image.
+
+        Parameters
+        ----------
+        image_path : str
+            The path of the input image.
+        model_path : str
+            The path to the Ilastik project file.
+        export_source : str
+            The type of data exported.
+        output_format : str
+            The format of the output file.
+
+        Returns
+        -------
+        str
+            The hexadecimal key, which only depends on the contents of the image and of the project file, the
+            export source and the output format.
+        """
+        parts = [
+            KEY_VERSION,
+            self.get_model_digest(model_path).encode(),
+            export_source.encode(),
+            output_format.encode(),
+            hash_file(image_path).encode(),
+        ]
+        return hashlib.sha256(b"\0".join(parts)).hexdigest()
+
+    def get(self, key: str, output_path: str) -> bool:
+        """
+        Write a stored output to a path.
+
+        Parameters
+        ----------
+        key : str
+            The key of the output, as returned by `get_key`.
+        output_path : str
+            The path where the output is written, replacing any existing file.
+
+        Returns
+        -------
+        bool
+            Whether the output was in the cache. Stored files failing the integrity check are evicted and
+            reported as missing.
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT suffix, size, checksum FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count(hit=False)
+            return False
+
+        suffix, size, checksum = row
+        object_path = self._object_path(key, suffix)
+        try:
+            valid = object_path.stat().st_size == size and (not self.verify or hash_file(object_path) == checksum)
+        except OSError:
+            valid = False
+        if not valid:
+            logger.warning("The cached output %s is corrupted, it is evicted.", object_path)
+            self._remove(key, suffix)
+            self._count(hit=False)
+            return False
+
+        self._place(object_path, Path(output_path), link=self.link)
+        with self._connect() as db:
+            db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._count(hit=True, size=size)
+        return True
+
+    def put(self, key: str, output_path: str) -> None:
+        """
+        Store an output.
+
+        Parameters
+        ----------
+        key : str
+            The key of the output, as returned by `get_key`.
+        output_path : str
+            The path of the output written by Ilastik. It is copied, so that it can be modified or deleted
+            afterwards.
+        """
+        suffix = Path(output_path).suffix
+        object_path = self._object_path(key, suffix)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        self._place(Path(output_path), object_path, link=False)
+        size = object_path.stat().st_size
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, suffix, size, checksum, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, suffix, size, hash_file(object_path), time.time()),
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used outputs until the cache fits in its size limit."""
+        with self._connect() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_size_bytes:
+                return
+            rows = db.execute("SELECT key, suffix, size FROM entries ORDER BY last_used").fetchall()
+        for key, suffix, size in rows:
+            if total <= self.max_size_bytes:
+                break
+            self._remove(key, suffix)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove all the stored outputs."""
+        with self._connect() as db:
+            rows = db.execute("SELECT key, suffix FROM entries").fetchall()
+        for key, suffix in rows:
+            self._remove(key, suffix)
+
+    def stats(self) -> dict:
+        """
+        Return the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            'hits', 'misses' and 'bytes_saved' (the size of the outputs served from the cache) since this object
+            was created, and 'entries' and 'size_bytes', the number and total size of the stored outputs.
+        """
+        with self._connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def _count(self, *, hit: bool, size: int = 0) -> None:
+        """Update the statistics, which may be shared by several threads."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+            else:
+                self.misses += 1
+
+    def _remove(self, key: str, suffix: str) -> None:
+        """Remove a stored output and its entry."""
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._object_path(key, suffix).unlink(missing_ok=True)
+
+    @staticmethod
+    def _place(source: Path, destination: Path, *, link: bool) -> None:
+        """Atomically replace destination with a hard link to, or a copy of, source."""
+        tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            if link:
+                try:
+                    tmp_path.hardlink_to(source)
+                except OSError:
+                    shutil.copyfile(source, tmp_path)
+            else:
+                shutil.copyfile(source, tmp_path)
+            tmp_path.replace(destination)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def serve_from_cache(
+    cache: ResultCache,
+    image_arg: list,
+    model_path: str,
+    result_base_path: str,
+    export_source: str,
+    output_format: str,
+    on_output: Callable[[str], object] | None,
+) -> tuple[list, Callable[[str], object]]:
+    """
+    Write the cached outputs of a list of images and prepare the storage of the other ones.
+
+    Parameters
+    ----------
+    cache : ResultCache
+        The cache.
+    image_arg : list
+        The paths of the images to process.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results are saved.
+    export_source : str
+        The type of data exported.
+    output_format : str
+        The format of the output files.
+    on_output : Callable[[str], object] | None
+        The function called with the path of each output file, if any. It is called for the outputs served from
+        the cache.
+
+    Returns
+    -------
+    tuple[list, Callable[[str], object]]
+        The images missing from the cache, and the function to call with the path of each output written by
+        Ilastik for them: it stores the output in the cache, then calls on_output.
+    """
+    images_by_output = group_by_output(image_arg, result_base_path, export_source, output_format)
+    missing = {}
+    for image_path in image_arg:
+        output_path = get_output_path(result_base_path, image_path, export_source, output_format)
+        key = cache.get_key(image_path, model_path, export_source, output_format)
+        if len(images_by_output[output_path]) == 1 and cache.get(key, output_path):
+            if on_output is not None:
+                on_output(output_path)
+        else:
+            missing[image_path] = key
+            # Ilastik overwrites its outputs in place, which must not modify a stored file linked there before
+            with contextlib.suppress(OSError):
+                if Path(output_path).stat().st_nlink > 1:
+                    Path(output_path).unlink()
+
+    logger.info("%d/%d outputs served from the cache.", len(image_arg) - len(missing), len(image_arg))
+
+    def store(output_path: str) -> None:
+        image_paths = images_by_output.get(output_path, [])
+        if len(image_paths) == 1 and image_paths[0] in missing:
+            cache.put(missing[image_paths[0]], output_path)
+        if on_output is not None:
+            on_output(output_path)
+
+    return list(missing), store
+
+
+def group_by_output(image_arg: list, result_base_path: str, export_source: str, output_format: str) -> dict:
+    """Group the images by the path of their output, warning about the outputs written for several images.
+
+    Images with the same stem (e.g. a.png and a.tif) are written to the same output, which only holds the last
+    one written by Ilastik: it can neither be served from nor stored in the cache.
+    """
+    images_by_output = {}
+    for image_path in image_arg:
+        output_path = get_output_path(result_base_path, image_path, export_source, output_format)
+        images_by_output.setdefault(output_path, []).append(image_path)
+    for output_path, image_paths in images_by_output.items():
+        if len(image_paths) > 1:
+            logger.warning(
+                "The images %s are all written to %s, which only keeps the last one written and is not cached.",
+                [str(image_path) for image_path in image_paths],
+                output_path,
+            )
+    return images_by_output
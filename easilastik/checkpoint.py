@@ -0,0 +1,217 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Record the images whose outputs are complete, to resume an interrupted run where it stopped.
+
+The manifest is a JSON Lines file in the result folder. A line is appended, and flushed to disk, as soon as the
+output of an image is complete, so that a crash or a pre-emption loses at most the images being processed. Each line
+records the input image and its output with their size and modification time, under a key identifying the project
+file (and its version), the export source, the output format and the result base path: runs with other settings
+can share the same folder without being mistaken for each other.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.pipeline import HDF5_SUFFIXES, is_readable
+from easilastik.utils import get_output_path
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".easilastik-manifest.jsonl"
+
+# Color images written next to a probability file, which may have been deleted once colored
+COLORED_SUFFIXES = (".png", ".tif", ".npy")
+
+
+def get_file_state(file_path: str) -> tuple | None:
+    """
+    Return the size and modification time of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    tuple | None
+        The size in bytes and the modification time in nanoseconds, or None if the file does not exist.
+    """
+    try:
+        stat = Path(file_path).stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class RunManifest:
+    """
+    Checkpoint of a run, listing the images whose outputs are complete.
+
+    Parameters
+    ----------
+    result_base_path : str
+        The base path where the results are saved. The manifest is written in this folder.
+    model_path : str
+        The path to the Ilastik project file.
+    export_source : str
+        The type of data exported.
+    output_format : str
+        The format of the output files, which must be written as a single file per image.
+    """
+
+    def __init__(self, result_base_path: str, model_path: str, export_source: str, output_format: str) -> None:
+        self.result_base_path = result_base_path
+        self.export_source = export_source
+        self.output_format = output_format
+        self.path = Path(result_base_path) / MANIFEST_NAME
+
+        model_size, model_mtime_ns = get_file_state(model_path) or (None, None)
+        parts = [str(Path(model_path).resolve()), str(model_size), str(model_mtime_ns), export_source, output_format]
+        parts.append(result_base_path)
+        self.run_key = hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Read the entries of this run.
+
+        Returns
+        -------
+        dict
+            The last entry recorded for each input image of this run, keyed by the resolved path of the image. A
+            line truncated by a crash is ignored.
+        """
+        entries = {}
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if entry.get("run") == self.run_key:
+                        entries[entry["input"]] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def is_complete(self, entry: dict, input_path: str) -> bool:
+        """
+        Check that a recorded output is still valid.
+
+        Parameters
+        ----------
+        entry : dict
+            The entry of the image, as returned by `load`.
+        input_path : str
+            The path of the input image.
+
+        Returns
+        -------
+        bool
+            Whether the input image is unchanged since its output was recorded and the output is still there with
+            the recorded size. HDF5 outputs, which may be rewritten once complete (see `compact_probabilities`),
+            only need to be readable. A probability file deleted once colored is complete if its color image exists.
+        """
+        if list(get_file_state(input_path) or ()) != entry["input_state"]:
+            return False
+        output_path = Path(entry["output"])
+        output_state = get_file_state(entry["output"])
+        if output_state is not None:
+            if output_path.suffix in HDF5_SUFFIXES:
+                return is_readable(str(output_path))
+            return output_state[0] == entry["output_state"][0]
+        return output_path.suffix == ".h5" and any(  # noqa: PLR2004
+            output_path.with_suffix(suffix).exists() for suffix in COLORED_SUFFIXES
+        )
+
+    def pending(self, image_arg: list) -> list:
+        """
+        Return the images whose outputs are not recorded as complete.
+
+        Parameters
+        ----------
+        image_arg : list
+            The paths of the images to process.
+
+        Returns
+        -------
+        list
+            The images of image_arg still to process, in the same order.
+        """
+        entries = self.load()
+        pending = []
+        for path in image_arg:
+            entry = entries.get(str(Path(path).resolve()))
+            if entry is None or not self.is_complete(entry, path):
+                pending.append(path)
+        logger.info("Resuming: %d/%d images already processed.", len(image_arg) - len(pending), len(image_arg))
+        return pending
+
+    def record(self, input_path: str, output_path: str) -> None:
+        """
+        Record that the output of an image is complete.
+
+        Parameters
+        ----------
+        input_path : str
+            The path of the input image.
+        output_path : str
+            The path of its output file.
+        """
+        entry = {
+            "run": self.run_key,
+            "input": str(Path(input_path).resolve()),
+            "input_state": list(get_file_state(input_path) or ()),
+            "output": str(Path(output_path).resolve()),
+            "output_state": list(get_file_state(output_path) or ()),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def wrap(self, image_arg: list, on_output: Callable[[str], object] | None) -> Callable[[str], object]:
+        """
+        Return a function recording the outputs of a list of images as they are reported.
+
+        Parameters
+        ----------
+        image_arg : list
+            The paths of the images to process.
+        on_output : Callable[[str], object] | None
+            The function called with the path of each output file, if any.
+
+        Returns
+        -------
+        Callable[[str], object]
+            The function to call with the path of each complete output: it records it, then calls on_output. It
+            may be called from several threads.
+        """
+        inputs = {
+            get_output_path(self.result_base_path, path, self.export_source, self.output_format): path
+            for path in image_arg
+        }
+
+        def record_output(output_path: str) -> None:
+            if output_path in inputs:
+                self.record(inputs[output_path], output_path)
+            if on_output is not None:
+                on_output(output_path)
+
+        return record_output
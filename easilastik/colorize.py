@@ -0,0 +1,604 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Color the probability maps exported by Ilastik.
+
+All the functions coloring probabilities share the same engine. It finds the winning channel of each pixel and
+whether its probability is above the threshold with a few in-place passes over the channels, then writes the colors
+directly into a uint8 image through a palette lookup table. Its buffers are kept between calls, so processing a
+series of files of the same shape does not allocate new arrays.
+
+Large probability maps (whole-slide images, 3D stacks) do not fit in memory. They can be read by blocks of rows
+aligned on the HDF5 chunks of the dataset, each block being colored and written to a striped TIFF file before the
+next one is read, so that the peak memory only depends on the memory budget and not on the size of the image.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import h5py
+import numpy as np
+
+from easilastik.encoder import COLOR_FORMATS, ColorOutput, write_color_image
+from easilastik.metrics import measure
+from easilastik.tiff_writer import StripedTiffWriter
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from easilastik.metrics import RunMetrics
+    from easilastik.statistics import PixelStatistics
+
+
+# Bytes of temporary arrays allocated by the engine for each pixel, on top of the probabilities
+BLOCK_OVERHEAD_PER_PIXEL = 16
+
+# The class map is stored as uint8, with 0 for the pixels below the threshold
+MAX_CHANNELS = 255
+
+# Attribute of the compacted probabilities (see `compact_probabilities`): the stored values are the probabilities
+# multiplied by it
+VALUE_SCALE_ATTR = "easilastik_value_scale"
+
+_thread_data = threading.local()
+
+
+def check_colors(below_threshold_color: list, channel_colors: list) -> None:
+    """
+    Check the colors used to color probabilities.
+
+    Parameters
+    ----------
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+
+    Raises
+    ------
+    ValueError
+        If below_threshold_color or channel_colors are not in the correct format.
+    """
+    if (
+        not isinstance(below_threshold_color, list)
+        or len(below_threshold_color) != 3
+        or not all(isinstance(i, int) and 0 <= i <= 255 for i in below_threshold_color)
+    ):
+        msg = "below_threshold_color must be a list of 3 integers between 0 and 255 (RGB color format)"
+        raise ValueError(msg)
+
+    if not isinstance(channel_colors, list) or not all(
+        isinstance(color, list) and len(color) == 3 and all(isinstance(i, int) and 0 <= i <= 255 for i in color)
+        for color in channel_colors
+    ):
+        msg = "channel_colors must be a list of lists of 3 integers between 0 and 255 (RGB color format)"
+        raise ValueError(msg)
+
+    if len(channel_colors) > MAX_CHANNELS:
+        msg = f"At most {MAX_CHANNELS} channels are supported, got {len(channel_colors)}"
+        raise ValueError(msg)
+
+
+def open_probabilities(file_path: str, channel_colors: list | None = None) -> h5py.File:
+    """
+    Open a .h5 file exported by Ilastik and check that it matches the channel colors.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file.
+    channel_colors : list, optional
+        List of RGB colors for each channel. If not provided, the number of channels is not checked.
+
+    Returns
+    -------
+    h5py.File
+        The open file, holding the probabilities in its 'exported_data' dataset.
+
+    Raises
+    ------
+    ValueError
+        If the file cannot be opened, if it does not contain 'exported_data', or if the length of channel_colors
+        does not match the number of channels in the data.
+    """
+    # Open the file
+    try:
+        f = h5py.File(file_path, "r")
+    except OSError as err:
+        msg = f"Could not open file at {file_path}"
+        raise ValueError(msg) from err
+
+    # Ensure the file contains 'exported_data'
+    if "exported_data" not in f:  # noqa: PLR2004
+        f.close()
+        msg = f"File at {file_path} does not contain 'exported_data'"
+        raise ValueError(msg)
+
+    # Check if the length of channel_colors is equal to the number of channels in data
+    n_channels = f["exported_data"].shape[-1]
+    if channel_colors is not None and len(channel_colors) != n_channels:
+        f.close()
+        msg = (
+            "The length of channel_colors must be equal to the number of channels in the data (there must be as many "
+            f"colors as labels annotated in the Ilastik project). Expected {n_channels}, got {len(channel_colors)}"
+        )
+        raise ValueError(msg)
+
+    return f
+
+
+def get_value_scale(data: h5py.Dataset) -> float:
+    """
+    Return the factor between the values stored in a dataset and the probabilities.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities.
+
+    Returns
+    -------
+    float
+        The factor by which the probabilities were multiplied before being stored, 1 unless the file was compacted
+        to integers.
+    """
+    return float(data.attrs.get(VALUE_SCALE_ATTR, 1.0))
+
+
+def get_palette(below_threshold_color: list, channel_colors: list, *, bgr: bool = True) -> np.ndarray:
+    """
+    Build the lookup table from class indices to colors.
+
+    Parameters
+    ----------
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+    bgr : bool, optional
+        Whether to store the colors in BGR order, as expected by OpenCV. Default is True.
+
+    Returns
+    -------
+    np.ndarray
+        A uint8 array of shape (channels + 1, 3): row 0 is the below threshold color and row i + 1 the color of
+        channel i.
+    """
+    palette = np.array([below_threshold_color, *channel_colors], dtype=np.uint8)
+    return np.ascontiguousarray(palette[:, ::-1]) if bgr else palette
+
+
+class ColorizeEngine:
+    """
+    Threshold and color probability maps, reusing its buffers between calls.
+
+    The arrays returned by the methods are internal buffers: they are overwritten by the next call. Copy them, or
+    pass `out`, to keep them. The engine keeps a single buffer per name, as large as the largest one requested, so
+    that its memory does not grow with the number of image shapes. An engine must not be shared between threads,
+    use `get_engine` to get the engine of the current thread.
+    """
+
+    def __init__(self) -> None:
+        self._buffers = {}
+
+    def buffer(self, name: str, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        """
+        Return a buffer of the engine, allocating it on first use.
+
+        The buffer is a view of the memory kept under name, which is reallocated when the data type changes or when
+        it is too small for the shape.
+
+        Parameters
+        ----------
+        name : str
+            The name of the buffer.
+        shape : tuple
+            The shape of the buffer.
+        dtype : np.dtype
+            The data type of the buffer.
+
+        Returns
+        -------
+        np.ndarray
+            The buffer, with undefined content.
+        """
+        dtype = np.dtype(dtype)
+        size = math.prod(shape)
+        memory = self._buffers.get(name)
+        if memory is None or memory.dtype != dtype or memory.size < size:
+            memory = self._buffers[name] = np.empty(size, dtype=dtype)
+        return memory[:size].reshape(shape)
+
+    def read(self, data: h5py.Dataset | np.ndarray, selection: tuple = ()) -> np.ndarray:
+        """
+        Read probabilities into a buffer of the engine.
+
+        Parameters
+        ----------
+        data : h5py.Dataset | np.ndarray
+            The probabilities. NumPy arrays are returned as they are, without copy.
+        selection : tuple, optional
+            The part of the dataset to read, as a tuple of indices and slices. Default is the whole dataset.
+
+        Returns
+        -------
+        np.ndarray
+            The probabilities read.
+        """
+        if isinstance(data, np.ndarray):
+            return data[selection]
+        shape = np.empty(data.shape, dtype=np.bool_)[selection].shape if selection else data.shape
+        probabilities = self.buffer("probabilities", shape, data.dtype)
+        data.read_direct(probabilities, source_sel=selection or None)
+        return probabilities
+
+    def find_winners(self, probabilities: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the channel with the highest probability of each pixel, and that probability.
+
+        Parameters
+        ----------
+        probabilities : np.ndarray
+            The probabilities, with the channels on the last axis.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            A uint8 array with the index of the winning channel plus 1 (the first one in case of ties), and the
+            maximum probability of each pixel, both with the shape of probabilities without its channel axis.
+        """
+        shape = probabilities.shape[:-1]
+        best = self.buffer("best", shape, probabilities.dtype)
+        classes = self.buffer("classes", shape, np.uint8)
+        mask = self.buffer("mask", shape, np.bool_)
+
+        # Single pass over the channels: a channel only wins if it is strictly greater, so the first one wins ties
+        np.copyto(best, probabilities[..., 0])
+        classes.fill(1)
+        for channel in range(1, probabilities.shape[-1]):
+            np.greater(probabilities[..., channel], best, out=mask)
+            np.copyto(best, probabilities[..., channel], where=mask)
+            np.copyto(classes, np.uint8(channel + 1), where=mask)
+        return classes, best
+
+    def classify(
+        self, probabilities: np.ndarray, threshold: float, statistics: PixelStatistics | None = None
+    ) -> np.ndarray:
+        """
+        Find the winning class of each pixel.
+
+        Parameters
+        ----------
+        probabilities : np.ndarray
+            The probabilities, with the channels on the last axis.
+        threshold : float
+            Pixels whose maximum probability is not greater than this threshold are assigned to class 0.
+        statistics : PixelStatistics, optional
+            If provided, the pixels are added to these statistics.
+
+        Returns
+        -------
+        np.ndarray
+            A uint8 array with the shape of probabilities without its channel axis: 0 if the maximum probability
+            of the pixel is below the threshold, else the index of the channel with the highest probability plus 1
+            (the first one in case of ties).
+        """
+        classes, best = self.find_winners(probabilities)
+        mask = self.buffer("mask", classes.shape, np.bool_)
+
+        # Set the class to 0 where the maximum is not above the threshold
+        np.greater(best, threshold, out=mask)
+        np.multiply(classes, mask, out=classes)
+        if statistics is not None:
+            statistics.update(classes, best)
+        return classes
+
+    def colorize(
+        self,
+        probabilities: np.ndarray,
+        threshold: float,
+        palette: np.ndarray,
+        out: np.ndarray | None = None,
+        statistics: PixelStatistics | None = None,
+    ) -> np.ndarray:
+        """
+        Color probabilities.
+
+        Parameters
+        ----------
+        probabilities : np.ndarray
+            The probabilities, with the channels on the last axis.
+        threshold : float
+            Pixels with maximum value greater than this threshold are colored according to their channel.
+        palette : np.ndarray
+            The lookup table returned by `get_palette`.
+        out : np.ndarray, optional
+            The uint8 array of shape probabilities.shape[:-1] + (3,) receiving the colors. Default is a buffer of
+            the engine.
+        statistics : PixelStatistics, optional
+            If provided, the pixels are added to these statistics.
+
+        Returns
+        -------
+        np.ndarray
+            The color image, with the colors in the order of the palette.
+        """
+        classes = self.classify(probabilities, threshold, statistics)
+        if out is None:
+            out = self.buffer("colors", (*classes.shape, 3), np.uint8)
+        return np.take(palette, classes, axis=0, out=out)
+
+
+def get_engine() -> ColorizeEngine:
+    """
+    Return the engine of the current thread.
+
+    Returns
+    -------
+    ColorizeEngine
+        The engine, created on first use in each thread.
+    """
+    if not hasattr(_thread_data, "engine"):
+        _thread_data.engine = ColorizeEngine()
+    return _thread_data.engine
+
+
+def get_block_rows(data: h5py.Dataset, max_memory_mb: float) -> int:
+    """
+    Return the number of rows of the blocks fitting in a memory budget.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities, with axes (..., y, x, channels).
+    max_memory_mb : float
+        The memory budget in MB for a block and its temporary arrays.
+
+    Returns
+    -------
+    int
+        The number of rows of each block. If the dataset is chunked, it is a multiple of the chunk height so that
+        every chunk is read only once, and it is never less than one chunk height.
+    """
+    height, width, channels = data.shape[-3:]
+    bytes_per_row = width * (channels * data.dtype.itemsize + data.dtype.itemsize + BLOCK_OVERHEAD_PER_PIXEL)
+    rows = max(1, int(max_memory_mb * 2**20) // bytes_per_row)
+    if data.chunks is not None:
+        chunk_rows = data.chunks[-3]
+        rows = max(chunk_rows, rows // chunk_rows * chunk_rows)
+    return min(rows, height)
+
+
+def iter_row_blocks(data: h5py.Dataset, max_memory_mb: float, engine: ColorizeEngine) -> Iterator[np.ndarray]:
+    """
+    Read a dataset by blocks of full rows.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities, with axes (..., y, x, channels). Leading axes (e.g. z or t) are read one index at a time.
+    max_memory_mb : float
+        The memory budget in MB for a block and its temporary arrays.
+    engine : ColorizeEngine
+        The engine whose buffers receive the blocks.
+
+    Yields
+    ------
+    np.ndarray
+        The blocks of rows of shape (rows, x, channels), in the order of the dataset. Each block is overwritten by
+        the next one.
+    """
+    height = data.shape[-3]
+    rows = get_block_rows(data, max_memory_mb)
+    for page in np.ndindex(*data.shape[:-3]):
+        for start in range(0, height, rows):
+            yield engine.read(data, (*page, slice(start, min(start + rows, height))))
+
+
+def colorize_to_tiff(
+    data: h5py.Dataset,
+    output_path: str,
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    max_memory_mb: float,
+    statistics: PixelStatistics | None = None,
+) -> dict:
+    """
+    Color probabilities block by block into a striped TIFF file.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities, with axes (..., y, x, channels). Each index of the leading axes is written as a page of
+        the TIFF file.
+    output_path : str
+        The path of the TIFF file to write.
+    threshold : float
+        Pixels with maximum value greater than this threshold are colored according to their channel.
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+    max_memory_mb : float
+        The memory budget in MB for a block and its temporary arrays.
+    statistics : PixelStatistics, optional
+        If provided, the pixels of each block are added to these statistics.
+
+    Returns
+    -------
+    dict
+        The seconds spent to 'read', 'colorize' and 'write' the blocks.
+    """
+    engine = get_engine()
+    palette = get_palette(below_threshold_color, channel_colors, bgr=False)  # TIFF files store RGB colors
+    threshold *= get_value_scale(data)
+    height, width = data.shape[-3:-1]
+    pages = int(np.prod(data.shape[:-3]))
+    timings = {"read": 0.0, "colorize": 0.0, "write": 0.0}
+    with StripedTiffWriter(output_path, width, height, pages=pages) as writer:
+        start_time = time.perf_counter()
+        for block in iter_row_blocks(data, max_memory_mb, engine):
+            read_time = time.perf_counter()
+            colors = engine.colorize(block, threshold, palette, statistics=statistics)
+            colorize_time = time.perf_counter()
+            writer.write_rows(colors)
+            write_time = time.perf_counter()
+            timings["read"] += read_time - start_time
+            timings["colorize"] += colorize_time - read_time
+            timings["write"] += write_time - colorize_time
+            start_time = write_time
+    return timings
+
+
+def colorize_in_memory(
+    data: h5py.Dataset,
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    color_format: str,
+    statistics: PixelStatistics | None,
+    *,
+    copy: bool = False,
+) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Load probabilities at once and color them with the shared engine.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities, with the channels on the last axis.
+    threshold : float
+        Pixels with maximum probability greater than this threshold are colored according to their channel.
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+    color_format : str
+        The format the image is written in, one of `COLOR_FORMATS`.
+    statistics : PixelStatistics | None
+        If provided, receives the classes of the pixels.
+    copy : bool, optional
+        Whether to return an image which is not a buffer of the engine, e.g. to write it in the background while
+        the engine colors the next file. Default is False.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, dict]
+        The image (the classes for 'index', the colors otherwise), the palette it is written with and the seconds
+        spent to read and color the probabilities.
+    """
+    engine = get_engine()
+    start_time = time.perf_counter()
+    probabilities = engine.read(data)
+    read_time = time.perf_counter()
+    threshold *= get_value_scale(data)
+    # OpenCV writes PNG images from BGR colors, the other formats store RGB colors
+    palette = get_palette(below_threshold_color, channel_colors, bgr=color_format == "png")  # noqa: PLR2004
+    if color_format == "index":  # noqa: PLR2004
+        image = engine.classify(probabilities, threshold, statistics)
+        image = image.copy() if copy else image
+    else:
+        out = np.empty((*probabilities.shape[:-1], 3), dtype=np.uint8) if copy else None
+        image = engine.colorize(probabilities, threshold, palette, out=out, statistics=statistics)
+    return image, palette, {"read": read_time - start_time, "colorize": time.perf_counter() - read_time}
+
+
+def colorize_file(
+    file_path: str,
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    *,
+    max_memory_mb: float | None = None,
+    output: ColorOutput | None = None,
+    on_written: Callable[[], object] | None = None,
+    metrics: RunMetrics | None = None,
+) -> Path:
+    """
+    Color a .h5 file exported by Ilastik and save the color image next to it.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file.
+    threshold : float
+        Pixels with maximum value greater than this threshold are colored according to their channel.
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+    max_memory_mb : float, optional
+        If provided, the file is processed by blocks within this memory budget and saved as a .tif file.
+        Default is None (the whole file is loaded at once).
+    output : ColorOutput, optional
+        The format of the color image ('png', 'tif' (uncompressed), 'npy' (a NumPy array of RGB colors) or 'index'
+        (a PNG image of the classes with the colors in its palette)), its PNG compression level, the encoder writing
+        it while the calling thread moves to the next file (its errors are then collected by the encoder rather
+        than raised) and the statistics receiving the pixel statistics of the file. Default is a 'png' image, or
+        'tif' with max_memory_mb, written in the calling thread.
+    on_written : Callable[[], object], optional
+        Called once the color image is written, e.g. to delete the .h5 file.
+    metrics : RunMetrics, optional
+        The metrics receiving the seconds spent to read, color and write the file, and the bytes read and written.
+
+    Returns
+    -------
+    Path
+        The path of the color image, which may still be being written by the encoder.
+
+    Raises
+    ------
+    ValueError
+        If the color format or the PNG compression level is not valid.
+    """
+    output = output or ColorOutput()
+    output.check(max_memory_mb)
+    color_format = output.get_format(max_memory_mb)
+    new_path = Path(file_path).with_suffix(COLOR_FORMATS[color_format])
+    read_bytes = Path(file_path).stat().st_size
+    # The image written in the background must not be a buffer of the engine, reused by the next file
+    background = output.encoder is not None and max_memory_mb is None
+    statistics = output.statistics
+
+    with open_probabilities(file_path, channel_colors) as f:
+        data = f["exported_data"]
+        image_statistics = None if statistics is None else statistics.create(data.shape[-1], get_value_scale(data))
+        if max_memory_mb is not None:
+            # Stream the probabilities block by block to a TIFF file instead of loading them at once
+            timings = colorize_to_tiff(
+                data, str(new_path), threshold, below_threshold_color, channel_colors, max_memory_mb, image_statistics
+            )
+        else:
+            image, palette, timings = colorize_in_memory(
+                data, threshold, below_threshold_color, channel_colors, color_format, image_statistics, copy=background
+            )
+
+    if statistics is not None:
+        statistics.add(file_path, image_statistics)
+
+    if metrics is not None:
+        for name, seconds in timings.items():
+            metrics.add_stage(name, seconds, file_path)
+
+    def write() -> None:
+        if max_memory_mb is None:
+            with measure(metrics, "write", file_path):
+                write_color_image(
+                    new_path, image, color_format, palette=palette, png_compression=output.png_compression
+                )
+        if metrics is not None:
+            metrics.add_bytes(read=read_bytes, written=new_path.stat().st_size)
+        if on_written is not None:
+            on_written()
+
+    if background:
+        output.encoder.submit(file_path, write)
+    else:
+        write()
+    return new_path
@@ -0,0 +1,192 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Rewrite the probability files exported by Ilastik in a compact format.
+
+Ilastik exports one float32 value per pixel and label, uncompressed, which often makes the probability files
+larger than the images they come from. They can be rewritten with a smaller data type, uint8 (the probabilities
+multiplied by 255 and rounded, a resolution of 1/255) or float16 (about 3 significant digits), in chunks compressed
+by a fast filter. The 'exported_data' dataset keeps its name, shape, axes and attributes, and the factor applied to
+the values is stored as an attribute, so that the functions coloring probabilities read compacted files as they
+read the original ones.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from easilastik.colorize import VALUE_SCALE_ATTR, get_engine, open_probabilities
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+COMPACT_DTYPES = {"uint8": np.uint8, "float16": np.float16}
+COMPRESSIONS = ["lzf", "gzip", None]
+
+# Target size of the compressed chunks before compression, and memory used to convert a file
+CHUNK_BYTES = 2**20
+BLOCK_BYTES = 64 * 2**20
+
+
+def get_chunks(shape: tuple, itemsize: int) -> tuple:
+    """
+    Return the shape of the chunks of a compact dataset.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the dataset, with axes (..., y, x, channels).
+    itemsize : int
+        The size in bytes of a value.
+
+    Returns
+    -------
+    tuple
+        Chunks of full rows with all the channels, one index of the leading axes, and about CHUNK_BYTES each.
+    """
+    height, width, channels = shape[-3:]
+    rows = max(1, min(height, CHUNK_BYTES // (width * channels * itemsize)))
+    return (*(1 for _ in shape[:-3]), rows, width, channels)
+
+
+def convert_block(block: np.ndarray, dtype: str, value_scale: float) -> np.ndarray:
+    """
+    Convert a block of probabilities to a compact data type.
+
+    Parameters
+    ----------
+    block : np.ndarray
+        The probabilities, in the stored values of the source file.
+    dtype : str
+        'uint8' or 'float16'.
+    value_scale : float
+        The factor by which the probabilities of the source file were multiplied.
+
+    Returns
+    -------
+    np.ndarray
+        The probabilities multiplied by 255 and rounded for uint8, or unchanged for float16.
+    """
+    probabilities = np.divide(block, value_scale, dtype=np.float32)
+    if COMPACT_DTYPES[dtype] is np.float16:
+        return probabilities.astype(np.float16)
+    np.multiply(probabilities, np.float32(255), out=probabilities)
+    np.rint(probabilities, out=probabilities)
+    np.clip(probabilities, 0, 255, out=probabilities)
+    return probabilities.astype(np.uint8)
+
+
+def is_compact(data: h5py.Dataset) -> bool:
+    """
+    Check whether a probability dataset is already stored in a compact data type.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities.
+
+    Returns
+    -------
+    bool
+        Whether the values are stored as uint8 or float16, whether they were compacted by `compact_probabilities`
+        or exported so by Ilastik: rewriting them would not make them smaller.
+    """
+    return data.dtype in {np.dtype(np.uint8), np.dtype(np.float16)}
+
+
+def compact_probabilities(
+    file_path: str,
+    dtype: str = "uint8",
+    *,
+    compression: str | None = "lzf",
+    output_path: str | None = None,
+) -> Path:
+    """
+    Rewrite a probability file exported by Ilastik with a compact data type and compressed chunks.
+
+    The file is converted by blocks of chunks, so that the memory used does not depend on the size of the image.
+
+    The conversion is lossy. With uint8, two channels whose probabilities differ by less than 1/255 may be rounded to
+    the same value, the first of them then winning the tie, and a probability within 1/510 of the threshold may be
+    rounded to the other side of it: the colors of such pixels can differ from the ones of the original file.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file.
+    dtype : str, optional
+        'uint8' (1 byte per value, resolution 1/255) or 'float16' (2 bytes per value). Default is 'uint8'.
+    compression : str | None, optional
+        The HDF5 filter compressing the chunks: 'lzf' (fast, only readable with h5py), 'gzip' (smaller and
+        readable everywhere, but slower) or None. Default is 'lzf'.
+    output_path : str, optional
+        The path of the compacted file. Default is file_path, which is replaced atomically once the conversion is
+        complete.
+
+    Returns
+    -------
+    Path
+        The path of the compacted file. Files already stored in a compact data type are left unchanged.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file at file_path does not exist.
+    ValueError
+        If dtype or compression are not valid, or if the file does not contain 'exported_data'.
+    """
+    if dtype not in COMPACT_DTYPES:
+        msg = f"dtype must be one of {list(COMPACT_DTYPES)}, got '{dtype}'"
+        raise ValueError(msg)
+    if compression not in COMPRESSIONS:
+        msg = f"compression must be one of {COMPRESSIONS}, got '{compression}'"
+        raise ValueError(msg)
+    if not Path(file_path).exists():
+        msg = f"File at {file_path} does not exist"
+        raise FileNotFoundError(msg)
+
+    destination = Path(output_path or file_path)
+    tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+    try:
+        with open_probabilities(file_path) as source:
+            data = source["exported_data"]
+            if is_compact(data):
+                return Path(file_path)
+
+            value_scale = float(data.attrs.get(VALUE_SCALE_ATTR, 1.0))
+            chunks = get_chunks(data.shape, np.dtype(COMPACT_DTYPES[dtype]).itemsize)
+            engine = get_engine()
+            with h5py.File(tmp_path, "w") as target:
+                compact = target.create_dataset(
+                    "exported_data",
+                    shape=data.shape,
+                    dtype=COMPACT_DTYPES[dtype],
+                    chunks=chunks,
+                    compression=compression,
+                )
+                for key, value in data.attrs.items():
+                    compact.attrs[key] = value
+                if COMPACT_DTYPES[dtype] is np.uint8:
+                    compact.attrs[VALUE_SCALE_ATTR] = 255.0
+                elif VALUE_SCALE_ATTR in compact.attrs:
+                    del compact.attrs[VALUE_SCALE_ATTR]
+
+                # Convert whole chunks at a time, as many as fit in the memory budget
+                height = data.shape[-3]
+                row_bytes = data.shape[-2] * data.shape[-1] * data.dtype.itemsize
+                rows = max(chunks[-3], BLOCK_BYTES // row_bytes // chunks[-3] * chunks[-3])
+                for page in np.ndindex(*data.shape[:-3]):
+                    for start in range(0, height, rows):
+                        selection = (*page, slice(start, min(start + rows, height)))
+                        compact[selection] = convert_block(engine.read(data, selection), dtype, value_scale)
+        tmp_path.replace(destination)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    logger.debug("Compacted %s to %s", file_path, destination)
+    return destination
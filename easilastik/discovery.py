@@ -0,0 +1,330 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+List the images of a folder, optionally recursively, with a single stat per file.
+
+The folders are read with `os.scandir`, whose entries tell files from folders without a stat on most platforms, and
+each image kept is stat'ed once for its size and modification time. Hidden files and folders, files whose extension
+Ilastik cannot read as an image (such as the HDF5 outputs of EasIlastik) and the paths matching ignore patterns are
+skipped.
+
+An optional index records the content of each folder with its modification time. Adding, removing or renaming a file
+changes the modification time of its folder, so a rescan only lists the folders which changed and takes the files of
+the others from the index.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Extensions of the images read by Ilastik, as a single 2D (or multipage) image per file
+IMAGE_EXTENSIONS = frozenset(
+    {
+        ".bmp",
+        ".gif",
+        ".hdr",
+        ".jpeg",
+        ".jpg",
+        ".npy",
+        ".pbm",
+        ".pgm",
+        ".png",
+        ".pnm",
+        ".ppm",
+        ".ras",
+        ".tif",
+        ".tiff",
+        ".xv",
+    }
+)
+
+INDEX_VERSION = 1
+
+# A folder modified less than this before a scan may still change within the same timestamp, so it is not trusted
+RACY_NS = 2_000_000_000
+
+
+class DiscoveryIndex:
+    """
+    Content of the folders listed by a previous scan, to rescan only the folders which changed.
+
+    The index is a JSON file recording, for each folder, its modification time, its subfolders and the size and
+    modification time of its files. A folder whose modification time did not change is not listed again. The files
+    rewritten in place keep the size and modification time of the index until their folder changes.
+
+    Parameters
+    ----------
+    index_path : str
+        The path of the index file. It is created by the first scan.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = Path(index_path)
+        self.folders = {}
+        self.scanned_folders = {}
+        self.n_listed = 0
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if data.get("version") == INDEX_VERSION:
+            self.folders = data["folders"]
+
+    def list_folder(self, folder: str, mtime_ns: int, scan_ns: int) -> tuple[list, list]:
+        """
+        List the files and subfolders of a folder, from the index if the folder did not change.
+
+        Parameters
+        ----------
+        folder : str
+            The path of the folder.
+        mtime_ns : int
+            The current modification time of the folder, in nanoseconds.
+        scan_ns : int
+            The time at which the scan started, in nanoseconds.
+
+        Returns
+        -------
+        tuple[list, list]
+            The files, as (name, size, mtime_ns) lists, and the subfolders, as (name, mtime_ns) lists. Hidden
+            entries are not listed.
+        """
+        record = self.folders.get(folder)
+        if record is None or record["mtime_ns"] != mtime_ns:
+            files, subfolders = list_folder(folder)
+            self.n_listed += 1
+            # A folder modified just before the scan is listed again by the next scan
+            trusted = mtime_ns < scan_ns - RACY_NS
+            record = {
+                "mtime_ns": mtime_ns if trusted else None,
+                "files": files,
+                "folders": [name for name, _ in subfolders],
+            }
+        else:
+            files = record["files"]
+            # The subfolders removed since the previous scan are skipped
+            mtimes = [get_mtime_ns(os.path.join(folder, name)) for name in record["folders"]]  # noqa: PTH118
+            subfolders = [
+                [name, mtime_ns]
+                for name, mtime_ns in zip(record["folders"], mtimes, strict=True)
+                if mtime_ns is not None
+            ]
+        self.scanned_folders[folder] = record
+        return files, subfolders
+
+    def save(self) -> None:
+        """Write the folders of the last complete scan to the index file, atomically."""
+        tmp_path = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}.tmp")
+        data = {"version": INDEX_VERSION, "folders": self.scanned_folders}
+        tmp_path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        tmp_path.replace(self.index_path)
+        logger.debug("Listed %d/%d folders, the others were read from the index.", self.n_listed, len(data["folders"]))
+        self.folders, self.scanned_folders, self.n_listed = self.scanned_folders, {}, 0
+
+
+def list_folder(folder: str) -> tuple[list, list]:
+    """
+    List the non-hidden files and subfolders of a folder, with a single stat per entry.
+
+    Parameters
+    ----------
+    folder : str
+        The path of the folder.
+
+    Returns
+    -------
+    tuple[list, list]
+        The files, as (name, size, mtime_ns) lists, and the subfolders, as (name, mtime_ns) lists. The entries
+        which disappear while the folder is listed are skipped.
+    """
+    files, subfolders = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append([entry.name, stat.st_size, stat.st_mtime_ns])
+                elif entry.is_dir():
+                    subfolders.append([entry.name, entry.stat().st_mtime_ns])
+            except OSError:
+                continue
+    return files, subfolders
+
+
+def get_mtime_ns(path: str) -> int | None:
+    """Return the modification time of a path in nanoseconds, or None if it cannot be read (e.g. it was removed)."""
+    try:
+        return os.stat(path).st_mtime_ns  # noqa: PTH116
+    except OSError:
+        return None
+
+
+def scan_folder(folder: str, extensions: set | None, subfolders: list) -> Iterator[list]:
+    """
+    Iterate over the non-hidden files of a folder as `os.scandir` lists them, without holding the whole listing.
+
+    Parameters
+    ----------
+    folder : str
+        The path of the folder.
+    extensions : set | None
+        The extensions of the files to yield, or None for all the files. The other files are not stat'ed.
+    subfolders : list
+        Receives the names of the non-hidden subfolders, as (name, None) lists, while the folder is listed.
+
+    Yields
+    ------
+    list
+        The name, size and modification time in nanoseconds of each file. The entries which disappear while the
+        folder is listed are skipped.
+    """
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_file():
+                    extension = os.path.splitext(entry.name)[1].lower()  # noqa: PTH122
+                    if extensions is not None and extension not in extensions:
+                        continue
+                    stat = entry.stat()
+                    yield [entry.name, stat.st_size, stat.st_mtime_ns]
+                elif entry.is_dir():
+                    subfolders.append([entry.name, None])
+            except OSError:
+                continue
+
+
+def is_ignored(relative_path: str, ignore: Iterable[str]) -> bool:
+    """Return whether a path relative to the scanned folder, or its name, matches one of the ignore patterns."""
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+
+def iter_images(
+    folder: str,
+    *,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    recursive: bool = False,
+    ignore: Iterable[str] = (),
+    index_path: str | None = None,
+) -> Iterator[tuple[str, int, int]]:
+    """
+    Iterate over the images of a folder as the folders are listed.
+
+    Without index, the images are yielded as `os.scandir` lists them, so that a large folder is never held in memory
+    as a single list.
+
+    Parameters
+    ----------
+    folder : str
+        The path of the folder.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files to keep, lowercase and with their leading dot. Default is the image formats read
+        by Ilastik (`IMAGE_EXTENSIONS`). If None, all the files are kept.
+    recursive : bool, optional
+        Whether to list the subfolders as well. Default is False.
+    ignore : Iterable[str], optional
+        Glob patterns of the files and folders to skip, matched against their name and their path relative to
+        folder (with "/" as separator). An ignored folder is not listed.
+    index_path : str, optional
+        The path of a `DiscoveryIndex`, to list only the folders which changed since the previous scan. The index
+        is written once the iteration is complete.
+
+    Yields
+    ------
+    tuple[str, int, int]
+        The path of each image, its size in bytes and its modification time in nanoseconds.
+    """
+    extensions = None if extensions is None else {extension.lower() for extension in extensions}
+    ignore = tuple(ignore)
+    index = DiscoveryIndex(index_path) if index_path is not None else None
+    scan_ns = time.time_ns()
+
+    pending = [(folder, "", Path(folder).stat().st_mtime_ns if index is not None else None)]
+    while pending:
+        current, prefix, mtime_ns = pending.pop()
+        if index is not None:
+            files, subfolders = index.list_folder(current, mtime_ns, scan_ns)
+        else:
+            # The files are yielded as they are listed, the subfolders are collected meanwhile
+            subfolders = []
+            files = scan_folder(current, extensions, subfolders)
+
+        for name, size, file_mtime_ns in files:
+            if extensions is not None and os.path.splitext(name)[1].lower() not in extensions:  # noqa: PTH122
+                continue
+            if ignore and is_ignored(prefix + name, ignore):
+                continue
+            yield os.path.join(current, name), size, file_mtime_ns  # noqa: PTH118
+
+        if recursive:
+            # The subfolders are listed in reverse so that they are popped in the order they were listed
+            for name, subfolder_mtime_ns in reversed(subfolders):
+                if ignore and is_ignored(prefix + name, ignore):
+                    continue
+                pending.append((os.path.join(current, name), f"{prefix}{name}/", subfolder_mtime_ns))  # noqa: PTH118
+
+    if index is not None:
+        index.save()
+
+
+def get_images(
+    folder: str,
+    *,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    recursive: bool = False,
+    ignore: Iterable[str] = (),
+    index_path: str | None = None,
+    order: str | None = None,
+) -> list:
+    """
+    List the images of a folder.
+
+    Parameters
+    ----------
+    folder : str
+        The path of the folder.
+    extensions, recursive, ignore, index_path
+        See `iter_images`.
+    order : str, optional
+        "name" to sort the images by path, or "size" to put the largest images first, so that they are not the last
+        ones left when the images are shared between several processes. Default is the order of the folders.
+
+    Returns
+    -------
+    list
+        The paths of the images.
+
+    Raises
+    ------
+    ValueError
+        If order is not valid.
+    """
+    if order not in {None, "name", "size"}:
+        msg = f"order must be None, 'name' or 'size', got {order}"
+        raise ValueError(msg)
+
+    images = list(
+        iter_images(folder, extensions=extensions, recursive=recursive, ignore=ignore, index_path=index_path)
+    )
+    if order == "name":  # noqa: PLR2004
+        images.sort()
+    elif order == "size":  # noqa: PLR2004
+        images.sort(key=lambda image: -image[1])
+    return [Path(path) for path, _, _ in images]
@@ -0,0 +1,416 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Write the color images, in the calling thread or in background threads.
+
+Encoding a large PNG image takes about as long as reading and coloring its probabilities. An `OutputEncoder` writes
+the images in its own threads while the next files are colored, with a bounded number of images waiting to be
+written so that the memory stays bounded when the encoding is the slower step. The formats faster to write than
+PNG skip the compression (TIFF) or the encoding altogether (NumPy arrays, which can be memory-mapped by readers).
+"""
+
+from __future__ import annotations
+
+import logging
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, ClassVar
+
+import numpy as np
+
+from easilastik.tiff_writer import StripedTiffWriter
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from concurrent.futures import Future
+    from types import TracebackType
+    from typing import BinaryIO
+
+    from easilastik.statistics import BatchStatistics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Extension of the color images of each format. 'index' images hold the class of each pixel and the colors in
+# their palette, 'npy' images are RGB arrays saved by NumPy
+COLOR_FORMATS = {"png": ".png", "tif": ".tif", "npy": ".npy", "index": ".png"}
+
+MAX_PNG_COMPRESSION = 9
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_PALETTE_COLOR_TYPE = 3
+
+# zlib level used for 'index' images when no compression is given, the default of OpenCV for PNG files
+DEFAULT_PNG_COMPRESSION = 1
+
+
+def check_color_format(color_format: str, png_compression: int | None, *, max_memory_mb: float | None = None) -> None:
+    """
+    Check the format of the color images.
+
+    Parameters
+    ----------
+    color_format : str
+        The format of the color images, one of `COLOR_FORMATS`.
+    png_compression : int | None
+        The zlib compression level of the PNG images, from 0 (none, fastest) to 9, or None for the default.
+    max_memory_mb : float, optional
+        The memory budget of the coloring. Images colored by blocks are always written as TIFF files.
+
+    Raises
+    ------
+    ValueError
+        If the format or the compression level is not valid.
+    """
+    if color_format not in COLOR_FORMATS:
+        msg = f"color_format must be one of {list(COLOR_FORMATS)}, got '{color_format}'"
+        raise ValueError(msg)
+    if max_memory_mb is not None and color_format != "tif":  # noqa: PLR2004
+        msg = f"Images colored by blocks (max_memory_mb) are written as 'tif' files, got color_format '{color_format}'"
+        raise ValueError(msg)
+    if png_compression is not None and not (
+        isinstance(png_compression, int) and 0 <= png_compression <= MAX_PNG_COMPRESSION
+    ):
+        msg = f"png_compression must be an integer between 0 and {MAX_PNG_COMPRESSION}, got {png_compression}"
+        raise ValueError(msg)
+
+
+class ColorOutput:
+    """
+    The options of the color images made from probability files, passed together through the coloring functions.
+
+    Parameters
+    ----------
+    color_format : str, optional
+        The format of the color images, one of `COLOR_FORMATS`. Default is 'png', or 'tif' for the images colored by
+        blocks.
+    png_compression : int, optional
+        The zlib compression level of 'png' and 'index' images, from 0 (fastest) to 9 (smallest). Default is the one
+        of OpenCV.
+    encoder : OutputEncoder, optional
+        If provided, the color images are written in the background by the encoder, which records their errors.
+        Ignored for the images colored by blocks.
+    statistics : BatchStatistics, optional
+        If provided, the pixel statistics of each file are computed while it is colored and added to it.
+    """
+
+    def __init__(
+        self,
+        color_format: str | None = None,
+        png_compression: int | None = None,
+        *,
+        encoder: OutputEncoder | None = None,
+        statistics: BatchStatistics | None = None,
+    ) -> None:
+        self.color_format = color_format
+        self.png_compression = png_compression
+        self.encoder = encoder
+        self.statistics = statistics
+
+    def get_format(self, max_memory_mb: float | None = None) -> str:
+        """Return the format of the color images, the default depending on whether they are colored by blocks."""
+        return self.color_format or ("tif" if max_memory_mb is not None else "png")
+
+    def check(self, max_memory_mb: float | None = None) -> None:
+        """Check the format and the compression level of the color images, see `check_color_format`."""
+        check_color_format(self.get_format(max_memory_mb), self.png_compression, max_memory_mb=max_memory_mb)
+
+
+def write_png_chunk(f: BinaryIO, chunk_type: bytes, data: bytes) -> None:
+    """Write a chunk of a PNG file, with its length and checksum."""
+    f.write(struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+def write_indexed_png(path: str, classes: np.ndarray, palette: np.ndarray, png_compression: int | None = None) -> None:
+    """
+    Write a class map as a PNG image with a palette.
+
+    Readers expanding palettes (such as OpenCV) read it as a color image, the others get the class of each pixel.
+
+    Parameters
+    ----------
+    path : str
+        The path of the PNG file.
+    classes : np.ndarray
+        A 2D uint8 array holding the index of the color of each pixel in the palette.
+    palette : np.ndarray
+        A uint8 array of shape (n_colors, 3) with the RGB colors, at most 256 of them.
+    png_compression : int, optional
+        The zlib compression level, from 0 to 9. Default is `DEFAULT_PNG_COMPRESSION`.
+
+    Raises
+    ------
+    ValueError
+        If classes is not a 2D image.
+    """
+    if classes.ndim != 2:
+        msg = f"Only 2D class maps can be written as PNG files, got shape {classes.shape}"
+        raise ValueError(msg)
+    height, width = classes.shape
+
+    # Each row starts with its filter type, 0 (none)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = classes
+    level = DEFAULT_PNG_COMPRESSION if png_compression is None else png_compression
+    with Path(path).open("wb") as f:
+        f.write(PNG_SIGNATURE)
+        write_png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_PALETTE_COLOR_TYPE, 0, 0, 0))
+        write_png_chunk(f, b"PLTE", np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+        write_png_chunk(f, b"IDAT", zlib.compress(rows.data, level))
+        write_png_chunk(f, b"IEND", b"")
+
+
+class StripedPngWriter:
+    """
+    Write an 8 or 16-bit PNG image strip by strip.
+
+    Rows are appended in order with `write_rows`, and compressed as they come: only the compressor state is kept in
+    memory, not the image.
+
+    Parameters
+    ----------
+    path : str
+        The path of the PNG file to write.
+    width : int
+        The width of the image in pixels.
+    height : int
+        The height of the image in pixels.
+    channels : int, optional
+        The number of channels: 1 (grayscale), 2 (grayscale and alpha), 3 (RGB) or 4 (RGBA). Default is 1.
+    dtype : np.dtype, optional
+        np.uint8 or np.uint16. Default is np.uint8.
+    png_compression : int, optional
+        The zlib compression level, from 0 to 9. Default is `DEFAULT_PNG_COMPRESSION`.
+
+    Raises
+    ------
+    ValueError
+        If the number of channels or the data type cannot be written as PNG.
+    """
+
+    COLOR_TYPES: ClassVar[dict] = {1: 0, 2: 4, 3: 2, 4: 6}
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        height: int,
+        *,
+        channels: int = 1,
+        dtype: np.dtype = np.uint8,
+        png_compression: int | None = None,
+    ) -> None:
+        dtype = np.dtype(dtype)
+        if channels not in self.COLOR_TYPES or dtype not in {np.dtype(np.uint8), np.dtype(np.uint16)}:
+            msg = f"PNG images have 1 to 4 channels of uint8 or uint16, got {channels} channels of {dtype}"
+            raise ValueError(msg)
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.channels = channels
+        # PNG samples are big-endian
+        self.dtype = dtype.newbyteorder(">")
+        self._rows = 0
+        self._compressor = zlib.compressobj(DEFAULT_PNG_COMPRESSION if png_compression is None else png_compression)
+        self._file = self.path.open("wb")
+        self._file.write(PNG_SIGNATURE)
+        header = struct.pack(">IIBBBBB", width, height, dtype.itemsize * 8, self.COLOR_TYPES[channels], 0, 0, 0)
+        write_png_chunk(self._file, b"IHDR", header)
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """
+        Append rows to the image.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            An array of shape (n_rows, width, channels), or (n_rows, width) for grayscale images.
+
+        Raises
+        ------
+        ValueError
+            If the rows do not have the shape of the image, or if more rows than the image height are written.
+        """
+        grayscale_rows = self.channels == 1 and rows.shape[1:] == (self.width,)
+        if rows.shape[1:] != (self.width, self.channels) and not grayscale_rows:
+            msg = f"Expected rows of shape (n, {self.width}, {self.channels}), got {rows.shape}"
+            raise ValueError(msg)
+        if self._rows + len(rows) > self.height:
+            msg = f"{self.path} has only {self.height} rows, got {self._rows + len(rows)}"
+            raise ValueError(msg)
+
+        # Each row starts with its filter type, 0 (none)
+        data = np.zeros((len(rows), 1 + self.width * self.channels * self.dtype.itemsize), dtype=np.uint8)
+        data[:, 1:] = rows.astype(self.dtype).reshape(len(rows), -1).view(np.uint8)
+        if compressed := self._compressor.compress(data.data):
+            write_png_chunk(self._file, b"IDAT", compressed)
+        self._rows += len(rows)
+
+    def close(self) -> None:
+        """
+        Finish the file.
+
+        Raises
+        ------
+        ValueError
+            If fewer rows than the image height were written.
+        """
+        if self._file.closed:
+            return
+        write_png_chunk(self._file, b"IDAT", self._compressor.flush())
+        write_png_chunk(self._file, b"IEND", b"")
+        self._file.close()
+        if self._rows < self.height:
+            msg = f"{self.path} is incomplete: {self._rows}/{self.height} rows written."
+            raise ValueError(msg)
+
+    def __enter__(self) -> StripedPngWriter:  # noqa: PYI034
+        """Return the writer when entering the context."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Finish the file when leaving the context, or only close it if an exception was raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def write_color_image(
+    path: str,
+    image: np.ndarray,
+    color_format: str,
+    *,
+    palette: np.ndarray | None = None,
+    png_compression: int | None = None,
+) -> None:
+    """
+    Write a color image in one of the `COLOR_FORMATS`.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    image : np.ndarray
+        A uint8 array of shape (y, x, 3) with the colors, in BGR order for 'png' and RGB order for 'tif' and 'npy',
+        or of shape (y, x) with the classes for 'index'.
+    color_format : str
+        The format of the file.
+    palette : np.ndarray, optional
+        The RGB colors of the classes, for 'index' images.
+    png_compression : int, optional
+        The zlib compression level of the PNG images, from 0 to 9. Default is the one of OpenCV.
+    """
+    if color_format == "png":  # noqa: PLR2004
+        import cv2  # noqa: PLC0415
+
+        params = [] if png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        if not cv2.imwrite(str(path), image, params):
+            msg = f"Could not write {path}"
+            raise OSError(msg)
+    elif color_format == "tif":  # noqa: PLR2004
+        height, width = image.shape[:2]
+        with StripedTiffWriter(str(path), width, height) as writer:
+            writer.write_rows(image)
+    elif color_format == "npy":  # noqa: PLR2004
+        np.save(path, image)
+    else:
+        write_indexed_png(path, image, palette, png_compression)
+
+
+class OutputEncoder:
+    """
+    Write images in background threads while the next ones are computed.
+
+    At most max_pending writes are queued or running: `submit` blocks until one of them is done, so that the images
+    waiting to be written do not accumulate in memory. The errors of the writes are collected rather than raised.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The number of threads writing images. Default is 1.
+    max_pending : int, optional
+        The maximum number of writes submitted but not finished. Default is twice the number of workers.
+
+    Raises
+    ------
+    ValueError
+        If workers is less than 1.
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int | None = None) -> None:
+        if workers < 1:
+            msg = f"workers must be at least 1, got {workers}"
+            raise ValueError(msg)
+        self.errors = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="easilastik-encoder")
+        self._slots = threading.Semaphore(max(workers, max_pending or 2 * workers))
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, write: Callable[[], object]) -> Future:
+        """
+        Run a write in a background thread, once fewer than max_pending writes are in progress.
+
+        Parameters
+        ----------
+        key : str
+            The key of the error in `errors` if the write fails, usually the path of the file being processed.
+        write : Callable[[], object]
+            The function writing the image. The arrays it writes must not be modified until it is done.
+
+        Returns
+        -------
+        Future
+            The future of the write, which never raises: its error is in `errors`.
+        """
+        self._slots.acquire()
+        try:
+            return self._executor.submit(self._run, key, write)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _run(self, key: str, write: Callable[[], object]) -> None:
+        """Run a write, recording its error."""
+        try:
+            write()
+        except Exception as error:
+            logger.exception("Error while writing the output of %s", key)
+            with self._lock:
+                self.errors[key] = error
+        finally:
+            self._slots.release()
+
+    def close(self) -> dict:
+        """
+        Wait for the writes in progress and stop the threads.
+
+        Returns
+        -------
+        dict
+            The exception raised by each failed write, keyed by the key given to `submit`.
+        """
+        self._executor.shutdown(wait=True)
+        return self.errors
+
+    def __enter__(self) -> OutputEncoder:  # noqa: PYI034
+        """Return the encoder when entering the context."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Wait for the writes in progress when leaving the context."""
+        self.close()
@@ -0,0 +1,19 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""Exceptions raised by EasIlastik."""
+
+
+class BatchError(RuntimeError):
+    """
+    Error raised when some items of a batch failed while the others were processed.
+
+    Parameters
+    ----------
+    msg : str
+        The error message.
+    errors : dict
+        The exception raised for each failed item, keyed by the item (e.g. a shard index or a file path).
+    """
+
+    def __init__(self, msg: str, errors: dict) -> None:
+        super().__init__(msg)
+        self.errors = errors
@@ -1,10 +1,21 @@
 # Copyright (C) 2026 Titouan Le Gourrierec
-"""Find the Ilastik executable on the current operating system."""
+"""
+Find the Ilastik executable on the current operating system.
+
+The executable is looked up, in order, in the `EASILASTIK_ILASTIK_PATH` environment variable, in the discovery cache,
+in the `PATH` and in the usual installation directories. Whatever is found is saved in the discovery cache, which
+is invalidated as soon as the cached executable no longer exists. A scan of the whole disk is only done on request,
+with `find_ilastik(full_scan=True)` or the `EASILASTIK_FULL_SCAN=1` environment variable.
+"""
 
 import logging
 import os
 import platform
+import re
+import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
@@ -13,6 +24,34 @@ logger = logging.getLogger(__name__)
 
 TIME_OUT = 60
 
+ILASTIK_PATH_ENV = "EASILASTIK_ILASTIK_PATH"
+FULL_SCAN_ENV = "EASILASTIK_FULL_SCAN"
+
+# Glob patterns of the usual installation directories, relative to the roots below
+KNOWN_LOCATIONS = {
+    "Linux": (
+        ["~", "~/Applications", "~/Downloads", "~/opt", "~/.local", "/opt", "/usr/local", "/usr/share"],
+        ["ilastik*/run_ilastik.sh"],
+    ),
+    "Darwin": (
+        ["/Applications", "~/Applications", "~/Downloads"],
+        ["ilastik*.app/Contents/*/run_ilastik.sh", "ilastik*/run_ilastik.sh"],
+    ),
+    "Windows": (
+        [os.environ.get("PROGRAMFILES", "C:\\Program Files"), os.environ.get("LOCALAPPDATA", "~") + "\\Programs"],
+        ["ilastik*/ilastik.exe"],
+    ),
+}
+
+# Directories never worth entering during a full scan
+PRUNED_DIRS = {"$Recycle.Bin", "__pycache__", "node_modules", "site-packages"}
+# System directories skipped only at the root of the filesystem, e.g. ~/dev may hold an Ilastik installation
+ROOT_PRUNED_DIRS = {"dev", "proc", "run", "sys", "Windows"}
+# Name of an installation directory, e.g. 'ilastik-1.4.0-Linux' or 'ilastik-1.4.1rc2-OSX.app'
+VERSION_PATTERN = re.compile(r"ilastik-?(\d+(?:\.\d+)*)", re.IGNORECASE)
+
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smbfs", "smb3", "sshfs", "fuse.sshfs", "afs", "9p", "davfs"}
+
 
 def get_os() -> str:
     """
@@ -26,48 +65,231 @@ def get_os() -> str:
     return platform.system()
 
 
-def find_file(filename: str, start_path: str) -> str:
+def get_cache_file() -> Path:
+    """
+    Return the path of the file caching the location of the Ilastik executable.
+
+    Returns
+    -------
+    Path
+        The path of the cache file, in the user cache directory of the current operating system.
+    """
+    os_name = get_os()
+    if os_name == "Windows":  # noqa: PLR2004
+        cache_dir = Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+    elif os_name == "Darwin":  # noqa: PLR2004
+        cache_dir = Path.home() / "Library" / "Caches"
+    else:
+        cache_dir = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    return cache_dir / "easilastik" / "ilastik_path"
+
+
+def read_cache() -> str | None:
+    """
+    Read the cached location of the Ilastik executable.
+
+    Returns
+    -------
+    str | None
+        The cached path, or None if there is no cache or if the cached executable no longer exists.
+    """
+    try:
+        cached_path = get_cache_file().read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return cached_path if cached_path and Path(cached_path).is_file() else None
+
+
+def write_cache(ilastik_path: str) -> None:
+    """
+    Save the location of the Ilastik executable in the cache.
+
+    Parameters
+    ----------
+    ilastik_path : str
+        The path to the Ilastik executable.
+    """
+    cache_file = get_cache_file()
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(ilastik_path, encoding="utf-8")
+        tmp_file.replace(cache_file)
+    except OSError:
+        logger.debug("Could not write the Ilastik path cache at %s", cache_file)
+
+
+def clear_cache() -> None:
+    """Forget the cached location of the Ilastik executable."""
+    get_cache_file().unlink(missing_ok=True)
+
+
+def find_in_known_locations(os_name: str) -> str | None:
+    """
+    Search for the Ilastik executable in the usual installation directories.
+
+    Parameters
+    ----------
+    os_name : str
+        The name of the operating system, as returned by `get_os`.
+
+    Returns
+    -------
+    str | None
+        The path to the executable of the most recent version found, else None.
+    """
+    roots, patterns = KNOWN_LOCATIONS.get(os_name, ([], []))
+    candidates = [
+        path
+        for root in roots
+        if Path(root).expanduser().is_dir()
+        for pattern in patterns
+        for path in Path(root).expanduser().glob(pattern)
+        if path.is_file()
+    ]
+    if not candidates:
+        return None
+    return str(max(candidates, key=get_version))
+
+
+def get_version(path: Path) -> tuple:
+    """
+    Return the version of an Ilastik installation from the name of its directory.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the Ilastik executable, in a directory named e.g. 'ilastik-1.4.0-Linux'.
+
+    Returns
+    -------
+    tuple
+        The numbers of the version, compared as integers, or an empty tuple if no directory of the path is named
+        after a version. The digits of the other directories (e.g. '/opt/build2024') are ignored.
+    """
+    for part in reversed(path.parts):
+        if match := VERSION_PATTERN.match(part):
+            return tuple(int(number) for number in match.group(1).split("."))
+    return ()
+
+
+def is_pruned(parent: str, name: str) -> bool:
+    """Return whether the full scan skips the subdirectory name of parent."""
+    if name.startswith(".") or name in PRUNED_DIRS:
+        return True
+    # The parent of the root of a filesystem (e.g. '/' or 'C:\\') is itself
+    return name in ROOT_PRUNED_DIRS and Path(parent).resolve().parent == Path(parent).resolve()
+
+
+def get_network_mounts() -> set:
+    """
+    Return the mount points of network filesystems.
+
+    Returns
+    -------
+    set
+        The mount points of network filesystems (only available on Linux, empty elsewhere).
+    """
+    network_mounts = set()
+    try:
+        with Path("/proc/mounts").open(encoding="utf-8") as mounts:
+            for line in mounts:
+                # Each line is "device mount_point filesystem options dump pass"
+                _, mount_point, filesystem, *_ = line.split()
+                if filesystem in NETWORK_FILESYSTEMS:
+                    network_mounts.add(mount_point)
+    except (OSError, ValueError):
+        return set()
+    return network_mounts
+
+
+def find_file(filename: str, start_path: str, timeout: float = TIME_OUT) -> str:
     """
     Search for a specified file starting from a specified path.
 
+    The subdirectories of start_path are walked in parallel. Hidden directories, system directories and network
+    filesystems are skipped, and the search stops as soon as the file is found or the timeout is reached.
+
     Parameters
     ----------
     filename : str
         The name of the file to search for.
     start_path : str
         The path to start the search from.
+    timeout : float, optional
+        The maximum duration of the search in seconds. Default is 60.
 
     Returns
     -------
     str
-        The path to the file if found, else None.
+        The path to the file if found, else an empty string.
     """
-    start_time = time.time()
+    deadline = time.monotonic() + timeout
+    found = threading.Event()
+    pruned_paths = get_network_mounts()
 
-    try:
-        for root, _, files in os.walk(start_path):
-            if time.time() - start_time > TIME_OUT:
-                logger.warning("Search timed out.")
+    def walk(top: str) -> str:
+        for root, dirs, files in os.walk(top):
+            if found.is_set() or time.monotonic() > deadline:
                 return ""
             if filename in files:
+                found.set()
                 return str(Path(root) / filename)
+            dirs[:] = [
+                name for name in dirs if not is_pruned(root, name) and str(Path(root) / name) not in pruned_paths
+            ]
+        return ""
+
+    try:
+        if (Path(start_path) / filename).is_file():
+            return str(Path(start_path) / filename)
+        with os.scandir(start_path) as entries:
+            tops = [
+                entry.path
+                for entry in entries
+                if entry.is_dir(follow_symlinks=False)
+                and not is_pruned(start_path, entry.name)
+                and entry.path not in pruned_paths
+            ]
+        with ThreadPoolExecutor(max_workers=min(32, len(tops) or 1)) as executor:
+            for result in executor.map(walk, tops):
+                if result:
+                    return result
     except Exception:
         msg = f"An error occurred while searching for {filename}"
         logger.exception(msg)
         return ""
 
+    if time.monotonic() > deadline:
+        logger.warning("Search timed out.")
     return ""
 
 
-def find_ilastik() -> str | None:
+def find_ilastik(*, full_scan: bool | None = None, use_cache: bool = True) -> str | None:
     """
     Search for the Ilastik executable file on the current operating system.
 
+    Parameters
+    ----------
+    full_scan : bool, optional
+        Whether to scan the whole disk if the executable is not found in the usual places. This can take up to a
+        minute. Default is False, unless the `EASILASTIK_FULL_SCAN` environment variable is set to 1.
+    use_cache : bool, optional
+        Whether to use and update the discovery cache. Default is True.
+
     Returns
     -------
     str | None
         The path to the Ilastik executable if found, else None.
     """
+    if explicit_path := os.environ.get(ILASTIK_PATH_ENV):
+        if Path(explicit_path).is_file():
+            return explicit_path
+        logger.warning("%s is set to '%s', which is not a file.", ILASTIK_PATH_ENV, explicit_path)
+
+    if use_cache and (cached_path := read_cache()) is not None:
+        return cached_path
+
     os_name = get_os()
 
     if os_name in {"Darwin", "Linux"}:
@@ -81,4 +303,14 @@ def find_ilastik() -> str | None:
         logger.error(msg)
         return None
 
-    return find_file(filename, start_path)
+    if full_scan is None:
+        full_scan = os.environ.get(FULL_SCAN_ENV) == "1"  # noqa: PLR2004
+
+    ilastik_path = shutil.which(filename) or find_in_known_locations(os_name)
+    if ilastik_path is None and full_scan:
+        logger.info("Scanning %s for %s, this may take a while.", start_path, filename)
+        ilastik_path = find_file(filename, start_path) or None
+
+    if ilastik_path is not None and use_cache:
+        write_cache(ilastik_path)
+    return ilastik_path
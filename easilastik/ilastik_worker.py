@@ -0,0 +1,106 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Worker script executed by the Python interpreter bundled with Ilastik.
+
+The worker loads an Ilastik project once and then processes batches of images sent by `IlastikSession`. Requests
+and responses are JSON documents, one per line: requests are read from stdin and responses are written to the
+original stdout, prefixed by `RESPONSE_PREFIX`. Everything else Ilastik prints is redirected to stderr.
+
+This file is run as a standalone script and must not import anything from easilastik.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+
+
+RESPONSE_PREFIX = "@easilastik:"
+
+
+def load_shell(project: str) -> object:
+    """
+    Load an Ilastik project in headless mode.
+
+    Parameters
+    ----------
+    project : str
+        The path to the Ilastik project file.
+
+    Returns
+    -------
+    object
+        The Ilastik headless shell holding the loaded workflow.
+    """
+    try:
+        from ilastik import app  # noqa: PLC0415
+    except ImportError:  # Ilastik < 1.4
+        import ilastik_main as app  # noqa: PLC0415
+
+    parsed_args, workflow_cmdline_args = app.parse_known_args(["--headless", "--readonly", "--project=" + project])
+    return app.main(parsed_args, workflow_cmdline_args, init_logging=False)
+
+
+def run_batch(shell: object, request: dict) -> None:
+    """
+    Export a batch of images with the workflow of an already loaded project.
+
+    Parameters
+    ----------
+    shell : object
+        The Ilastik headless shell returned by `load_shell`.
+    request : dict
+        The request holding the `inputs` and the `export_source`, `output_format` and `output_filename_format`
+        export settings.
+    """
+    workflow = shell.workflow
+    export_args, _ = workflow.dataExportApplet.parse_known_cmdline_args(
+        [
+            "--export_source=" + request["export_source"],
+            "--output_format=" + request["output_format"],
+            "--output_filename_format=" + request["output_filename_format"],
+        ]
+    )
+    workflow.dataExportApplet.configure_operator_with_parsed_args(export_args)
+
+    role_names = getattr(workflow, "ROLE_NAMES", ["Raw Data"])
+    input_args, _ = workflow.batchProcessingApplet.parse_known_cmdline_args(request["inputs"], role_names)
+    workflow.batchProcessingApplet.run_export_from_parsed_args(input_args)
+
+
+def main() -> None:
+    """Serve batch requests until stdin is closed."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--project", required=True)
+    args = parser.parse_args()
+
+    # Keep the real stdout for the protocol and send any other output to stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def respond(message: dict) -> None:
+        channel.write(RESPONSE_PREFIX + json.dumps(message) + "\n")
+        channel.flush()
+
+    shell = load_shell(args.project)
+    respond({"event": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        start_time = time.perf_counter()
+        try:
+            run_batch(shell, request)
+        except Exception:  # noqa: BLE001
+            respond({"id": request.get("id"), "ok": False, "error": traceback.format_exc()})
+        else:
+            respond({"id": request.get("id"), "ok": True, "elapsed": time.perf_counter() - start_time})
+
+
+if __name__ == "__main__":
+    main()
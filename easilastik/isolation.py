@@ -0,0 +1,282 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Isolate the images on which Ilastik fails, so that a bad image does not fail its whole batch.
+
+A failed batch is not run again as a whole: the outputs Ilastik completed before the failure are kept (the outputs
+of a batch are removed before it runs, so that outputs of a previous run are not taken for them). Ilastik processes
+the images of its command line in order, so when it completed some of them, the first image left is the suspect: it
+is run alone and the images after it as a new batch. A batch which failed before completing any output is split in
+two halves, so that a single bad image among n costs about 2 log2(n) extra processes. An image which fails alone is
+retried after an increasing delay, in case the failure was transient (a busy file system, a lack of memory), then
+reported as failed with the end of the error output of Ilastik.
+"""
+
+from __future__ import annotations
+
+import collections
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.metrics import run_process
+from easilastik.parallel import shard_paths
+from easilastik.pipeline import is_readable
+from easilastik.utils import split_command_line
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    from easilastik.metrics import RunMetrics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Number of lines of the error output of Ilastik kept for each failed image
+STDERR_LINES = 20
+
+
+class FailureIsolation:
+    """
+    Find the images on which Ilastik fails and process the others, instead of failing the whole batch.
+
+    Pass it as the `isolation` argument of `run_ilastik` or `run_ilastik_probabilities`, which then return its
+    `result` rather than raising an error when Ilastik fails on some images.
+
+    Parameters
+    ----------
+    retries : int, optional
+        The number of times an image failing alone is processed again before being reported as failed. Default
+        is 2.
+    retry_delay : float, optional
+        The delay in seconds before the first retry of an image, doubled at each retry. Default is 1.
+    max_failures : int, optional
+        If provided, once this number of images failed, the images not processed yet are skipped, e.g. because the
+        project cannot be loaded and every image would fail. Default is None (no limit).
+
+    Attributes
+    ----------
+    succeeded : list
+        The paths of the images processed by Ilastik.
+    failed : dict
+        The end of the error output of Ilastik (or the error message) for each image which failed, keyed by path.
+    skipped : list
+        The paths of the images not processed: their outputs were already complete (see the resume and cache
+        arguments of `run_ilastik`) or max_failures was reached.
+    n_processes : int
+        The number of Ilastik processes run, including the ones which failed.
+    """
+
+    def __init__(self, retries: int = 2, retry_delay: float = 1.0, max_failures: int | None = None) -> None:
+        if retries < 0:
+            msg = f"retries must be a non-negative integer, got {retries}"
+            raise ValueError(msg)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_failures = max_failures
+        self.succeeded = []
+        self.failed = {}
+        self.skipped = []
+        self.n_processes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def result(self) -> dict:
+        """The paths of the images which 'succeeded', 'failed' (with their error output) and were 'skipped'."""
+        with self._lock:
+            return {"succeeded": list(self.succeeded), "failed": dict(self.failed), "skipped": list(self.skipped)}
+
+    def add_failures(self, errors: dict) -> None:
+        """Record images which failed outside of Ilastik processes, with their errors keyed by path."""
+        with self._lock:
+            self.failed.update({str(path): str(error) for path, error in errors.items()})
+
+    def add_skipped(self, paths: Iterable) -> None:
+        """Record images which are not processed."""
+        with self._lock:
+            self.skipped.extend(str(path) for path in paths)
+
+    def run(
+        self,
+        ilastik_args: list,
+        image_arg: list,
+        get_output: Callable[[str], str],
+        *,
+        workers: int = 1,
+        env: dict | None = None,
+        on_batch: Callable[[list], object] | None = None,
+        metrics: RunMetrics | None = None,
+    ) -> None:
+        """
+        Execute Ilastik on a list of images, isolating the images on which it fails.
+
+        Parameters
+        ----------
+        ilastik_args : list
+            The Ilastik command line without the images.
+        image_arg : list
+            The paths of the images to process.
+        get_output : Callable[[str], str]
+            Returns the path of the output file of an image.
+        workers : int, optional
+            The number of Ilastik processes to run concurrently. The images are split into as many shards of
+            balanced total size, and each process takes the next batch left. Default is 1.
+        env : dict, optional
+            The environment of the Ilastik processes. Default is the current environment.
+        on_batch : Callable[[list], object], optional
+            Called from the thread of a process with the paths of the images whose outputs are complete, once a
+            process exits.
+        metrics : RunMetrics, optional
+            The metrics receiving the resource usage of each Ilastik process.
+
+        Raises
+        ------
+        OSError
+            If Ilastik cannot be executed at all. The images are not isolated then.
+        """
+        # Each item is a batch of images and the number of times it was run alone
+        shards = shard_paths(image_arg, workers) if workers > 1 else [image_arg]
+        pending = collections.deque(
+            (batch, 0) for shard in shards for batch in split_command_line(ilastik_args, shard)
+        )
+        condition = threading.Condition()
+        running = 0
+        error = None
+
+        def take() -> tuple | None:
+            nonlocal running
+            with condition:
+                while not pending and running and error is None:
+                    condition.wait()
+                if not pending or error is not None:
+                    return None
+                running += 1
+                return pending.popleft()
+
+        def work() -> None:
+            nonlocal running, error
+            while (item := take()) is not None:
+                try:
+                    retried = self.run_batch(ilastik_args, *item, get_output, env, on_batch, metrics)
+                except Exception as batch_error:  # noqa: BLE001
+                    retried = []
+                    with condition:
+                        error = batch_error
+                with condition:
+                    pending.extendleft(reversed(retried))
+                    running -= 1
+                    self.skip_pending(pending)
+                    condition.notify_all()
+
+        n_processes = self.n_processes
+        n_threads = max(1, min(workers, len(image_arg)))
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            # The errors of the batches are caught by work, and raised once the other threads are done
+            for _ in range(n_threads):
+                executor.submit(work)
+        if error is not None:
+            raise error
+        if self.failed:
+            logger.error(
+                "Ilastik failed on %d images, found with %d Ilastik processes.",
+                len(self.failed),
+                self.n_processes - n_processes,
+            )
+
+    def run_batch(
+        self,
+        ilastik_args: list,
+        batch: list,
+        attempt: int,
+        get_output: Callable[[str], str],
+        env: dict | None,
+        on_batch: Callable[[list], object] | None,
+        metrics: RunMetrics | None,
+    ) -> list:
+        """
+        Execute Ilastik on a batch of images and split it if Ilastik fails.
+
+        The outputs of the images of the batch are removed before Ilastik runs, so that only the outputs it writes
+        count as complete after a failure.
+
+        Parameters
+        ----------
+        ilastik_args : list
+            The Ilastik command line without the images.
+        batch : list
+            The paths of the images of the batch.
+        attempt : int
+            The number of times the batch was already run alone, for a single image.
+        get_output, env, on_batch, metrics
+            See `run`.
+
+        Returns
+        -------
+        list
+            The batches to run next, as (batch, attempt) tuples.
+        """
+        if attempt > 0:
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+        # Outputs left by a previous run would be taken for outputs completed before a failure
+        for path in batch:
+            if (output_path := get_output(path)) is not None:
+                Path(output_path).unlink(missing_ok=True)
+        batch_args = [*ilastik_args, *(str(path) for path in batch)]
+        with self._lock:
+            self.n_processes += 1
+        try:
+            run_process(batch_args, env=env, metrics=metrics, n_images=len(batch), stderr_lines=STDERR_LINES)
+        except subprocess.CalledProcessError as error:
+            stderr = error.stderr or str(error)
+        else:
+            self.add_succeeded(batch, on_batch)
+            return []
+
+        # Keep the outputs completed before the failure
+        complete = [is_complete(get_output(path)) for path in batch]
+        self.add_succeeded([path for path, done in zip(batch, complete, strict=True) if done], on_batch)
+        remaining = [path for path, done in zip(batch, complete, strict=True) if not done]
+
+        if not remaining:
+            return []
+        if len(remaining) == 1:
+            if len(batch) > 1 or attempt < self.retries:
+                logger.warning("Ilastik failed on %s, retrying it alone.", remaining[0])
+                return [(remaining, 0 if len(batch) > 1 else attempt + 1)]
+            logger.error("Ilastik failed on %s after %d retries.", remaining[0], self.retries)
+            Path(get_output(remaining[0])).unlink(missing_ok=True)
+            with self._lock:
+                self.failed[str(remaining[0])] = stderr
+            return []
+        if len(remaining) < len(batch):
+            # Ilastik stopped at the first image left
+            return [(remaining[:1], 0), (remaining[1:], 0)]
+        half = len(remaining) // 2
+        return [(remaining[:half], 0), (remaining[half:], 0)]
+
+    def skip_pending(self, pending: collections.deque) -> None:
+        """Skip the batches left once max_failures images failed, the lock of the pending batches being held."""
+        if self.max_failures is None or len(self.failed) < self.max_failures or not pending:
+            return
+        logger.error("%d images failed, skipping the %d batches left.", len(self.failed), len(pending))
+        self.add_skipped(path for batch, _ in pending for path in batch)
+        pending.clear()
+
+    def add_succeeded(self, batch: list, on_batch: Callable[[list], object] | None) -> None:
+        """Record the images of a batch whose outputs are complete and report them to on_batch."""
+        if not batch:
+            return
+        with self._lock:
+            self.succeeded.extend(str(path) for path in batch)
+        if on_batch is not None:
+            on_batch(batch)
+
+
+def is_complete(output_path: str | None) -> bool:
+    """Return whether Ilastik completed an output file."""
+    return output_path is not None and Path(output_path).is_file() and is_readable(output_path)
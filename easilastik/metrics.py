@@ -0,0 +1,374 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Measure where the time of a run goes.
+
+A `RunMetrics` object passed to `run_ilastik`, `run_ilastik_probabilities` or `treshold_probabilities` records the
+duration of each stage (discovery of the images, Ilastik, reading of the probabilities, coloring, writing of the
+images), per image and in total, the wall time, CPU time, peak memory and block I/O of each Ilastik process (taken
+from the resource usage of the child process where the platform reports it), and the bytes read and written by the
+post-processing. Each measure is sent to an optional callback as soon as it is taken, and the whole run is written
+as a JSON report in the result folder when it ends.
+"""
+
+from __future__ import annotations
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+REPORT_NAME = "easilastik_report.json"
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS, block counts are in units of 512 bytes
+MAXRSS_BYTES = 1 if sys.platform == "darwin" else 1024  # noqa: PLR2004
+BLOCK_BYTES = 512
+
+
+class RunMetrics:
+    """
+    Collect the timings and resource usage of a run.
+
+    Parameters
+    ----------
+    on_event : Callable[[dict], object], optional
+        Called with each measure as soon as it is taken, possibly from several threads: a dict whose 'event' is
+        'stage' (a stage of an image or of the run), 'process' (an Ilastik process which exited) or 'run' (the
+        whole report, once the run ends).
+    report : bool, optional
+        Whether to write the report as `easilastik_report.json` in the result folder when the run ends. Default
+        is True.
+
+    Examples
+    --------
+    >>> metrics = RunMetrics(on_event=lambda event: monitoring.send(event))
+    >>> run_ilastik_probabilities("images/", "model.ilp", "results/", 0.7, [255, 0, 0], colors, metrics=metrics)
+    >>> metrics.stages
+    {'discovery': 0.01, 'ilastik': 812.4, 'read': 35.2, 'colorize': 12.9, 'write': 41.0}
+    """
+
+    def __init__(self, on_event: Callable[[dict], object] | None = None, *, report: bool = True) -> None:
+        self.on_event = on_event
+        self.report = report
+        self.stages = {}
+        self.images = {}
+        self.processes = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.report_path = None
+
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._start_time = None
+        self._started_at = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str, item: str | None = None) -> Iterator[None]:
+        """
+        Time a stage of the run.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage, e.g. 'read'.
+        item : str, optional
+            The image or file the stage belongs to, if any.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start_time, item)
+
+    def add_stage(self, name: str, seconds: float, item: str | None = None) -> None:
+        """
+        Record the duration of a stage.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        seconds : float
+            Its duration.
+        item : str, optional
+            The image or file the stage belongs to, if any.
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            if item is not None:
+                timings = self.images.setdefault(str(item), {})
+                timings[name] = timings.get(name, 0.0) + seconds
+        item = None if item is None else str(item)
+        self._emit({"event": "stage", "stage": name, "item": item, "seconds": seconds})
+
+    def add_bytes(self, *, read: int = 0, written: int = 0) -> None:
+        """
+        Record bytes read or written by the post-processing.
+
+        Parameters
+        ----------
+        read : int, optional
+            The number of bytes read.
+        written : int, optional
+            The number of bytes written.
+        """
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def add_process(self, n_images: int, returncode: int, wall: float, usage: object | None) -> None:
+        """
+        Record an Ilastik process which exited.
+
+        Parameters
+        ----------
+        n_images : int
+            The number of images it processed.
+        returncode : int
+            Its exit code.
+        wall : float
+            The seconds between its start and its exit.
+        usage : object | None
+            Its resource usage, as returned by `os.wait4`, or None if the platform does not report it.
+        """
+        record = {
+            "event": "process",
+            "images": n_images,
+            "returncode": returncode,
+            "wall_seconds": wall,
+        }
+        if usage is not None:
+            record.update(
+                {
+                    "user_cpu_seconds": usage.ru_utime,
+                    "system_cpu_seconds": usage.ru_stime,
+                    "peak_rss_bytes": usage.ru_maxrss * MAXRSS_BYTES,
+                    "read_bytes": usage.ru_inblock * BLOCK_BYTES,
+                    "written_bytes": usage.ru_oublock * BLOCK_BYTES,
+                }
+            )
+        with self._lock:
+            self.processes.append(record)
+        self.add_stage("ilastik", wall)
+        self._emit(record)
+
+    @contextlib.contextmanager
+    def run(self, result_base_path: str) -> Iterator[None]:
+        """
+        Delimit a run, which is reported when the outermost run ends.
+
+        Parameters
+        ----------
+        result_base_path : str
+            The base path where the results are saved, where the report is written.
+        """
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._start_time = time.perf_counter()
+                self._started_at = time.time()
+        status = "failed"
+        try:
+            yield
+            status = "succeeded"
+        finally:
+            with self._lock:
+                self._depth -= 1
+                outermost = self._depth == 0
+            if outermost:
+                self._finish(result_base_path, status)
+
+    def to_dict(self) -> dict:
+        """
+        Return the report of the run.
+
+        Returns
+        -------
+        dict
+            'stages' (the total seconds of each stage, summed over the threads and processes running it),
+            'images' (the seconds of each stage of each image), 'processes' (the Ilastik processes), 'bytes_read'
+            and 'bytes_written'. The report sent when the run ends also holds its 'status', 'started_at' (a Unix
+            timestamp) and 'wall_seconds'.
+        """
+        with self._lock:
+            return {
+                "stages": dict(self.stages),
+                "images": {item: dict(timings) for item, timings in self.images.items()},
+                "processes": list(self.processes),
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+    def _finish(self, result_base_path: str, status: str) -> None:
+        """Write the report and send it to the callback."""
+        report = {
+            "event": "run",
+            "status": status,
+            "started_at": self._started_at,
+            "wall_seconds": time.perf_counter() - self._start_time,
+            **self.to_dict(),
+        }
+        if self.report and Path(result_base_path).is_dir():
+            self.report_path = Path(result_base_path) / REPORT_NAME
+            tmp_path = self.report_path.with_name(f".{REPORT_NAME}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+            tmp_path.replace(self.report_path)
+        self._emit(report)
+
+    def _emit(self, event: dict) -> None:
+        """Send a measure to the callback, without letting its errors stop the run."""
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event)
+        except Exception:
+            logger.exception("Error in the metrics callback")
+
+
+def measure(metrics: RunMetrics | None, name: str, item: str | None = None) -> contextlib.AbstractContextManager:
+    """
+    Time a stage if metrics are collected.
+
+    Parameters
+    ----------
+    metrics : RunMetrics | None
+        The metrics of the run, or None.
+    name : str
+        The name of the stage.
+    item : str, optional
+        The image or file the stage belongs to, if any.
+
+    Returns
+    -------
+    contextlib.AbstractContextManager
+        A context manager timing its block, which does nothing without metrics.
+    """
+    return contextlib.nullcontext() if metrics is None else metrics.stage(name, item)
+
+
+def measure_run(metrics: RunMetrics | None, result_base_path: str) -> contextlib.AbstractContextManager:
+    """
+    Delimit a run if metrics are collected, see `RunMetrics.run`.
+
+    Parameters
+    ----------
+    metrics : RunMetrics | None
+        The metrics of the run, or None.
+    result_base_path : str
+        The base path where the results are saved.
+
+    Returns
+    -------
+    contextlib.AbstractContextManager
+        A context manager reporting the run when it ends, which does nothing without metrics.
+    """
+    return contextlib.nullcontext() if metrics is None else metrics.run(result_base_path)
+
+
+def wait_child(process: subprocess.Popen, *, block: bool = True) -> tuple[int | None, object | None]:
+    """
+    Wait for a child process and return its resource usage.
+
+    Parameters
+    ----------
+    process : subprocess.Popen
+        The child process.
+    block : bool, optional
+        Whether to wait until the process exits. Default is True.
+
+    Returns
+    -------
+    tuple[int | None, object | None]
+        The exit code, or None if the process is still running, and the resource usage of the process as returned
+        by `os.wait4`, or None if it is not available on the platform or the process was already reaped.
+    """
+    if process.returncode is not None or not hasattr(os, "wait4"):
+        return (process.wait() if block else process.poll()), None
+    pid, status, usage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None, None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+def run_process(
+    args: list,
+    *,
+    env: dict | None = None,
+    metrics: RunMetrics | None = None,
+    n_images: int = 0,
+    stderr_lines: int = 0,
+) -> object | None:
+    """
+    Execute a command line, recording its resource usage.
+
+    Parameters
+    ----------
+    args : list
+        The command line.
+    env : dict, optional
+        The environment of the process. Default is the current environment.
+    metrics : RunMetrics, optional
+        The metrics receiving the usage of the process.
+    n_images : int, optional
+        The number of images on the command line, recorded with the usage. Default is 0.
+    stderr_lines : int, optional
+        If positive, the error output of the process is still printed but its last stderr_lines lines are kept, and
+        attached to the `subprocess.CalledProcessError` as its stderr attribute. Default is 0.
+
+    Returns
+    -------
+    object | None
+        The resource usage of the process as returned by `os.wait4`, or None if the platform does not report it.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If the process exits with a non-zero code.
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen(args, env=env, stderr=subprocess.PIPE if stderr_lines > 0 else None)  # noqa: S603
+    tail = collections.deque(maxlen=max(stderr_lines, 1))
+    reader = None
+    if stderr_lines > 0:
+        # The pipe is drained by a thread, so that a process writing a lot of errors does not block on it
+        reader = threading.Thread(target=tee_lines, args=(process.stderr, tail), daemon=True)
+        reader.start()
+    try:
+        returncode, usage = wait_child(process)
+    except BaseException:
+        # Do not leave the process running if the wait is interrupted
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        if reader is not None:
+            reader.join()
+            process.stderr.close()
+    if metrics is not None:
+        metrics.add_process(n_images, returncode, time.perf_counter() - start_time, usage)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args, stderr="".join(tail) if reader is not None else None)
+    return usage
+
+
+def tee_lines(stream: object, tail: collections.deque) -> None:
+    """Copy the lines of a binary stream to sys.stderr, keeping the last ones in tail."""
+    for raw_line in iter(stream.readline, b""):
+        line = raw_line.decode(errors="replace")
+        sys.stderr.write(line)
+        tail.append(line)
@@ -0,0 +1,347 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Apply several Ilastik projects to the same images with a single pool of workers.
+
+The images are listed once, then split into shards for each project. The (project, shard) jobs are run by a single
+pool of Ilastik processes, so that the projects share the machine instead of competing for it. The outputs of each
+project are written in its own subfolder of the result folder, and an index lists the outputs of each image.
+"""
+
+from __future__ import annotations
+
+import csv
+import functools
+import itertools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.checkpoint import RunManifest
+from easilastik.errors import BatchError
+from easilastik.find_ilastik import find_ilastik
+from easilastik.metrics import measure, measure_run
+from easilastik.parallel import get_shard_env, shard_paths
+from easilastik.pipeline import get_signature
+from easilastik.run_ilastik import build_ilastik_args, check_arguments, execute_ilastik, report_outputs
+from easilastik.utils import get_input_paths, get_output_path, split_command_line
+
+
+if TYPE_CHECKING:
+    from easilastik.metrics import RunMetrics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "easilastik_index.csv"
+
+
+def get_model_result_path(result_base_path: str, name: str) -> str:
+    """Return the base path of the outputs of a project, in its subfolder of result_base_path."""
+    return str(Path(result_base_path) / name) + os.sep
+
+
+def get_model_specs(specs: list) -> list:
+    """
+    Normalize the projects applied to the images and name their result subfolders.
+
+    Parameters
+    ----------
+    specs : list
+        The projects, each one being the path to an Ilastik project file or a tuple (model_path, export_source,
+        output_format), optionally followed by the name of its result subfolder.
+
+    Returns
+    -------
+    list
+        A tuple (name, model_path, export_source, output_format) for each project. Unless given, the name is the
+        stem of the project file, followed by the export source if several specs use projects with the same stem.
+
+    Raises
+    ------
+    ValueError
+        If specs is empty, if two specs are identical, or if two specs get the same name (e.g. projects with the
+        same stem in different folders, applied with the same export source).
+    """
+    if not specs:
+        msg = "specs must contain at least one project"
+        raise ValueError(msg)
+
+    specs = [(spec, "Simple Segmentation", "png") if isinstance(spec, str) else tuple(spec) for spec in specs]
+    unnamed = [spec[:3] for spec in specs]
+    stems = [Path(model_path).stem for model_path, _, _ in unnamed]
+    named_specs = []
+    for stem, spec in zip(stems, specs, strict=True):
+        model_path, export_source, output_format, *name = spec
+        if not name:
+            name = [stem if stems.count(stem) == 1 else f"{stem}_{export_source.replace(' ', '_')}"]
+        named_specs.append((name[0], model_path, export_source, output_format))
+
+    for spec in unnamed:
+        if unnamed.count(spec) > 1:
+            msg = f"Each project must be applied with a different export source, got {spec} twice"
+            raise ValueError(msg)
+    names = [name for name, *_ in named_specs]
+    for name in names:
+        if names.count(name) > 1:
+            colliding = [model_path for other, model_path, _, _ in named_specs if other == name]
+            msg = (
+                f"The result subfolders of {colliding} are both named '{name}', from the stems of the project files. "
+                "Pass explicit names as a fourth element of the specs, e.g. (model_path, export_source, "
+                "output_format, name)."
+            )
+            raise ValueError(msg)
+    return named_specs
+
+
+def write_index(index_path: Path, index: dict, names: list) -> None:
+    """
+    Write the outputs of each image as a CSV file.
+
+    Parameters
+    ----------
+    index_path : Path
+        The path of the CSV file.
+    index : dict
+        The output of each project for each image, as returned by `run_ilastik_models`.
+    names : list
+        The names of the projects, one column each.
+    """
+    tmp_path = index_path.with_name(f".{index_path.name}.tmp")
+    with tmp_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image", *names])
+        for image_path, outputs in index.items():
+            writer.writerow([image_path, *(outputs[name] or "" for name in names)])
+    tmp_path.replace(index_path)
+
+
+def run_ilastik_models(
+    input_path: str,
+    specs: list,
+    result_base_path: str,
+    ilastik_script_path: str | None = None,
+    *,
+    workers: int = 1,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    resume: bool = False,
+    metrics: RunMetrics | None = None,
+) -> dict:
+    """
+    Execute several Ilastik projects on the same images, sharing a single pool of Ilastik processes.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    specs : list
+        The projects to apply, each one being the path to an Ilastik project file (exporting its "Simple
+        Segmentation" as png) or a tuple (model_path, export_source, output_format), optionally followed by the
+        name of its result subfolder. The output format must be written as a single file per image.
+    result_base_path : str
+        The base path where the results are saved. The outputs of each project are written in a subfolder named
+        after the project file or given in its spec (see `get_model_specs`), and the index in
+        `easilastik_index.csv`.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    workers : int, optional
+        The number of Ilastik processes to run concurrently, for all the projects. Default is 1. The images are
+        split into this number of shards for each project, and the jobs of the different projects are interleaved
+        so that all the projects progress together.
+    threads_per_worker : int, optional
+        The number of threads of each Ilastik process (LAZYFLOW_THREADS). Default is the number of CPUs divided by
+        the number of workers.
+    ram_per_worker_mb : int, optional
+        The amount of RAM in MB of each Ilastik process (LAZYFLOW_TOTAL_RAM_MB). Default is the total RAM divided
+        by the number of workers.
+    resume : bool, optional
+        Whether to skip, for each project, the images already processed by a previous run, see `run_ilastik`.
+        Default is False.
+    metrics : RunMetrics, optional
+        Collects the duration of each stage of the run and the resource usage of each Ilastik process, see
+        `run_ilastik`.
+
+    Returns
+    -------
+    dict
+        For each input image, the path of the output of each project keyed by the project name, or None if the
+        project did not write it during this run (outputs left by a previous run are only listed for the images
+        skipped with resume). The same index is written to `easilastik_index.csv` in result_base_path.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the input_path does not exist.
+    ValueError
+        If a spec is not valid.
+    BatchError
+        If Ilastik failed on some of the jobs, once the other jobs are done and the index is written. The `errors`
+        attribute maps each failed job, a tuple (model_path, paths of the images), to its error.
+    """
+    if workers < 1:
+        msg = f"workers must be a positive integer, got {workers}"
+        raise ValueError(msg)
+
+    specs = get_model_specs(specs)
+    for _, _, export_source, output_format in specs:
+        check_arguments(input_path, export_source, output_format, single_file=True)
+
+    ilastik_script_path = ilastik_script_path or find_ilastik()
+    if ilastik_script_path is None:
+        logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
+        return {}
+
+    with measure_run(metrics, result_base_path):
+        # The images are listed once for all the projects
+        with measure(metrics, "discovery"):
+            image_arg = get_input_paths(input_path)
+
+        jobs_by_model = []
+        # The outputs of the images each project processes, with their signature before the run
+        initial_signatures = {}
+        for spec in specs:
+            model_jobs, signatures = build_model_jobs(
+                spec, image_arg, result_base_path, ilastik_script_path, workers=workers, resume=resume, metrics=metrics
+            )
+            jobs_by_model.append(model_jobs)
+            initial_signatures.update(signatures)
+
+        # Interleave the projects, so that all of them progress together
+        jobs = [job for shard_jobs in itertools.zip_longest(*jobs_by_model) for job in shard_jobs if job is not None]
+        logger.info("Processing %d images with %d projects in %d jobs.", len(image_arg), len(specs), len(jobs))
+
+        errors = {}
+        if jobs:
+            env = get_shard_env(min(workers, len(jobs)), threads_per_worker, ram_per_worker_mb)
+            with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                futures = [executor.submit(run_job, job, env, metrics) for job in jobs]
+                for (model_path, _, shard, _), future in zip(jobs, futures, strict=True):
+                    if (error := future.exception()) is not None:
+                        logger.error("Error during conversion of %d images with %s: %s", len(shard), model_path, error)
+                        errors[(model_path, tuple(str(path) for path in shard))] = error
+
+        with measure(metrics, "index"):
+            index = build_index(image_arg, specs, result_base_path, initial_signatures)
+            write_index(Path(result_base_path) / INDEX_NAME, index, [name for name, *_ in specs])
+
+        if errors:
+            msg = f"Error during Ilastik execution of {len(errors)}/{len(jobs)} jobs. See console output for details."
+            raise BatchError(msg, errors)
+
+    msg = f"Conversion of {input_path} with {len(specs)} projects completed successfully."
+    logger.info(msg)
+    return index
+
+
+def build_model_jobs(
+    spec: tuple,
+    image_arg: list,
+    result_base_path: str,
+    ilastik_script_path: str,
+    *,
+    workers: int,
+    resume: bool,
+    metrics: RunMetrics | None,
+) -> tuple[list, dict]:
+    """
+    Build the jobs applying a project to the images, see `run_ilastik_models`.
+
+    Parameters
+    ----------
+    spec : tuple
+        The project, as a tuple (name, model_path, export_source, output_format) returned by `get_model_specs`.
+    image_arg : list
+        The paths of the images.
+    result_base_path : str
+        The base path where the results are saved, the outputs of the project being written in its subfolder.
+    ilastik_script_path : str
+        The path to the Ilastik script.
+    workers : int
+        The number of shards of the images.
+    resume : bool
+        Whether to skip the images already processed by a previous run.
+    metrics : RunMetrics | None
+        The metrics receiving the duration of the resume stage.
+
+    Returns
+    -------
+    tuple[list, dict]
+        The jobs, as tuples (model_path, ilastik_args, shard, on_batch), and the signature before the run of the
+        output of each image to process, keyed by output path.
+    """
+    name, model_path, export_source, output_format = spec
+    model_result_path = get_model_result_path(result_base_path, name)
+    Path(model_result_path).mkdir(parents=True, exist_ok=True)
+    pending, on_batch = image_arg, None
+    if resume:
+        # Each project has its own manifest, in its subfolder
+        with measure(metrics, "resume"):
+            manifest = RunManifest(model_result_path, model_path, export_source, output_format)
+            pending = manifest.pending(image_arg)
+        on_batch = functools.partial(
+            report_outputs,
+            result_base_path=model_result_path,
+            export_source=export_source,
+            output_format=output_format,
+            on_output=manifest.wrap(pending, None),
+        )
+
+    signatures = {}
+    for image_path in pending:
+        output_path = get_output_path(model_result_path, image_path, export_source, output_format)
+        signatures[output_path] = get_signature(output_path)
+    ilastik_args = build_ilastik_args(
+        ilastik_script_path, model_path, model_result_path, export_source, output_format, []
+    )
+    shards = shard_paths(pending, workers) if pending else []
+    return [(model_path, ilastik_args, shard, on_batch) for shard in shards], signatures
+
+
+def run_job(job: tuple, env: dict, metrics: RunMetrics | None) -> None:
+    """Execute Ilastik on the shard of a job built by `build_model_jobs`, one command line after the other."""
+    _, ilastik_args, shard, on_batch = job
+    for batch in split_command_line(ilastik_args, shard):
+        batch_args = [*ilastik_args, *(str(path) for path in batch)]
+        execute_ilastik(batch_args, env, metrics=metrics, n_images=len(batch))
+        if on_batch is not None:
+            on_batch(batch)
+
+
+def build_index(image_arg: list, specs: list, result_base_path: str, initial_signatures: dict) -> dict:
+    """
+    List the output of each project for each image, see `run_ilastik_models`.
+
+    Parameters
+    ----------
+    image_arg : list
+        The paths of the images.
+    specs : list
+        The projects, as returned by `get_model_specs`.
+    result_base_path : str
+        The base path where the results are saved.
+    initial_signatures : dict
+        The signature before the run of the output of each image processed, keyed by output path.
+
+    Returns
+    -------
+    dict
+        For each image, the path of the output of each project keyed by the project name, or None if the project
+        did not write it during this run.
+    """
+    index = {}
+    for image_path in image_arg:
+        outputs = {}
+        for name, _, export_source, output_format in specs:
+            model_result_path = get_model_result_path(result_base_path, name)
+            output_path = get_output_path(model_result_path, image_path, export_source, output_format)
+            # An output left by a previous run is only listed if this run did not have to process it
+            signature = get_signature(output_path)
+            written = signature is not None and (
+                output_path not in initial_signatures or signature != initial_signatures[output_path]
+            )
+            outputs[name] = output_path if written else None
+        index[str(image_path)] = outputs
+    return index
@@ -0,0 +1,277 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""Run several Ilastik processes, or post-processing tasks, concurrently on the same list of images."""
+
+from __future__ import annotations
+
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.errors import BatchError
+from easilastik.metrics import run_process
+from easilastik.utils import split_command_line
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    from easilastik.metrics import RunMetrics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+
+def get_total_ram_mb() -> int | None:
+    """
+    Return the total physical memory of the machine.
+
+    Returns
+    -------
+    int | None
+        The total physical memory in MB, or None if it cannot be determined.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def shard_paths(paths: list, n_shards: int) -> list:
+    """
+    Split a list of files into shards of balanced total size.
+
+    The largest files are assigned first, each one to the shard with the smallest total size so far.
+
+    Parameters
+    ----------
+    paths : list
+        The paths of the files to split.
+    n_shards : int
+        The maximum number of shards.
+
+    Returns
+    -------
+    list
+        The non-empty shards, each one being a list of paths.
+    """
+    shards = [[] for _ in range(min(n_shards, len(paths)))]
+    sizes = [0] * len(shards)
+    for size, path in sorted(((Path(path).stat().st_size, path) for path in paths), key=lambda item: -item[0]):
+        lightest = sizes.index(min(sizes))
+        shards[lightest].append(path)
+        sizes[lightest] += size
+    return shards
+
+
+def get_worker_env(threads: int | None, ram_mb: int | None) -> dict:
+    """
+    Build the environment of an Ilastik process limited to a thread and RAM budget.
+
+    Parameters
+    ----------
+    threads : int | None
+        The number of threads Ilastik may use (LAZYFLOW_THREADS), or None to keep Ilastik's default.
+    ram_mb : int | None
+        The amount of RAM in MB Ilastik may use (LAZYFLOW_TOTAL_RAM_MB), or None to keep Ilastik's default.
+
+    Returns
+    -------
+    dict
+        A copy of the current environment with the Ilastik limits set.
+    """
+    env = os.environ.copy()
+    if threads is not None:
+        env["LAZYFLOW_THREADS"] = str(threads)
+    if ram_mb is not None:
+        env["LAZYFLOW_TOTAL_RAM_MB"] = str(ram_mb)
+    return env
+
+
+def get_shard_env(n_shards: int, threads_per_worker: int | None, ram_per_worker_mb: int | None) -> dict:
+    """
+    Build the environment of Ilastik processes sharing the machine.
+
+    Parameters
+    ----------
+    n_shards : int
+        The number of Ilastik processes running concurrently.
+    threads_per_worker : int | None
+        The number of threads of each Ilastik process, or None for the number of CPUs divided by n_shards.
+    ram_per_worker_mb : int | None
+        The amount of RAM in MB of each Ilastik process, or None for the total RAM divided by n_shards.
+
+    Returns
+    -------
+    dict
+        The environment of each Ilastik process, see `get_worker_env`.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // n_shards)
+    if ram_per_worker_mb is None and (total_ram_mb := get_total_ram_mb()) is not None:
+        ram_per_worker_mb = total_ram_mb // n_shards
+
+    logger.info(
+        "Running %d Ilastik processes with %d threads and %s MB of RAM each.",
+        n_shards,
+        threads_per_worker,
+        ram_per_worker_mb,
+    )
+    return get_worker_env(threads_per_worker, ram_per_worker_mb)
+
+
+def run_shards(
+    ilastik_args: list,
+    image_arg: list,
+    workers: int,
+    *,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    on_batch: Callable[[list], object] | None = None,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Execute Ilastik concurrently on shards of a list of images.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line without the images.
+    image_arg : list
+        The paths of the images to process.
+    workers : int
+        The number of Ilastik processes to run concurrently.
+    threads_per_worker : int, optional
+        The number of threads of each Ilastik process. Default is the number of CPUs divided by workers.
+    ram_per_worker_mb : int, optional
+        The amount of RAM in MB of each Ilastik process. Default is the total RAM divided by workers.
+    on_batch : Callable[[list], object], optional
+        Called from the thread of a shard with the paths of the images of each command line once Ilastik has
+        processed them. A shard too long for a single command line is processed by several Ilastik processes in a
+        row (see `split_command_line`).
+    metrics : RunMetrics, optional
+        The metrics receiving the resource usage of each Ilastik process.
+
+    Raises
+    ------
+    BatchError
+        If Ilastik failed on some of the shards. The `errors` attribute maps each failed shard (a tuple of paths)
+        to its error, the other shards are processed completely.
+    """
+    shards = shard_paths(image_arg, workers)
+    env = get_shard_env(len(shards), threads_per_worker, ram_per_worker_mb)
+
+    def run_shard(shard: list) -> None:
+        for batch in split_command_line(ilastik_args, shard):
+            batch_args = [*ilastik_args, *(str(path) for path in batch)]
+            run_process(batch_args, env=env, metrics=metrics, n_images=len(batch))
+            if on_batch is not None:
+                on_batch(batch)
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(run_shard, shard) for shard in shards]
+        for index, (shard, future) in enumerate(zip(shards, futures, strict=True)):
+            if (error := future.exception()) is not None:
+                logger.error("Error during conversion of shard %d: %s", index, error)
+                errors[tuple(str(path) for path in shard)] = error
+
+    if errors:
+        msg = f"Error during Ilastik execution of {len(errors)}/{len(shards)} shards. See console output for details."
+        raise BatchError(msg, errors)
+
+
+def map_bounded(
+    function: Callable,
+    items: Iterable,
+    workers: int,
+    *,
+    executor: str = "thread",
+    max_in_flight: int | None = None,
+) -> dict:
+    """
+    Apply a function to items concurrently, without stopping at the first failure.
+
+    Items are submitted lazily: at most max_in_flight of them are queued or running at any time, so that neither
+    the items nor the tasks accumulate in memory.
+
+    Parameters
+    ----------
+    function : Callable
+        The function applied to each item. With the process executor, it must be picklable (a module level
+        function or a `functools.partial` of one).
+    items : Iterable
+        The items to process.
+    workers : int
+        The number of threads or processes. With 1, the items are processed in the calling thread.
+    executor : str, optional
+        'thread' or 'process'. Default is 'thread'.
+    max_in_flight : int, optional
+        The maximum number of items submitted but not finished. Default is twice the number of workers.
+
+    Returns
+    -------
+    dict
+        The exception raised for each failed item, keyed by the item.
+
+    Raises
+    ------
+    ValueError
+        If workers is less than 1 or if executor is not 'thread' or 'process'.
+    """
+    if workers < 1:
+        msg = f"workers must be at least 1, got {workers}"
+        raise ValueError(msg)
+    if executor not in EXECUTORS:
+        msg = f"executor must be one of {list(EXECUTORS)}, got '{executor}'"
+        raise ValueError(msg)
+
+    errors = {}
+    if workers == 1:
+        for item in items:
+            try:
+                function(item)
+            except Exception as error:  # noqa: PERF203
+                logger.exception("Error while processing %s", item)
+                errors[item] = error
+        return errors
+
+    max_in_flight = max(workers, max_in_flight or 2 * workers)
+    in_flight = {}
+    with EXECUTORS[executor](max_workers=workers) as pool:
+        for item in items:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                errors.update(collect_errors(done, in_flight))
+            in_flight[pool.submit(function, item)] = item
+        errors.update(collect_errors(list(in_flight), in_flight))
+    return errors
+
+
+def collect_errors(futures: Iterable, in_flight: dict) -> dict:
+    """
+    Remove finished futures from the in-flight tasks and return their errors.
+
+    Parameters
+    ----------
+    futures : Iterable
+        The futures to collect, waited for if they are not finished.
+    in_flight : dict
+        The in-flight tasks, mapping each future to its item.
+
+    Returns
+    -------
+    dict
+        The exception raised for each failed item, keyed by the item.
+    """
+    errors = {}
+    for future in futures:
+        item = in_flight.pop(future)
+        if (error := future.exception()) is not None:
+            logger.error("Error while processing %s: %s", item, error)
+            errors[item] = error
+    return errors
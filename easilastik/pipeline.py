@@ -0,0 +1,235 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Hand over the files written by Ilastik while it is still processing the next images.
+
+Ilastik processes the images of a batch one after the other, in the order of the command line, and writes the
+output of each image before starting the next one. The output of an image is therefore complete as soon as the
+output of the next image appears (or changes, if it was left by a previous run), or when the process exits. HDF5
+outputs are additionally opened before being handed over: HDF5 locks the files open for writing, so a file still
+being written is never read.
+"""
+
+from __future__ import annotations
+
+import logging
+import subprocess
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.metrics import wait_child
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from easilastik.metrics import RunMetrics
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of the output files
+POLL_INTERVAL = 0.2
+
+HDF5_SUFFIXES = {".h5", ".hdf5"}
+
+
+def get_signature(output_path: str) -> tuple | None:
+    """
+    Return what identifies a version of an output file.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output file.
+
+    Returns
+    -------
+    tuple | None
+        The inode, size and modification time of the file, or None if it does not exist.
+    """
+    try:
+        stat = Path(output_path).stat()
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def is_readable(output_path: str) -> bool:
+    """
+    Check that an output file can be read.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output file.
+
+    Returns
+    -------
+    bool
+        False if the file is an HDF5 file which cannot be opened (e.g. because Ilastik still holds its lock) or
+        which does not contain 'exported_data' yet, else True.
+    """
+    if Path(output_path).suffix not in HDF5_SUFFIXES:
+        return True
+
+    import h5py  # noqa: PLC0415
+
+    try:
+        with h5py.File(output_path, "r") as f:
+            return "exported_data" in f  # noqa: PLR2004
+    except OSError:
+        return False
+
+
+class OutputWatcher:
+    """
+    Find the outputs completed by an Ilastik process since the last check.
+
+    Parameters
+    ----------
+    output_paths : list
+        The paths of the files Ilastik writes, in the order of the images on the command line. It must be created
+        before the Ilastik process starts, so that files left by a previous run are not taken for its outputs.
+    """
+
+    def __init__(self, output_paths: list) -> None:
+        self.output_paths = output_paths
+        self.initial_signatures = {path: get_signature(path) for path in output_paths}
+        self.next_index = 0
+
+    def poll(self, returncode: int | None) -> Iterator[int]:
+        """
+        Yield the outputs completed since the last check.
+
+        Parameters
+        ----------
+        returncode : int | None
+            The exit code of the Ilastik process, or None if it is still running.
+
+        Yields
+        ------
+        int
+            The index in output_paths of each complete output file. Missing outputs are skipped with a warning. If
+            Ilastik failed, the outputs it wrote before failing are yielded, the following ones are not.
+        """
+        output_paths = self.output_paths
+        while self.next_index < len(output_paths):
+            output_path = output_paths[self.next_index]
+            next_paths = output_paths[self.next_index + 1 : self.next_index + 2]
+            next_started = any(get_signature(path) not in {None, self.initial_signatures[path]} for path in next_paths)
+            if not next_started and returncode != 0:
+                if returncode is not None and self.is_written(output_path):
+                    # Ilastik failed after this output, the last one it completed
+                    yield self.next_index
+                    self.next_index += 1
+                break  # Ilastik may still be writing this output, or failed before writing it
+            if not Path(output_path).exists():
+                logger.warning("Ilastik did not write %s", output_path)
+            elif not is_readable(output_path):
+                if returncode is None:
+                    break  # The file is still locked, check again later
+                logger.warning("Could not read %s", output_path)
+            else:
+                yield self.next_index
+            self.next_index += 1
+
+    def is_written(self, output_path: str) -> bool:
+        """Return whether an output was written since the watcher was created and can be read."""
+        return get_signature(output_path) not in {None, self.initial_signatures[output_path]} and is_readable(
+            output_path
+        )
+
+
+def watch_outputs(
+    ilastik_args: list,
+    output_paths: list,
+    *,
+    poll_interval: float = POLL_INTERVAL,
+    metrics: RunMetrics | None = None,
+) -> Iterator[int]:
+    """
+    Execute an Ilastik command line and yield each output file as soon as it is complete.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line, as built by `build_ilastik_args`.
+    output_paths : list
+        The paths of the files Ilastik writes, in the order of the images on the command line.
+    poll_interval : float, optional
+        The number of seconds between two checks of the output files. Default is 0.2.
+    metrics : RunMetrics, optional
+        The metrics receiving the resource usage of the Ilastik process.
+
+    Yields
+    ------
+    int
+        The index in output_paths of each complete output file, while Ilastik processes the next images. Missing
+        outputs are skipped with a warning. If the generator is closed before the end, Ilastik is killed.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution. The outputs of the images processed before the error
+        have already been yielded.
+    """
+    # Files left by a previous run must not be taken for the outputs of this run
+    watcher = OutputWatcher(output_paths)
+    start_time = time.perf_counter()
+    process = subprocess.Popen(ilastik_args)  # noqa: S603
+    try:
+        while True:
+            returncode, usage = wait_child(process, block=False)
+            if returncode is not None and metrics is not None:
+                metrics.add_process(len(output_paths), returncode, time.perf_counter() - start_time, usage)
+            yield from watcher.poll(returncode)
+            if returncode is not None:
+                break
+            time.sleep(poll_interval)
+    finally:
+        # Do not leave Ilastik running if the consumer failed, stopped early or was interrupted
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    if returncode != 0:
+        logger.error("Error during conversion: Ilastik exited with code %d", returncode)
+        msg = "Error during Ilastik execution. See console output for details."
+        raise RuntimeError(msg)
+
+
+def run_watched(
+    ilastik_args: list,
+    output_paths: list,
+    on_output: Callable[[str], object],
+    *,
+    poll_interval: float = POLL_INTERVAL,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Execute an Ilastik command line and report each output file as soon as it is complete.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line, as built by `build_ilastik_args`.
+    output_paths : list
+        The paths of the files Ilastik writes, in the order of the images on the command line.
+    on_output : Callable[[str], object]
+        Called in the calling thread with the path of each complete output file, while Ilastik processes the next
+        images. It should return quickly (e.g. submit the file to an executor) not to delay the next outputs.
+    poll_interval : float, optional
+        The number of seconds between two checks of the output files. Default is 0.2.
+    metrics : RunMetrics, optional
+        The metrics receiving the resource usage of the Ilastik process.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution. The outputs of the images processed before the error
+        have already been reported.
+    """
+    for index in watch_outputs(ilastik_args, output_paths, poll_interval=poll_interval, metrics=metrics):
+        on_output(output_paths[index])
@@ -1,16 +1,45 @@
 # Copyright (C) 2026 Titouan Le Gourrierec
 """Module to run Ilastik in headless mode and process the results."""
 
+from __future__ import annotations
+
+import contextlib
+import functools
 import logging
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import cv2
-import h5py
-import numpy as np
-
+from easilastik.autotune import run_auto
+from easilastik.cache import serve_from_cache
+from easilastik.checkpoint import RunManifest
+from easilastik.discovery import IMAGE_EXTENSIONS
+from easilastik.errors import BatchError
 from easilastik.find_ilastik import find_ilastik
-from easilastik.utils import get_image_paths
+from easilastik.metrics import measure, measure_run, run_process
+from easilastik.parallel import collect_errors, get_shard_env, map_bounded, run_shards
+from easilastik.pipeline import run_watched
+from easilastik.utils import (
+    OUTPUT_EXTENSIONS,
+    get_input_paths,
+    get_output_filename_format,
+    get_output_path,
+    split_command_line,
+)
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    import numpy as np
+
+    from easilastik.cache import ResultCache
+    from easilastik.encoder import ColorOutput
+    from easilastik.isolation import FailureIsolation
+    from easilastik.metrics import RunMetrics
+    from easilastik.session import IlastikSession
+    from easilastik.statistics import BatchStatistics
 
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -58,36 +87,20 @@ ALLOWED_FORMATS = [
 ##################################################################################################
 
 
-def run_ilastik(
-    input_path: str,
-    model_path: str,
-    result_base_path: str,
-    ilastik_script_path: str | None = find_ilastik(),
-    export_source: str = "Simple Segmentation",
-    output_format: str = "png",
-) -> None:
+def check_arguments(input_path: str, export_source: str, output_format: str, *, single_file: bool = False) -> None:
     """
-    Execute the Ilastik software in headless mode with the specified parameters.
+    Check the arguments shared by the functions running Ilastik.
 
     Parameters
     ----------
     input_path : str
         The path to the image file or folder to be processed.
-    model_path : str
-        The path to the Ilastik project file.
-    result_base_path : str
-        The base path where the result will be saved.
-    ilastik_script_path : str, optional
-        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
-    export_source : str, optional
-        The type of data to export. Default is "Simple Segmentation". Must be one of
-        ["Probabilities", "Simple Segmentation", "Uncertainty", "Features", "Labels"].
-    output_format : str, optional
-        The format of the output file. Default is "png". Must be one of["bmp", "gif", "hdr", "jpeg",
-        "jpg", "pbm", "pgm", "png", "pnm", "ppm", "ras", "tif", "tiff", "xv", "bmp sequence", "gif sequence",
-        "hdr sequence", "jpeg sequence", "jpg sequence", "pbm sequence", "pgm sequence", "png sequence",
-        "pnm sequence", "ppm sequence", "ras sequence", "tif sequence", "tiff sequence", "xv sequence",
-        "multipage tiff", "multipage tiff sequence", "hdf5", "compressed hdf5", "numpy, dvid"].
+    export_source : str
+        The type of data to export.
+    output_format : str
+        The format of the output file.
+    single_file : bool, optional
+        Whether the output of each image must be a single file. Default is False.
 
     Raises
     ------
@@ -95,13 +108,7 @@ def run_ilastik(
         If the input_path does not exist.
     ValueError
         If the export_source or output_format is not valid.
-    RuntimeError
-        If there is an error during the Ilastik execution.
     """
-    if ilastik_script_path is None:
-        logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
-        return
-
     if not Path(input_path).is_file() and not Path(input_path).is_dir():
         msg = f"input_path '{input_path}' is not a valid file or directory."
         raise FileNotFoundError(msg)
@@ -127,33 +134,646 @@ def run_ilastik(
         )
         raise ValueError(msg)
 
-    # Check if result_base_path exists, if not, create it
-    if not Path(result_base_path).exists():
-        Path(result_base_path).mkdir(parents=True, exist_ok=True)
+    if single_file and output_format not in OUTPUT_EXTENSIONS:
+        msg = (
+            f"The '{output_format}' format is written as several files per image, use one of {list(OUTPUT_EXTENSIONS)}"
+        )
+        raise ValueError(msg)
+
+
+def build_ilastik_args(
+    ilastik_script_path: str,
+    model_path: str,
+    result_base_path: str,
+    export_source: str,
+    output_format: str,
+    image_arg: list,
+) -> list:
+    """
+    Build the command line executing Ilastik in headless mode on a list of images.
 
-    # Check if input_path is a directory or a file
-    if Path(input_path).is_dir():
-        image_arg = get_image_paths(input_path)
-    elif Path(input_path).is_file():
-        image_arg = [input_path]
+    The project is opened read-only, so that several processes can use it at the same time.
+
+    Parameters
+    ----------
+    ilastik_script_path : str
+        The path to the Ilastik script.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results will be saved.
+    export_source : str
+        The type of data to export.
+    output_format : str
+        The format of the output files.
+    image_arg : list
+        The paths of the images to process.
 
-    logger.info("image_arg: %s", image_arg)
-    # Arguments to execute Ilastik in headless mode
-    ilastik_args = [
+    Returns
+    -------
+    list
+        The arguments to pass to `subprocess`.
+    """
+    return [
         ilastik_script_path,
         "--headless",
+        # Exporting never writes to the project, and concurrent processes could not all open it for writing
+        "--readonly",
         "--project=" + model_path,
         "--export_source=" + export_source,
         "--output_format=" + output_format,
-        "--output_filename_format=" + result_base_path + "{nickname}_" + export_source.replace(" ", "_"),
-        *image_arg,
+        "--output_filename_format=" + get_output_filename_format(result_base_path, export_source),
+        *(str(path) for path in image_arg),
     ]
 
+
+def run_ilastik(  # noqa: PLR0913
+    input_path: str,
+    model_path: str,
+    result_base_path: str,
+    ilastik_script_path: str | None = None,
+    export_source: str = "Simple Segmentation",
+    output_format: str = "png",
+    *,
+    session: IlastikSession | None = None,
+    workers: int | str = 1,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    on_output: Callable[[str], object] | None = None,
+    cache: ResultCache | None = None,
+    resume: bool = False,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    tile_size: int | None = None,
+    tile_halo: int | None = None,
+    isolation: FailureIsolation | None = None,
+    metrics: RunMetrics | None = None,
+) -> dict | None:
+    """
+    Execute the Ilastik software in headless mode with the specified parameters.
+
+    Folders too large for a single command line are processed by several Ilastik processes in a row, each one
+    receiving as many images as the system allows (see `split_command_line`).
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the result will be saved.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    export_source : str, optional
+        The type of data to export. Default is "Simple Segmentation". Must be one of
+        ["Probabilities", "Simple Segmentation", "Uncertainty", "Features", "Labels"].
+    output_format : str, optional
+        The format of the output file. Default is "png". Must be one of["bmp", "gif", "hdr", "jpeg",
+        "jpg", "pbm", "pgm", "png", "pnm", "ppm", "ras", "tif", "tiff", "xv", "bmp sequence", "gif sequence",
+        "hdr sequence", "jpeg sequence", "jpg sequence", "pbm sequence", "pgm sequence", "png sequence",
+        "pnm sequence", "ppm sequence", "ras sequence", "tif sequence", "tiff sequence", "xv sequence",
+        "multipage tiff", "multipage tiff sequence", "hdf5", "compressed hdf5", "numpy, dvid"].
+    session : IlastikSession, optional
+        A running Ilastik session with the project already loaded. If provided, the images are processed by the
+        session's worker instead of a new Ilastik process, and ilastik_script_path is ignored.
+    workers : int | str, optional
+        The number of Ilastik processes to run concurrently. Default is 1. If greater than 1, the images are split
+        into shards of balanced total file size, each one processed by its own Ilastik process. With 'auto', the
+        number of processes, their threads and their RAM are chosen from the CPUs and memory available and the
+        estimated memory of a process, which is corrected by the peak memory of the processes as they exit (see
+        `run_auto`); threads_per_worker and ram_per_worker_mb are then ignored.
+    threads_per_worker : int, optional
+        The number of threads of each Ilastik process (LAZYFLOW_THREADS) when workers is greater than 1. Default is
+        the number of CPUs divided by the number of processes.
+    ram_per_worker_mb : int, optional
+        The amount of RAM in MB of each Ilastik process (LAZYFLOW_TOTAL_RAM_MB) when workers is greater than 1.
+        Default is the total RAM divided by the number of processes.
+    on_output : Callable[[str], object], optional
+        Called with the path of each output file once it is complete. With a single Ilastik process, it is called
+        while Ilastik processes the next images, so that the outputs can be post-processed in the meantime (see
+        `run_watched`). With a session or several workers, it is called once the images of each batch are processed.
+    cache : ResultCache, optional
+        A cache of the outputs. The outputs of the images already processed with the same project, export source
+        and output format are taken from the cache, only the other images are processed by Ilastik and their
+        outputs are added to the cache.
+    resume : bool, optional
+        Whether to checkpoint the run and skip the images already processed by a previous run with the same
+        settings. Each complete output is recorded in a manifest in result_base_path as soon as it is written, so
+        that a run interrupted by an error, a crash or a pre-emption is resumed where it stopped when called again
+        with resume=True. Images modified since their output was recorded, or whose output was removed, are
+        processed again. Default is False.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the input folder to process, lowercase and with their leading dot. Default
+        is the image formats read by Ilastik as a single 2D image (`IMAGE_EXTENSIONS`), which excludes HDF5 files
+        such as the outputs of Ilastik: pass e.g. {".h5", ".hdf5"} to process HDF5 raw data, or None to process all
+        the files. A warning is logged if the folder holds files but none with these extensions.
+    tile_size : int, optional
+        If provided, the images higher or wider than tile_size pixels (according to their header) are cut into tiles
+        of this size plus a halo, the tiles are processed by the workers and their outputs are stitched into the
+        output of the image, written strip by strip (see `run_tiled`). Use it for images too large for a single
+        Ilastik process. The output_format must be 'png', 'tif', 'tiff', 'hdf5' or 'compressed hdf5'. Default is
+        None (no tiling).
+    tile_halo : int, optional
+        The number of pixels added on each side of the tiles, so that the filters of the project see the same
+        neighborhood as in the whole image. Default is the radius of the largest filter selected in the project.
+    isolation : FailureIsolation, optional
+        If provided, a batch on which Ilastik fails is split until the images which fail are found, the outputs of
+        the other images being kept, and the images failing alone are retried (see `FailureIsolation`). The
+        failures are then returned rather than raised.
+    metrics : RunMetrics, optional
+        Collects the duration of each stage of the run and the resource usage of each Ilastik process, and writes
+        them as a report in result_base_path once the run ends (see `RunMetrics`).
+
+    Returns
+    -------
+    dict | None
+        With isolation, the `FailureIsolation.result` of the run: the paths of the images which 'succeeded', the
+        error output of Ilastik for each image which 'failed' and the paths of the images 'skipped'. Else None.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the input_path does not exist.
+    ValueError
+        If the export_source or output_format is not valid, if the session was opened for another project, if
+        workers or isolation is combined with a session, if on_output, cache, resume or isolation is combined with
+        a format written as several files, or if tile_size is combined with a format which cannot be stitched.
+    RuntimeError
+        If there is an error during the Ilastik execution. With several workers, a `BatchError` listing the
+        failed shards is raised once all the shards are done, and with tile_size, a `BatchError` listing the tiled
+        images which failed once the other ones are done.
+    """
+    if workers != "auto" and (not isinstance(workers, int) or workers < 1):  # noqa: PLR2004
+        msg = f"workers must be a positive integer or 'auto', got {workers}"
+        raise ValueError(msg)
+
+    if tile_size is not None:
+        check_tiling_arguments(tile_size, tile_halo, output_format)
+
+    if session is not None:
+        if workers != 1:
+            msg = "workers cannot be combined with a session, the session has a single worker."
+            raise ValueError(msg)
+        if isolation is not None:
+            msg = "isolation cannot be combined with a session, the images are not run by Ilastik processes."
+            raise ValueError(msg)
+        session.check_model(model_path)
+    else:
+        ilastik_script_path = ilastik_script_path or find_ilastik()
+        if ilastik_script_path is None:
+            logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
+            return None
+
+    single_file = on_output is not None or cache is not None or resume or isolation is not None
+    check_arguments(input_path, export_source, output_format, single_file=single_file)
+
+    # Check if result_base_path exists, if not, create it
+    if not Path(result_base_path).exists():
+        Path(result_base_path).mkdir(parents=True, exist_ok=True)
+
+    with measure_run(metrics, result_base_path):
+        image_arg, on_output = prepare_images(
+            input_path,
+            model_path,
+            result_base_path,
+            export_source,
+            output_format,
+            on_output,
+            cache=cache,
+            resume=resume,
+            extensions=extensions,
+            metrics=metrics,
+        )
+        logger.info("Processing %d images.", len(image_arg))
+        logger.debug("image_arg: %s", image_arg)
+        if isolation is not None and (resume or cache is not None):
+            # The images whose outputs were already complete or in the cache
+            processed = set(image_arg)
+            isolation.add_skipped(path for path in get_input_paths(input_path, extensions) if path not in processed)
+
+        dispatch_images(
+            image_arg,
+            model_path,
+            result_base_path,
+            ilastik_script_path,
+            export_source,
+            output_format,
+            tile_size=tile_size,
+            tile_halo=tile_halo,
+            isolation=isolation,
+            metrics=metrics,
+            session=session,
+            workers=workers,
+            threads_per_worker=threads_per_worker,
+            ram_per_worker_mb=ram_per_worker_mb,
+            on_output=on_output,
+        )
+
+    if isolation is not None:
+        result = isolation.result
+        logger.info(
+            "Conversion of %s: %d images succeeded, %d failed, %d skipped.",
+            input_path,
+            len(result["succeeded"]),
+            len(result["failed"]),
+            len(result["skipped"]),
+        )
+        return result
+    msg = f"Conversion of {input_path} completed successfully."
+    logger.info(msg)
+    return None
+
+
+def check_tiling_arguments(tile_size: int, tile_halo: int | None, output_format: str) -> None:
+    """
+    Check the tiling arguments of `run_ilastik`.
+
+    Parameters
+    ----------
+    tile_size : int
+        The size of the tiles.
+    tile_halo : int | None
+        The number of pixels added on each side of the tiles, if provided.
+    output_format : str
+        The format of the output files.
+
+    Raises
+    ------
+    ValueError
+        If tile_size is not a positive integer, if tile_halo is negative or if the output_format cannot be stitched.
+    """
+    from easilastik.tiling import TILED_FORMATS  # noqa: PLC0415
+
+    if not isinstance(tile_size, int) or tile_size < 1:
+        msg = f"tile_size must be a positive integer, got {tile_size}"
+        raise ValueError(msg)
+    if tile_halo is not None and tile_halo < 0:
+        msg = f"tile_halo must be a non-negative integer, got {tile_halo}"
+        raise ValueError(msg)
+    if output_format not in TILED_FORMATS:
+        msg = f"Tiled outputs must be written in one of {list(TILED_FORMATS)}, got '{output_format}'"
+        raise ValueError(msg)
+
+
+def dispatch_images(
+    image_arg: list,
+    *args: object,
+    tile_size: int | None,
+    tile_halo: int | None,
+    isolation: FailureIsolation | None,
+    metrics: RunMetrics | None,
+    **kwargs: object,
+) -> None:
+    """
+    Process the images with `process_images`, or as tiles with `run_tiled` for the ones larger than tile_size.
+
+    Parameters
+    ----------
+    image_arg : list
+        The paths of the images to process.
+    *args : object
+        The model_path, result_base_path, ilastik_script_path, export_source and output_format, see `run_ilastik`.
+    tile_size : int | None
+        The size of the tiles, or None to process every image whole.
+    tile_halo : int | None
+        The number of pixels added on each side of the tiles, see `run_ilastik`.
+    isolation : FailureIsolation | None
+        Records the images on which Ilastik fails instead of raising an error, see `FailureIsolation`.
+    metrics : RunMetrics | None
+        The metrics receiving the duration of the stages and the resource usage of the Ilastik processes.
+    **kwargs : object
+        The session, workers, threads_per_worker, ram_per_worker_mb and on_output, see `run_ilastik`.
+    """
+    tiled = []
+    if tile_size is not None:
+        from easilastik.tiling import is_oversized  # noqa: PLC0415
+
+        # Only the images too large for a single Ilastik process are tiled
+        with measure(metrics, "discovery"):
+            oversized = [is_oversized(path, tile_size) for path in image_arg]
+        tiled = [path for path, tile in zip(image_arg, oversized, strict=True) if tile]
+        image_arg = [path for path, tile in zip(image_arg, oversized, strict=True) if not tile]
+
+    if image_arg:
+        process_images(image_arg, *args, isolation=isolation, metrics=metrics, **kwargs)
+    if tiled:
+        from easilastik.tiling import run_tiled  # noqa: PLC0415
+
+        run_tiled_images = run_tiled if isolation is None else functools.partial(run_isolated_tiles, isolation)
+        run_tiled_images(tiled, *args, tile_size=tile_size, halo=tile_halo, metrics=metrics, **kwargs)
+
+
+def run_isolated_tiles(isolation: FailureIsolation, image_paths: list, *args: object, **kwargs: object) -> None:
+    """Process images as tiles with `run_tiled`, recording the images which failed in isolation."""
+    from easilastik.tiling import run_tiled  # noqa: PLC0415
+
+    errors = {}
+    try:
+        run_tiled(image_paths, *args, **kwargs)
+    except BatchError as error:
+        errors = error.errors
+        isolation.add_failures(errors)
+    isolation.add_succeeded([path for path in image_paths if str(path) not in errors], None)
+
+
+def prepare_images(
+    input_path: str,
+    model_path: str,
+    result_base_path: str,
+    export_source: str,
+    output_format: str,
+    on_output: Callable[[str], object] | None,
+    *,
+    cache: ResultCache | None = None,
+    resume: bool = False,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    metrics: RunMetrics | None = None,
+) -> tuple[list, Callable[[str], object] | None]:
+    """
+    List the images Ilastik has to process, the arguments being already checked (see `run_ilastik`).
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results are saved.
+    export_source : str
+        The type of data to export.
+    output_format : str
+        The format of the output files.
+    on_output : Callable[[str], object] | None
+        The function called with the path of each output file, if any.
+    cache : ResultCache, optional
+        A cache of the outputs, see `run_ilastik`.
+    resume : bool, optional
+        Whether to skip the images already processed by a previous run, see `run_ilastik`. Default is False.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the input folder to process, see `run_ilastik`.
+    metrics : RunMetrics, optional
+        The metrics receiving the duration of the discovery, resume and cache stages.
+
+    Returns
+    -------
+    tuple[list, Callable[[str], object] | None]
+        The images whose outputs are neither complete nor in the cache, and the function to call with the path of
+        each output Ilastik writes for them: it records it in the manifest and the cache, then calls on_output.
+    """
+    with measure(metrics, "discovery"):
+        image_arg = get_input_paths(input_path, extensions)
+    if resume:
+        # Only the images without a complete output are processed, and each new output is recorded
+        with measure(metrics, "resume"):
+            manifest = RunManifest(result_base_path, model_path, export_source, output_format)
+            image_arg = manifest.pending(image_arg)
+            on_output = manifest.wrap(image_arg, on_output)
+    if cache is not None:
+        # Only the images whose outputs are not in the cache are processed
+        with measure(metrics, "cache"):
+            image_arg, on_output = serve_from_cache(
+                cache, image_arg, model_path, result_base_path, export_source, output_format, on_output
+            )
+    return image_arg, on_output
+
+
+def process_images(  # noqa: PLR0913
+    image_arg: list,
+    model_path: str,
+    result_base_path: str,
+    ilastik_script_path: str | None,
+    export_source: str,
+    output_format: str,
+    *,
+    session: IlastikSession | None = None,
+    workers: int | str = 1,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    on_output: Callable[[str], object] | None = None,
+    isolation: FailureIsolation | None = None,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Process a list of images with Ilastik, the arguments being already checked (see `run_ilastik`).
+
+    Parameters
+    ----------
+    image_arg : list
+        The paths of the images to process.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results are saved.
+    ilastik_script_path : str | None
+        The path to the Ilastik script, ignored with a session.
+    export_source : str
+        The type of data to export.
+    output_format : str
+        The format of the output files.
+    session : IlastikSession, optional
+        A running Ilastik session with the project already loaded.
+    workers : int | str, optional
+        The number of Ilastik processes to run concurrently, or 'auto'. Default is 1.
+    threads_per_worker : int, optional
+        The number of threads of each Ilastik process when workers is greater than 1.
+    ram_per_worker_mb : int, optional
+        The amount of RAM in MB of each Ilastik process when workers is greater than 1.
+    on_output : Callable[[str], object], optional
+        Called with the path of each output file once it is complete.
+    isolation : FailureIsolation, optional
+        Records the images on which Ilastik fails instead of raising an error, see `FailureIsolation`.
+    metrics : RunMetrics, optional
+        The metrics receiving the duration and resource usage of the Ilastik processes.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution. The outputs of the images processed before the error
+        have already been reported.
+    """
+    if session is not None:
+        # The project is already loaded by the session's worker, which receives the images through a pipe
+        elapsed = session.run(image_arg, result_base_path, export_source, output_format)
+        if metrics is not None and elapsed is not None:
+            # The worker is a long-lived process, only the duration of the run is known
+            metrics.add_stage("ilastik", elapsed)
+        if on_output is not None:
+            report_outputs(image_arg, result_base_path, export_source, output_format, on_output)
+        return
+
+    # Arguments to execute Ilastik in headless mode, without the images
+    ilastik_args = build_ilastik_args(
+        ilastik_script_path, model_path, result_base_path, export_source, output_format, []
+    )
+    on_batch = (
+        None
+        if on_output is None
+        else functools.partial(
+            report_outputs,
+            result_base_path=result_base_path,
+            export_source=export_source,
+            output_format=output_format,
+            on_output=on_output,
+        )
+    )
+    if isolation is not None:
+        get_output = functools.partial(
+            get_output_path, result_base_path, export_source=export_source, output_format=output_format
+        )
+        run_isolated(
+            isolation,
+            ilastik_args,
+            image_arg,
+            model_path,
+            get_output,
+            workers=workers,
+            threads_per_worker=threads_per_worker,
+            ram_per_worker_mb=ram_per_worker_mb,
+            on_batch=on_batch,
+            metrics=metrics,
+        )
+        return
+    if workers == "auto":  # noqa: PLR2004
+        run_auto(ilastik_args, image_arg, model_path, on_batch=on_batch, metrics=metrics)
+        return
+    if workers > 1 and len(image_arg) > 1:
+        run_shards(
+            ilastik_args,
+            image_arg,
+            workers,
+            threads_per_worker=threads_per_worker,
+            ram_per_worker_mb=ram_per_worker_mb,
+            on_batch=on_batch,
+            metrics=metrics,
+        )
+        return
+
+    batches = list(split_command_line(ilastik_args, image_arg))
+    if len(batches) > 1:
+        logger.info("The images are split between %d Ilastik command lines.", len(batches))
+    for batch in batches:
+        batch_args = [*ilastik_args, *(str(path) for path in batch)]
+        if on_output is None:
+            execute_ilastik(batch_args, metrics=metrics, n_images=len(batch))
+        else:
+            # Report each output as soon as it is complete, while Ilastik processes the next images
+            output_paths = [get_output_path(result_base_path, path, export_source, output_format) for path in batch]
+            run_watched(batch_args, output_paths, on_output, metrics=metrics)
+
+
+def run_isolated(
+    isolation: FailureIsolation,
+    ilastik_args: list,
+    image_arg: list,
+    model_path: str,
+    get_output: Callable[[str], str],
+    *,
+    workers: int | str,
+    threads_per_worker: int | None,
+    ram_per_worker_mb: int | None,
+    on_batch: Callable[[list], object] | None,
+    metrics: RunMetrics | None,
+) -> None:
+    """
+    Process a list of images with Ilastik processes, isolating the images on which Ilastik fails.
+
+    Parameters
+    ----------
+    isolation : FailureIsolation
+        Records the images on which Ilastik fails, see `FailureIsolation`.
+    ilastik_args : list
+        The Ilastik command line without the images.
+    image_arg : list
+        The paths of the images to process.
+    model_path : str
+        The path to the Ilastik project file.
+    get_output : Callable[[str], str]
+        Returns the path of the output file of an image.
+    workers : int | str
+        The number of Ilastik processes to run concurrently, or 'auto' to size them from the available resources
+        once (see `AutoScheduler`).
+    threads_per_worker : int | None
+        The number of threads of each Ilastik process when workers is greater than 1.
+    ram_per_worker_mb : int | None
+        The amount of RAM in MB of each Ilastik process when workers is greater than 1.
+    on_batch : Callable[[list], object] | None
+        Called with the paths of the images whose outputs are complete, once a process exits.
+    metrics : RunMetrics | None
+        The metrics receiving the resource usage of each Ilastik process.
+    """
+    env = None
+    if workers == "auto":  # noqa: PLR2004
+        from easilastik.autotune import AutoScheduler, estimate_process_mb  # noqa: PLC0415
+
+        scheduler = AutoScheduler(estimate_process_mb(image_arg, model_path))
+        workers = min(scheduler.workers, len(image_arg))
+        env = scheduler.get_env(workers)
+    else:
+        workers = min(workers, len(image_arg))
+        if workers > 1:
+            env = get_shard_env(workers, threads_per_worker, ram_per_worker_mb)
+    isolation.run(ilastik_args, image_arg, get_output, workers=workers, env=env, on_batch=on_batch, metrics=metrics)
+
+
+def report_outputs(
+    image_arg: list,
+    result_base_path: str,
+    export_source: str,
+    output_format: str,
+    on_output: Callable[[str], object],
+) -> None:
+    """
+    Call on_output with the path of each output file written by Ilastik.
+
+    Parameters
+    ----------
+    image_arg : list
+        The paths of the images processed.
+    result_base_path : str
+        The base path where the results are saved.
+    export_source : str
+        The type of data exported.
+    output_format : str
+        The format of the output files.
+    on_output : Callable[[str], object]
+        The function called with the path of each output file. Missing outputs are skipped.
+    """
+    for path in image_arg:
+        output_path = get_output_path(result_base_path, path, export_source, output_format)
+        if Path(output_path).exists():
+            on_output(output_path)
+
+
+def execute_ilastik(
+    ilastik_args: list,
+    env: dict | None = None,
+    *,
+    metrics: RunMetrics | None = None,
+    n_images: int = 0,
+) -> None:
+    """
+    Execute an Ilastik command line and wait for it to complete.
+
+    Parameters
+    ----------
+    ilastik_args : list
+        The Ilastik command line, as built by `build_ilastik_args`.
+    env : dict, optional
+        The environment of the Ilastik process. Default is the current environment.
+    metrics : RunMetrics, optional
+        The metrics receiving the duration and resource usage of the Ilastik process.
+    n_images : int, optional
+        The number of images on the command line, recorded with the metrics. Default is 0.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution.
+    """
     # Execute the Ilastik command in headless mode with the specified arguments
     try:
-        subprocess.run(ilastik_args, check=True)  # noqa: S603
-        msg = f"Conversion of {input_path} completed successfully."
-        logger.info(msg)
+        run_process(ilastik_args, env=env, metrics=metrics, n_images=n_images)
     except subprocess.CalledProcessError as err:
         logger.exception("Error during conversion")
         msg = "Error during Ilastik execution. See console output for details."
@@ -173,6 +793,9 @@ def process_single_file(
     channel_colors: list,
     *,
     deletion: bool = True,
+    max_memory_mb: float | None = None,
+    output: ColorOutput | None = None,
+    metrics: RunMetrics | None = None,
 ) -> None:
     """
     Create a color image from a single .h5 file.
@@ -190,6 +813,21 @@ def process_single_file(
         List of RGB colors for each channel. Each color must be a list of 3 integers between 0 and 255.
     deletion : bool, optional
         If True, the original .h5 file will be deleted after processing. Default is True.
+    max_memory_mb : float, optional
+        If provided, the probabilities are read and colored by blocks of rows using at most about this amount of
+        memory, and the color image is written incrementally to a .tif file instead of a .png file. Use it for
+        images too large to fit in memory. Default is None (the whole file is loaded at once).
+    output : ColorOutput, optional
+        The options of the color image. Its color_format is 'png', 'tif' (uncompressed, faster to write), 'npy' (a
+        NumPy array of RGB colors, which can be memory-mapped with `np.load(path, mmap_mode="r")`) or 'index' (a PNG
+        image holding the class of each pixel, 0 below the threshold, with the colors in its palette), by default
+        'png', or 'tif' with max_memory_mb. Its png_compression is the compression level of 'png' and 'index'
+        images, from 0 (fastest to write) to 9 (smallest file). With an encoder, the color image is written in the
+        background by the encoder, which records its errors, and the .h5 file is deleted once it is written. With
+        statistics, the number of pixels of each class and the histogram of the maximum probability are computed
+        while the file is colored, and added to them. Default is a 'png' image written in the calling thread.
+    metrics : RunMetrics, optional
+        The metrics receiving the seconds spent to read, color and write the file.
 
     Raises
     ------
@@ -198,92 +836,36 @@ def process_single_file(
     ValueError
         If below_threshold_color or channel_colors are not in the correct format, or if the file
         does not contain 'exported_data', or if the length of channel_colors does not match
-        the number of channels in the data.
+        the number of channels in the data, or if the color format or PNG compression level is not valid.
     """
     if not Path(file_path).exists():
         msg = f"File at {file_path} does not exist"
         raise FileNotFoundError(msg)
 
-    if (
-        not isinstance(below_threshold_color, list)
-        or len(below_threshold_color) != 3
-        or not all(isinstance(i, int) and 0 <= i <= 255 for i in below_threshold_color)
-    ):
-        msg = "below_threshold_color must be a list of 3 integers between 0 and 255 (RGB color format)"
-        raise ValueError(msg)
-
-    if not isinstance(channel_colors, list) or not all(
-        isinstance(color, list) and len(color) == 3 and all(isinstance(i, int) and 0 <= i <= 255 for i in color)
-        for color in channel_colors
-    ):
-        msg = "channel_colors must be a list of lists of 3 integers between 0 and 255 (RGB color format)"
-        raise ValueError(msg)
-
-    # Open the file
-    try:
-        f = h5py.File(file_path, "r")
-    except OSError as err:
-        msg = f"Could not open file at {file_path}"
-        raise ValueError(msg) from err
-
-    # Ensure the file contains 'exported_data'
-    if "exported_data" not in f:  # noqa: PLR2004
-        f.close()
-        msg = f"File at {file_path} does not contain 'exported_data'"
-        raise ValueError(msg)
-
-    data = f["exported_data"]
-
-    # Check if the length of channel_colors is equal to the number of channels in data
-    if len(channel_colors) != data.shape[-1]:
-        f.close()
-        msg = (
-            "The length of channel_colors must be equal to the number of channels in the data"
-            "(there must be as many colors as labels annotated in the Ilastik project)."
-            f"Expected {data.shape[-1]}, got {len(channel_colors)}"
-        )
-        raise ValueError(msg)
-
-    # Find the index of the channel with the highest value for each pixel
-    indices = np.argmax(data, axis=-1)
-    indices = indices.astype(int)
-
-    # Find the maximum value for each pixel
-    max_values = np.max(data, axis=-1)
-
-    # Create a color map
-    colors = np.array([below_threshold_color, *channel_colors])
-
-    # Convert the below_threshold_color to a numpy array and add two new axes to match the shape
-    # of max_values[..., np.newaxis]
-    below_threshold_color_array = np.array(below_threshold_color)[np.newaxis, np.newaxis, :]
-
-    # Use numpy's take function to create a color map. The color map is an array of colors corresponding
-    # to the indices.
-    color_map = np.take(colors, indices + 1, axis=0)
-
-    # Use numpy's where function to create the color image. If the maximum value of a pixel is greater than the
-    # threshold, the pixel's color is taken from the color map. Otherwise, the pixel's color is set to
-    # below_threshold_color.
-    color_image = np.where(max_values[..., np.newaxis] > threshold, color_map, below_threshold_color_array)
-
-    # Convert the color image to uint8 type for compatibility with OpenCV's imwrite function.
-    color_image_uint8 = color_image.astype(np.uint8)
-
-    # Save the color image
-    new_path = Path(file_path).with_suffix(".png")
-    cv2.imwrite(str(new_path), cv2.cvtColor(color_image_uint8, cv2.COLOR_RGB2BGR))  # cv2 uses BGR color format
-
-    # Close the h5 file
-    f.close()
-
-    if deletion:
-        # Delete the h5 file
-        Path(file_path).unlink()
+    # OpenCV and h5py are slow to import, only load them when results are processed
+    from easilastik.colorize import check_colors, colorize_file  # noqa: PLC0415
+
+    check_colors(below_threshold_color, channel_colors)
+    colorize_file(
+        file_path,
+        threshold,
+        below_threshold_color,
+        channel_colors,
+        max_memory_mb=max_memory_mb,
+        output=output,
+        # Delete the h5 file once the color image is written
+        on_written=Path(file_path).unlink if deletion else None,
+        metrics=metrics,
+    )
 
 
 def color_treshold_probabilities(
-    file_path: str, threshold: float, below_threshold_color: list, channel_colors: list
+    file_path: str,
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    *,
+    statistics: BatchStatistics | None = None,
 ) -> np.ndarray:
     """
     Create a color image from a single .h5 file.
@@ -299,6 +881,8 @@ def color_treshold_probabilities(
         RGB color for values below the threshold. Must be a list of 3 integers between 0 and 255.
     channel_colors : list
         List of RGB colors for each channel. Each color must be a list of 3 integers between 0 and 255.
+    statistics : BatchStatistics, optional
+        If provided, the pixel statistics of the file are computed while it is colored and added to it.
 
     Returns
     -------
@@ -319,83 +903,70 @@ def color_treshold_probabilities(
         msg = f"File at {file_path} does not exist"
         raise FileNotFoundError(msg)
 
-    if (
-        not isinstance(below_threshold_color, list)
-        or len(below_threshold_color) != 3
-        or not all(isinstance(i, int) and 0 <= i <= 255 for i in below_threshold_color)
-    ):
-        msg = "below_threshold_color must be a list of 3 integers between 0 and 255 (RGB color format)"
-        raise ValueError(msg)
-
-    if not isinstance(channel_colors, list) or not all(
-        isinstance(color, list) and len(color) == 3 and all(isinstance(i, int) and 0 <= i <= 255 for i in color)
-        for color in channel_colors
-    ):
-        msg = "channel_colors must be a list of lists of 3 integers between 0 and 255 (RGB color format)"
-        raise ValueError(msg)
+    # OpenCV and h5py are slow to import, only load them when results are processed
+    import numpy as np  # noqa: PLC0415
 
-    # Open the file
-    try:
-        f = h5py.File(file_path, "r")
-    except OSError as err:
-        msg = f"Could not open file at {file_path}"
-        raise ValueError(msg) from err
-
-    # Ensure the file contains 'exported_data'
-    if "exported_data" not in f:  # noqa: PLR2004
-        f.close()
-        msg = f"File at {file_path} does not contain 'exported_data'"
-        raise ValueError(msg)
-    data = f["exported_data"]
+    from easilastik.colorize import (  # noqa: PLC0415
+        check_colors,
+        get_engine,
+        get_palette,
+        get_value_scale,
+        open_probabilities,
+    )
 
-    # Check if the length of channel_colors is equal to the number of channels in data
-    if len(channel_colors) != data.shape[-1]:
-        f.close()
-        msg = (
-            "The length of channel_colors must be equal to the number of channels in the data (there must be as many "
-            f"colors as labels annotated in the Ilastik project). Expected {data.shape[-1]}, got {len(channel_colors)}"
+    check_colors(below_threshold_color, channel_colors)
+    with open_probabilities(file_path, channel_colors) as f:
+        engine = get_engine()
+        data = f["exported_data"]
+        probabilities = engine.read(data)
+        # The palette is in BGR order, so the image is directly compatible with OpenCV
+        palette = get_palette(below_threshold_color, channel_colors)
+        color_image = np.empty((*probabilities.shape[:-1], 3), dtype=np.uint8)
+        image_statistics = None if statistics is None else statistics.create(data.shape[-1], get_value_scale(data))
+        engine.colorize(
+            probabilities, threshold * get_value_scale(data), palette, out=color_image, statistics=image_statistics
         )
-        raise ValueError(msg)
-
-    # Find the index of the channel with the highest value for each pixel
-    indices = np.argmax(data, axis=-1)
-    indices = indices.astype(int)
-
-    # Find the maximum value for each pixel
-    max_values = np.max(data, axis=-1)
-
-    # Create a color map
-    colors = np.array([below_threshold_color, *channel_colors])
-
-    # Convert the below_threshold_color to a numpy array and add two new axes to match the shape
-    # of max_values[..., np.newaxis]
-    below_threshold_color_array = np.array(below_threshold_color)[np.newaxis, np.newaxis, :]
-
-    # Use numpy's take function to create a color map. The color map is an array of colors corresponding
-    # to the indices.
-    color_map = np.take(colors, indices + 1, axis=0)
+    if statistics is not None:
+        statistics.add(file_path, image_statistics)
+    return color_image
 
-    # Use numpy's where function to create the color image. If the maximum value of a pixel is greater than the
-    # threshold, the pixel's color is taken from the color map. Otherwise, the pixel's color is set to
-    # below_threshold_color.
-    color_image = np.where(max_values[..., np.newaxis] > threshold, color_map, below_threshold_color_array)
 
-    color_image_uint8 = color_image.astype(np.uint8)
-    color_image_uint8 = cv2.cvtColor(color_image_uint8, cv2.COLOR_RGB2BGR)
+def get_probability_files(dir_path: str) -> list:
+    """
+    List the .h5 files of a directory.
 
-    # Close the h5 file
-    f.close()
+    Parameters
+    ----------
+    dir_path : str
+        The path to the directory.
 
-    return color_image_uint8
+    Returns
+    -------
+    list
+        The paths of the .h5 files, empty if the directory does not exist. The list is built before returning, so
+        that images can be written to the directory while the files are processed.
+    """
+    if not Path(dir_path).is_dir():
+        return []
+    return [str(file) for file in Path(dir_path).iterdir() if file.suffix == ".h5"]  # noqa: PLR2004
 
 
-def treshold_probabilities(
+def treshold_probabilities(  # noqa: PLR0913
     file_or_dir_path: str,
     threshold: float,
     below_threshold_color: list,
     channel_colors: list,
     *,
     deletion: bool = True,
+    max_memory_mb: float | None = None,
+    color_format: str | None = None,
+    png_compression: int | None = None,
+    workers: int = 1,
+    executor: str = "thread",
+    max_in_flight: int | None = None,
+    encode_workers: int = 1,
+    statistics: BatchStatistics | None = None,
+    metrics: RunMetrics | None = None,
 ) -> None:
     """
     Process .h5 file(s) to create color images based on probability thresholds.
@@ -410,22 +981,96 @@ def treshold_probabilities(
         RGB color for values below the threshold.
     channel_colors : list
         List of RGB colors for each channel.
+    deletion : bool, optional
+        If True, the .h5 files will be deleted after processing. Files which could not be processed are never
+        deleted. Default is True.
+    max_memory_mb : float, optional
+        If provided, each file is processed by blocks using at most about this amount of memory and written to a
+        .tif file (see `process_single_file`). Default is None.
+    color_format : str, optional
+        The format of the color images, 'png', 'tif', 'npy' or 'index' (see `process_single_file`). Default is
+        'png', or 'tif' with max_memory_mb.
+    png_compression : int, optional
+        The compression level of 'png' and 'index' images, from 0 (fastest) to 9 (smallest). Default is the one
+        of OpenCV.
+    workers : int, optional
+        The number of files of a directory processed concurrently. Default is 1.
+    executor : str, optional
+        'thread' to process the files in threads (reading and coloring overlap as NumPy releases the GIL) or
+        'process' to process them in separate processes. Default is 'thread'.
+    max_in_flight : int, optional
+        The maximum number of files submitted but not finished, see `map_bounded`. At most `workers` files are
+        loaded at the same time. Default is twice the number of workers.
+    encode_workers : int, optional
+        The number of threads writing the color images of a directory while the next files are colored (see
+        `OutputEncoder`), or 0 to write each image before coloring the next file. Ignored with the 'process'
+        executor. Default is 1.
+    statistics : BatchStatistics, optional
+        Collects the number of pixels of each class and the histogram of the maximum probability of each file,
+        computed while the file is colored (see `BatchStatistics`). Ignored with the 'process' executor.
+    metrics : RunMetrics, optional
+        Collects the seconds spent to read, color and write each file, and writes them as a report in the folder
+        once the files are processed (see `RunMetrics`). Ignored with the 'process' executor.
 
+    Raises
+    ------
+    ValueError
+        If the colors, color_format, png_compression or encode_workers are not valid.
+    BatchError
+        If some files of a directory could not be processed. The `errors` attribute maps each failed file to its
+        error, the other files are processed completely.
     """
-    if Path(file_or_dir_path).is_dir():
-        # If the path is a directory, apply the function to all .h5 files in the directory
-        for file in Path(file_or_dir_path).iterdir():
-            if file.suffix == ".h5":  # noqa: PLR2004
-                process_single_file(
-                    str(file),
-                    threshold,
-                    below_threshold_color,
-                    channel_colors,
-                    deletion=deletion,
-                )
-    else:
+    if encode_workers < 0:
+        msg = f"encode_workers must be a non-negative integer, got {encode_workers}"
+        raise ValueError(msg)
+
+    from easilastik.encoder import ColorOutput, OutputEncoder  # noqa: PLC0415
+
+    if not Path(file_or_dir_path).is_dir():
         # If the path is not a directory, assume it's a file and apply the function to it
-        process_single_file(file_or_dir_path, threshold, below_threshold_color, channel_colors, deletion=deletion)
+        process_single_file(
+            file_or_dir_path,
+            threshold,
+            below_threshold_color,
+            channel_colors,
+            deletion=deletion,
+            max_memory_mb=max_memory_mb,
+            output=ColorOutput(color_format, png_compression, statistics=statistics),
+            metrics=metrics,
+        )
+        return
+
+    from easilastik.colorize import check_colors  # noqa: PLC0415
+
+    # The encoder, the statistics and the metrics cannot be shared with other processes
+    shared = executor == "thread"  # noqa: PLR2004
+    encoder = OutputEncoder(encode_workers) if encode_workers > 0 and shared else None
+    output = ColorOutput(color_format, png_compression, encoder=encoder, statistics=statistics if shared else None)
+
+    # Check the colors and the format once rather than failing on every file
+    check_colors(below_threshold_color, channel_colors)
+    output.check(max_memory_mb)
+
+    # If the path is a directory, apply the function to all .h5 files in the directory
+    process_file = functools.partial(
+        process_single_file,
+        threshold=threshold,
+        below_threshold_color=below_threshold_color,
+        channel_colors=channel_colors,
+        deletion=deletion,
+        max_memory_mb=max_memory_mb,
+        output=output,
+        metrics=metrics if shared else None,
+    )
+    with measure_run(metrics, file_or_dir_path):
+        files = get_probability_files(file_or_dir_path)
+        with encoder or contextlib.nullcontext():
+            errors = map_bounded(process_file, files, workers, executor=executor, max_in_flight=max_in_flight)
+        if encoder is not None:
+            errors.update(encoder.errors)
+        if errors:
+            msg = f"Error during the thresholding of {len(errors)} files. See console output for details."
+            raise BatchError(msg, errors)
 
 
 ###############################################################################################################
@@ -433,7 +1078,84 @@ def treshold_probabilities(
 ###############################################################################################################
 
 
-def run_ilastik_probabilities(
+def get_probability_processor(
+    threshold: float,
+    below_threshold_color: list,
+    channel_colors: list,
+    *,
+    deletion: bool = True,
+    max_memory_mb: float | None = None,
+    output: ColorOutput | None = None,
+    compact: str | None = None,
+    metrics: RunMetrics | None = None,
+) -> Callable[[str], None]:
+    """
+    Check the settings of the post-processing of probability files and return the function applying it.
+
+    Parameters
+    ----------
+    threshold : float
+        Threshold value for color mapping.
+    below_threshold_color : list
+        RGB color for values below the threshold.
+    channel_colors : list
+        List of RGB colors for each channel.
+    deletion : bool, optional
+        If True, each .h5 file is deleted once colored. Default is True.
+    max_memory_mb : float, optional
+        The memory budget of the coloring, see `process_single_file`. Default is None.
+    output : ColorOutput, optional
+        The format of the color images, their PNG compression level, the encoder writing them in the background
+        and the statistics collecting the pixel statistics of each file, see `process_single_file`.
+    compact : str, optional
+        The data type each probability file is compacted to before being colored, see
+        `run_ilastik_probabilities`. Default is None.
+    metrics : RunMetrics, optional
+        The metrics receiving the duration of the compaction and coloring of each file.
+
+    Returns
+    -------
+    Callable[[str], None]
+        The function compacting and coloring a probability file. It may be called from several threads.
+
+    Raises
+    ------
+    ValueError
+        If the colors, the color format, the PNG compression level or compact are not valid.
+    """
+    from easilastik.colorize import check_colors  # noqa: PLC0415
+    from easilastik.compact import COMPACT_DTYPES, compact_probabilities  # noqa: PLC0415
+    from easilastik.encoder import ColorOutput  # noqa: PLC0415
+
+    output = output or ColorOutput()
+    check_colors(below_threshold_color, channel_colors)
+    output.check(max_memory_mb)
+    if compact is not None and compact not in COMPACT_DTYPES:
+        msg = f"compact must be one of {list(COMPACT_DTYPES)}, got '{compact}'"
+        raise ValueError(msg)
+
+    color_file = functools.partial(
+        process_single_file,
+        threshold=threshold,
+        below_threshold_color=below_threshold_color,
+        channel_colors=channel_colors,
+        deletion=deletion,
+        max_memory_mb=max_memory_mb,
+        output=output,
+        metrics=metrics,
+    )
+
+    def process_file(file_path: str) -> None:
+        if compact is not None:
+            # The probabilities are then read back from the smaller file
+            with measure(metrics, "compact", file_path):
+                compact_probabilities(file_path, compact)
+        color_file(file_path)
+
+    return process_file
+
+
+def run_ilastik_probabilities(  # noqa: PLR0913
     input_path: str,
     model_path: str,
     result_base_path: str,
@@ -442,8 +1164,24 @@ def run_ilastik_probabilities(
     channel_colors: list,
     *,
     deletion: bool = True,
-    ilastik_script_path: str | None = find_ilastik(),
-) -> None:
+    ilastik_script_path: str | None = None,
+    session: IlastikSession | None = None,
+    workers: int | str = 1,
+    max_memory_mb: float | None = None,
+    threshold_workers: int = 1,
+    color_format: str | None = None,
+    png_compression: int | None = None,
+    encode_workers: int = 1,
+    cache: ResultCache | None = None,
+    resume: bool = False,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    compact: str | None = None,
+    tile_size: int | None = None,
+    tile_halo: int | None = None,
+    statistics: BatchStatistics | None = None,
+    isolation: FailureIsolation | None = None,
+    metrics: RunMetrics | None = None,
+) -> dict | None:
     """
     Execute Ilastik in headless mode to generate probability maps and color images based on a specifiedthreshold.
 
@@ -465,16 +1203,129 @@ def run_ilastik_probabilities(
     channel_colors : list
         The colors for the channels. Must be a list of lists, where each inner list is a list of 3 integers between
         0 and 255.
+    session : IlastikSession, optional
+        A running Ilastik session with the project already loaded, used instead of a new Ilastik process.
+    workers : int | str, optional
+        The number of Ilastik processes to run concurrently on shards of the images, or 'auto' (see
+        `run_ilastik`). Default is 1.
+    max_memory_mb : float, optional
+        If provided, the probabilities are colored by blocks using at most about this amount of memory and the color
+        images are written to .tif files (see `process_single_file`). Default is None.
+    threshold_workers : int, optional
+        The number of probability files colored concurrently. Default is 1.
+    color_format : str, optional
+        The format of the color images, 'png', 'tif', 'npy' or 'index' (see `process_single_file`). Default is
+        'png', or 'tif' with max_memory_mb.
+    png_compression : int, optional
+        The compression level of 'png' and 'index' images, from 0 (fastest) to 9 (smallest). Default is the one
+        of OpenCV.
+    encode_workers : int, optional
+        The number of threads writing the color images while the next files are colored, or 0 to write each image
+        in the thread coloring it (see `treshold_probabilities`). Default is 1.
+    cache : ResultCache, optional
+        A cache of the probability files, see `run_ilastik`.
+    resume : bool, optional
+        Whether to skip the images already processed by a previous run, see `run_ilastik`. An image counts as
+        processed once its probability file is written, even if it was deleted after being colored; probability
+        files left uncolored by an interrupted run are colored at the end.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the input folder to process, see `run_ilastik`.
+    compact : str, optional
+        If provided ('uint8' or 'float16'), each probability file is rewritten with this data type and compressed
+        chunks before being colored (see `compact_probabilities`), so that it takes less space on disk and is read
+        faster. Only useful with deletion=False. Default is None.
+    tile_size : int, optional
+        If provided, the images larger than tile_size pixels are processed as tiles whose probabilities are
+        stitched into a single file before being colored, see `run_ilastik`. Default is None.
+    tile_halo : int, optional
+        The number of pixels added on each side of the tiles, see `run_ilastik`.
+    statistics : BatchStatistics, optional
+        Collects the number of pixels of each class and the histogram of the maximum probability of each image,
+        computed while its probabilities are colored (see `BatchStatistics`).
+    isolation : FailureIsolation, optional
+        If provided, the images on which Ilastik fails are isolated and returned, the other ones being colored,
+        see `run_ilastik`.
+    metrics : RunMetrics, optional
+        Collects the duration of each stage, for the whole run and for each image (Ilastik, compaction, reading,
+        coloring and writing), and writes them as a report in result_base_path once the run ends (see
+        `RunMetrics`).
+
+    Returns
+    -------
+    dict | None
+        With isolation, the images which succeeded, failed and were skipped in Ilastik (see `run_ilastik`), else
+        None.
+
+    Raises
+    ------
+    ValueError
+        If the colors, color_format, png_compression, encode_workers or compact are not valid.
+    BatchError
+        If some probability files could not be colored. The `errors` attribute maps each failed file to its error.
+
+    Notes
+    -----
+    The probability files are colored while Ilastik processes the next images, as soon as each one is complete
+    (see `run_watched`), so that the total duration is close to the one of the slower of the two steps.
     """
-    # Run Ilastik to create h5 files
-    run_ilastik(
-        input_path,
-        model_path,
-        result_base_path,
-        ilastik_script_path,
-        export_source="Probabilities",
-        output_format="hdf5",
+    if encode_workers < 0:
+        msg = f"encode_workers must be a non-negative integer, got {encode_workers}"
+        raise ValueError(msg)
+
+    from easilastik.encoder import ColorOutput, OutputEncoder  # noqa: PLC0415
+
+    # The threads of the encoder are only started by its first image
+    encoder = OutputEncoder(encode_workers) if encode_workers > 0 else None
+    # Check the colors before running Ilastik rather than once the probabilities are computed
+    process_file = get_probability_processor(
+        threshold,
+        below_threshold_color,
+        channel_colors,
+        deletion=deletion,
+        max_memory_mb=max_memory_mb,
+        output=ColorOutput(color_format, png_compression, encoder=encoder, statistics=statistics),
+        compact=compact,
+        metrics=metrics,
     )
 
-    # Create color images from the h5 files
-    treshold_probabilities(result_base_path, threshold, below_threshold_color, channel_colors, deletion=deletion)
+    submitted = {}
+    with measure_run(metrics, result_base_path):
+        # The coloring threads are stopped before the encoder, so that all their images are written
+        with encoder or contextlib.nullcontext(), ThreadPoolExecutor(max_workers=threshold_workers) as executor:
+
+            def on_output(output_path: str) -> None:
+                submitted[executor.submit(process_file, output_path)] = output_path
+
+            # Run Ilastik to create h5 files, each one being colored as soon as it is complete
+            result = run_ilastik(
+                input_path,
+                model_path,
+                result_base_path,
+                ilastik_script_path,
+                export_source="Probabilities",
+                output_format="hdf5",
+                session=session,
+                workers=workers,
+                on_output=on_output,
+                cache=cache,
+                resume=resume,
+                extensions=extensions,
+                tile_size=tile_size,
+                tile_halo=tile_halo,
+                isolation=isolation,
+                metrics=metrics,
+            )
+
+            # Also color the other h5 files of the folder, e.g. the ones left by a previous run
+            colored = {Path(path).resolve() for path in submitted.values()}
+            for file in get_probability_files(result_base_path):
+                if Path(file).resolve() not in colored:
+                    on_output(file)
+
+        errors = collect_errors(list(submitted), submitted)
+        if encoder is not None:
+            errors.update(encoder.errors)
+        if errors:
+            msg = f"Error during the thresholding of {len(errors)} files. See console output for details."
+            raise BatchError(msg, errors)
+    return result
@@ -0,0 +1,264 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""Keep an Ilastik project loaded in a long-lived worker process between calls."""
+
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import subprocess
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik import ilastik_worker
+from easilastik.find_ilastik import find_ilastik
+from easilastik.utils import get_output_filename_format
+
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+PYTHON_CANDIDATES = ["bin/python", "bin/python3", "python.exe", "python"]
+
+
+def find_ilastik_python(ilastik_script_path: str) -> str:
+    """
+    Find the Python interpreter bundled with an Ilastik installation.
+
+    Parameters
+    ----------
+    ilastik_script_path : str
+        The path to the Ilastik script (`run_ilastik.sh` or `ilastik.exe`).
+
+    Returns
+    -------
+    str
+        The path to the Python interpreter of the Ilastik installation.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no interpreter is found next to the Ilastik script.
+    """
+    ilastik_dir = Path(ilastik_script_path).parent
+    for candidate in PYTHON_CANDIDATES:
+        python_path = ilastik_dir / candidate
+        if python_path.is_file():
+            return str(python_path)
+
+    msg = f"Could not find the Python interpreter of the Ilastik installation in '{ilastik_dir}'."
+    raise FileNotFoundError(msg)
+
+
+class IlastikSession:
+    """
+    Long-lived Ilastik worker that keeps a project loaded between calls.
+
+    The project is loaded once when the worker starts, then each call to `run` only pays for the processing of
+    its images. If the worker dies, it is restarted automatically and the batch is sent again.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to the Ilastik project file.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    python_path : str, optional
+        The path to the Python interpreter of the Ilastik installation. If not provided, it is looked up next to
+        the Ilastik script.
+    max_restarts : int, optional
+        The number of times the worker is restarted for a single batch before giving up. Default is 2.
+
+    Examples
+    --------
+    >>> with IlastikSession("path/to/model.ilp") as session:
+    ...     run_ilastik("image_1.png", "path/to/model.ilp", "results/", session=session)
+    ...     run_ilastik("image_2.png", "path/to/model.ilp", "results/", session=session)
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        ilastik_script_path: str | None = None,
+        *,
+        python_path: str | None = None,
+        max_restarts: int = 2,
+    ) -> None:
+        if not Path(model_path).is_file():
+            msg = f"model_path '{model_path}' is not a valid file."
+            raise FileNotFoundError(msg)
+
+        if python_path is None:
+            if ilastik_script_path is None:
+                ilastik_script_path = find_ilastik()
+            if not ilastik_script_path:
+                msg = "Could not find Ilastik. Please provide the path to the Ilastik script."
+                raise FileNotFoundError(msg)
+            python_path = find_ilastik_python(ilastik_script_path)
+
+        self.model_path = str(Path(model_path).resolve())
+        self.python_path = python_path
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self._process: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+
+    @property
+    def alive(self) -> bool:
+        """Whether the worker process is running."""
+        return self._process is not None and self._process.poll() is None
+
+    def check_model(self, model_path: str) -> None:
+        """
+        Check that the session was opened for a given project.
+
+        Parameters
+        ----------
+        model_path : str
+            The path to the Ilastik project file.
+
+        Raises
+        ------
+        ValueError
+            If the session was opened for another project.
+        """
+        if Path(model_path).resolve() != Path(self.model_path):
+            msg = f"The session was opened for '{self.model_path}', not for '{model_path}'."
+            raise ValueError(msg)
+
+    def start(self) -> None:
+        """
+        Start the worker process and wait until the project is loaded.
+
+        Raises
+        ------
+        RuntimeError
+            If the worker exits before the project is loaded.
+        """
+        if self.alive:
+            return
+        if self._process is not None:
+            self.restarts += 1
+            logger.warning("Ilastik worker exited with code %s, restarting it.", self._process.returncode)
+
+        logger.info("Loading %s in a new Ilastik worker.", self.model_path)
+        self._process = subprocess.Popen(  # noqa: S603
+            [self.python_path, ilastik_worker.__file__, "--project", self.model_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        try:
+            self._read_response()
+        except EOFError as err:
+            self._kill()
+            msg = f"The Ilastik worker could not load {self.model_path}. See console output for details."
+            raise RuntimeError(msg) from err
+
+    def run(
+        self,
+        inputs: list,
+        result_base_path: str,
+        export_source: str = "Simple Segmentation",
+        output_format: str = "png",
+    ) -> float:
+        """
+        Process a batch of images with the loaded project.
+
+        Parameters
+        ----------
+        inputs : list
+            The paths of the images to process.
+        result_base_path : str
+            The base path where the results will be saved.
+        export_source : str, optional
+            The type of data to export. Default is "Simple Segmentation".
+        output_format : str, optional
+            The format of the output files. Default is "png".
+
+        Returns
+        -------
+        float
+            The time spent by the worker processing the batch, in seconds.
+
+        Raises
+        ------
+        RuntimeError
+            If Ilastik fails to process the batch, or if the worker keeps dying.
+        """
+        request = {
+            "inputs": [str(path) for path in inputs],
+            "export_source": export_source,
+            "output_format": output_format,
+            "output_filename_format": get_output_filename_format(result_base_path, export_source),
+        }
+
+        with self._lock:
+            for _ in range(self.max_restarts + 1):
+                self.start()
+                try:
+                    request["id"] = next(self._request_ids)
+                    self._process.stdin.write(json.dumps(request) + "\n")
+                    self._process.stdin.flush()
+                    response = self._read_response()
+                except (BrokenPipeError, ConnectionResetError, EOFError):
+                    # Reap the dead worker, it is restarted on the next attempt
+                    self._process.wait()
+                    continue
+
+                if not response["ok"]:
+                    logger.error(response["error"])
+                    msg = "Error during Ilastik execution. See console output for details."
+                    raise RuntimeError(msg)
+                return response["elapsed"]
+
+        msg = f"The Ilastik worker died {self.max_restarts + 1} times in a row."
+        raise RuntimeError(msg)
+
+    def close(self) -> None:
+        """Stop the worker process."""
+        if self._process is None:
+            return
+        if self.alive:
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._kill()
+        self._process = None
+
+    def _read_response(self) -> dict:
+        """Read the next response of the worker, skipping any other output."""
+        for line in self._process.stdout:
+            if line.startswith(ilastik_worker.RESPONSE_PREFIX):
+                return json.loads(line[len(ilastik_worker.RESPONSE_PREFIX) :])
+        msg = "The Ilastik worker exited unexpectedly."
+        raise EOFError(msg)
+
+    def _kill(self) -> None:
+        """Kill the worker process without waiting for pending work."""
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def __enter__(self) -> IlastikSession:  # noqa: PYI034
+        """Start the worker when entering the context."""
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Stop the worker when leaving the context."""
+        self.close()
@@ -0,0 +1,207 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Count the pixels of each class while the probabilities are thresholded.
+
+The statistics are updated by the coloring engine from the classes and maximum probabilities it computes anyway, so
+that they cost a few histograms of arrays already in memory rather than a second read of the color images. The
+statistics of a batch of files are written as a CSV table, one row per image, or as a NumPy .npz archive.
+
+The mean probability is reported per class rather than as a histogram: the probabilities exported by Ilastik sum to
+1 over the channels, so the mean probability of every pixel is 1 / n_channels and its histogram would hold a single
+bin. The histogram is the one of the maximum probability, which measures how confident the classification is.
+"""
+
+from __future__ import annotations
+
+import csv
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+# Number of bins of the histograms of the maximum probability, between 0 and 1
+DEFAULT_BINS = 20
+
+
+class PixelStatistics:
+    """
+    Pixel statistics of a probability map, accumulated block by block.
+
+    Parameters
+    ----------
+    n_channels : int
+        The number of channels of the probabilities.
+    value_scale : float, optional
+        The factor by which the stored values are the probabilities, see `get_value_scale`. Default is 1.
+    bins : int, optional
+        The number of bins of the histogram of the maximum probability. Default is `DEFAULT_BINS`.
+
+    Attributes
+    ----------
+    counts : np.ndarray
+        The number of pixels of each class: index 0 counts the pixels below the threshold and index i + 1 the pixels
+        won by channel i.
+    probability_sums : np.ndarray
+        The sum of the maximum probability of the pixels of each class, indexed as counts.
+    histogram : np.ndarray
+        The number of pixels whose maximum probability falls in each of the bins of equal width between 0 and 1.
+    """
+
+    def __init__(self, n_channels: int, value_scale: float = 1.0, bins: int = DEFAULT_BINS) -> None:
+        self.value_scale = value_scale
+        self.counts = np.zeros(n_channels + 1, dtype=np.int64)
+        self.probability_sums = np.zeros(n_channels + 1, dtype=np.float64)
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def update(self, classes: np.ndarray, best: np.ndarray) -> None:
+        """
+        Add the pixels of a block.
+
+        Parameters
+        ----------
+        classes : np.ndarray
+            The class of each pixel, as returned by `ColorizeEngine.classify`.
+        best : np.ndarray
+            The maximum stored value of each pixel, with the shape of classes.
+        """
+        classes = classes.ravel()
+        best = best.ravel()
+        n_classes = len(self.counts)
+        self.counts += np.bincount(classes, minlength=n_classes)
+        self.probability_sums += np.bincount(classes, weights=best, minlength=n_classes) / self.value_scale
+
+        bins = len(self.histogram)
+        indices = np.multiply(best, bins / self.value_scale, dtype=np.float32).astype(np.intp)
+        np.clip(indices, 0, bins - 1, out=indices)
+        self.histogram += np.bincount(indices, minlength=bins)
+
+    @property
+    def mean_probabilities(self) -> np.ndarray:
+        """The mean maximum probability of the pixels of each class, NaN for the classes without pixels."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.probability_sums / self.counts
+
+
+class BatchStatistics:
+    """
+    Pixel statistics of each file of a batch, collected while the files are thresholded.
+
+    Pass it as the `statistics` argument of `treshold_probabilities` or `run_ilastik_probabilities`, then write the
+    statistics with `write`. It may be shared by the threads thresholding the files.
+
+    Parameters
+    ----------
+    bins : int, optional
+        The number of bins of the histograms of the maximum probability. Default is `DEFAULT_BINS`.
+
+    Attributes
+    ----------
+    images : dict
+        The `PixelStatistics` of each file, keyed by its path.
+    """
+
+    def __init__(self, bins: int = DEFAULT_BINS) -> None:
+        self.bins = bins
+        self.images = {}
+        self._lock = threading.Lock()
+
+    def create(self, n_channels: int, value_scale: float = 1.0) -> PixelStatistics:
+        """Return empty statistics for a file, with the bins of the batch."""
+        return PixelStatistics(n_channels, value_scale, self.bins)
+
+    def add(self, file_path: str, statistics: PixelStatistics) -> None:
+        """Record the statistics of a file, replacing the previous ones of the same file."""
+        with self._lock:
+            self.images[str(file_path)] = statistics
+
+    def get_arrays(self) -> dict:
+        """
+        Return the statistics of all the files as arrays, one row per file.
+
+        Returns
+        -------
+        dict
+            'images' (the paths of the files), 'counts' and 'probability_sums' (padded with zeros to the largest
+            number of classes), 'histograms' and 'bin_edges'.
+        """
+        with self._lock:
+            images = dict(self.images)
+        n_classes = max((len(statistics.counts) for statistics in images.values()), default=1)
+        counts = np.zeros((len(images), n_classes), dtype=np.int64)
+        probability_sums = np.zeros((len(images), n_classes), dtype=np.float64)
+        histograms = np.zeros((len(images), self.bins), dtype=np.int64)
+        for row, statistics in enumerate(images.values()):
+            counts[row, : len(statistics.counts)] = statistics.counts
+            probability_sums[row, : len(statistics.counts)] = statistics.probability_sums
+            histograms[row] = statistics.histogram
+        return {
+            "images": np.array(list(images), dtype=str),
+            "counts": counts,
+            "probability_sums": probability_sums,
+            "histograms": histograms,
+            "bin_edges": np.linspace(0, 1, self.bins + 1),
+        }
+
+    def write(self, path: str) -> Path:
+        """
+        Write the statistics of all the files.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file, ending with '.csv' or '.npz'. The CSV table has one row per file with its number
+            of pixels, the number ('class_i'), fraction ('fraction_i') and mean maximum probability
+            ('mean_probability_i') of the pixels of each class i, class 0 holding the pixels below the threshold and
+            class i + 1 the pixels won by channel i, and the histogram of the maximum probability. The .npz archive
+            holds the arrays returned by `get_arrays`.
+
+        Returns
+        -------
+        Path
+            The path of the file written.
+
+        Raises
+        ------
+        ValueError
+            If the extension of path is neither '.csv' nor '.npz'.
+        """
+        path = Path(path)
+        if path.suffix not in {".csv", ".npz"}:
+            msg = f"The statistics are written to a '.csv' or '.npz' file, got {path}"
+            raise ValueError(msg)
+
+        arrays = self.get_arrays()
+        if path.suffix == ".npz":  # noqa: PLR2004
+            np.savez(path, **arrays)
+            return path
+
+        counts = arrays["counts"]
+        n_classes = counts.shape[1] - 1
+        pixels = counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = counts / pixels[:, None]
+            mean_probabilities = arrays["probability_sums"] / counts
+        header = [
+            "image",
+            "pixels",
+            *(f"class_{index}" for index in range(n_classes + 1)),
+            *(f"fraction_{index}" for index in range(n_classes + 1)),
+            *(f"mean_probability_{index}" for index in range(n_classes + 1)),
+            *(f"max_probability_{low:.2f}" for low in arrays["bin_edges"][:-1]),
+        ]
+        with path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row, image in enumerate(arrays["images"]):
+                writer.writerow(
+                    [
+                        image,
+                        pixels[row],
+                        *counts[row],
+                        *(f"{value:.6g}" for value in fractions[row]),
+                        *("" if np.isnan(value) else f"{value:.6g}" for value in mean_probabilities[row]),
+                        *arrays["histograms"][row],
+                    ]
+                )
+        return path
@@ -0,0 +1,185 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Iterate over the results of Ilastik as they are produced.
+
+The images of a folder are discovered lazily and processed in batches of bounded size, each batch by one Ilastik
+process (or by a session). The result of each image is yielded as soon as Ilastik has written it, while it
+processes the next images, and nothing is processed beyond the batch being consumed.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import logging
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.find_ilastik import find_ilastik
+from easilastik.pipeline import HDF5_SUFFIXES, watch_outputs
+from easilastik.run_ilastik import build_ilastik_args, check_arguments
+from easilastik.utils import get_output_path, iter_input_paths
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    import numpy as np
+
+    from easilastik.session import IlastikSession
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 64
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    """
+    Group items into lists, consuming only the items of one list at a time.
+
+    Parameters
+    ----------
+    items : Iterable
+        The items to group.
+    batch_size : int
+        The maximum number of items of each list.
+
+    Yields
+    ------
+    list
+        The next batch_size items, or less for the last batch.
+    """
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def load_output(output_path: str) -> np.ndarray:
+    """
+    Read an output file written by Ilastik.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output file.
+
+    Returns
+    -------
+    np.ndarray
+        The 'exported_data' dataset of HDF5 files, or the image as it is stored (without color conversion) for
+        the other formats.
+    """
+    if Path(output_path).suffix in HDF5_SUFFIXES:
+        import h5py  # noqa: PLC0415
+
+        with h5py.File(output_path, "r") as f:
+            return f["exported_data"][()]
+
+    import cv2  # noqa: PLC0415
+
+    return cv2.imread(output_path, cv2.IMREAD_UNCHANGED)
+
+
+def iter_ilastik(
+    input_path: str,
+    model_path: str,
+    result_base_path: str,
+    ilastik_script_path: str | None = None,
+    export_source: str = "Simple Segmentation",
+    output_format: str = "png",
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    session: IlastikSession | None = None,
+    load: bool = False,
+) -> Iterator[tuple]:
+    """
+    Execute Ilastik in headless mode and yield the result of each image as soon as it is written.
+
+    The arguments are checked when the iteration starts. Breaking out of the iteration (or closing the generator)
+    kills the running Ilastik process, and the remaining images are not processed.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results will be saved.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    export_source : str, optional
+        The type of data to export. Default is "Simple Segmentation".
+    output_format : str, optional
+        The format of the output files. Default is "png". Formats written as several files per image (sequences)
+        are not supported.
+    batch_size : int, optional
+        The number of images processed by each Ilastik process. Larger batches pay the loading of the project less
+        often, smaller ones stop sooner when the iteration is abandoned. Default is 64.
+    session : IlastikSession, optional
+        A running Ilastik session with the project already loaded. The results of a batch are then yielded once
+        the whole batch is processed.
+    load : bool, optional
+        Whether to yield the results as arrays (see `load_output`) rather than as paths. Default is False.
+
+    Yields
+    ------
+    tuple
+        (input_path, output, timings) for each image in the order of processing, where output is the path of the
+        output file (or its content if load is True) and timings is a dict with the seconds of 'processing'
+        (since the previous result of the batch was available, or since the start of the batch, which includes
+        the start of Ilastik; with a session, the duration of the batch divided by its size), the seconds spent
+        to 'load' the output and the seconds 'elapsed' since the iteration started.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the input_path does not exist.
+    ValueError
+        If the export_source or output_format is not valid, or if the session was opened for another project.
+    RuntimeError
+        If there is an error during the Ilastik execution. The results of the images processed before the error
+        have already been yielded.
+    """
+    if session is not None:
+        session.check_model(model_path)
+    else:
+        ilastik_script_path = ilastik_script_path or find_ilastik()
+        if ilastik_script_path is None:
+            logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
+            return
+
+    check_arguments(input_path, export_source, output_format, single_file=True)
+    Path(result_base_path).mkdir(parents=True, exist_ok=True)
+
+    start_time = time.perf_counter()
+    for batch in iter_batches(iter_input_paths(input_path), batch_size):
+        logger.info("Processing a batch of %d images.", len(batch))
+        output_paths = [get_output_path(result_base_path, path, export_source, output_format) for path in batch]
+        previous_time = time.perf_counter()
+
+        if session is not None:
+            duration = session.run(batch, result_base_path, export_source, output_format) / len(batch)
+            completed = (index for index, path in enumerate(output_paths) if Path(path).exists())
+        else:
+            duration = None
+            ilastik_args = build_ilastik_args(
+                ilastik_script_path, model_path, result_base_path, export_source, output_format, batch
+            )
+            completed = watch_outputs(ilastik_args, output_paths)
+
+        # Closing the generator of outputs kills Ilastik if the iteration is abandoned
+        with contextlib.closing(completed):
+            for index in completed:
+                done_time = time.perf_counter()
+                output = load_output(output_paths[index]) if load else output_paths[index]
+                timings = {
+                    "processing": duration if duration is not None else done_time - previous_time,
+                    "load": time.perf_counter() - done_time,
+                    "elapsed": done_time - start_time,
+                }
+                yield str(batch[index]), output, timings
+                previous_time = done_time
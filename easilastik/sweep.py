@@ -0,0 +1,304 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Try many thresholds on a probability file from a single read of the probabilities.
+
+The probabilities are reduced once to a sidecar file stored next to the .h5 file: the winning channel of each pixel
+as a uint8 and its maximum probability quantised to a uint16, three bytes per pixel whatever the number of
+channels. A threshold is then applied with a comparison of the quantised maximum, and the pixel counts of any number
+of thresholds come from a single histogram of the sidecar, so that the float probabilities are never read again.
+
+The quantisation has a resolution of 1/65535 of the range of the probabilities: only a pixel whose maximum
+probability is within half a step of the threshold may fall on the other side of it than with
+`color_treshold_probabilities`.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from easilastik.colorize import (
+    check_colors,
+    get_block_rows,
+    get_engine,
+    get_palette,
+    get_value_scale,
+    open_probabilities,
+)
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    import h5py
+
+
+SIDECAR_SUFFIX = ".sidecar.npz"
+
+# Number of quantisation steps of the maximum probability, stored as a uint16
+LEVELS = 65535
+LEVEL_BITS = 16
+
+# Number of pixels whose histogram is computed at once
+HISTOGRAM_CHUNK_PIXELS = 2**22
+
+
+def get_sidecar_path(file_path: str) -> Path:
+    """
+    Return the path of the sidecar of a probability file.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file.
+
+    Returns
+    -------
+    Path
+        The path of the sidecar, next to the .h5 file.
+    """
+    return Path(file_path).with_suffix(SIDECAR_SUFFIX)
+
+
+def get_scale(data: h5py.Dataset) -> float:
+    """
+    Return the factor converting the stored values of probabilities to quantisation steps.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The probabilities.
+
+    Returns
+    -------
+    float
+        LEVELS divided by the largest value: 1 for floats, the largest value of the type for integers.
+    """
+    max_value = np.iinfo(data.dtype).max if np.issubdtype(data.dtype, np.integer) else 1.0
+    return LEVELS / max_value
+
+
+def quantise(best: np.ndarray, scale: float, out: np.ndarray) -> np.ndarray:
+    """
+    Quantise maximum probabilities to uint16.
+
+    Parameters
+    ----------
+    best : np.ndarray
+        The maximum probability of each pixel.
+    scale : float
+        The factor returned by `get_scale`.
+    out : np.ndarray
+        The uint16 array receiving the quantised probabilities.
+
+    Returns
+    -------
+    np.ndarray
+        out, holding the probabilities multiplied by scale, rounded and clipped to [0, LEVELS].
+    """
+    steps = np.multiply(best, np.float32(scale), dtype=np.float32)
+    np.rint(steps, out=steps)
+    np.clip(steps, 0, LEVELS, out=steps)
+    np.copyto(out, steps, casting="unsafe")
+    return out
+
+
+def compute_sidecar(file_path: str, *, max_memory_mb: float | None = None, overwrite: bool = False) -> Path:
+    """
+    Reduce a probability file to its winning channels and quantised maximum probabilities.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file exported by Ilastik.
+    max_memory_mb : float, optional
+        If provided, the probabilities are read by blocks of rows using at most about this amount of memory, on top
+        of the three bytes per pixel of the sidecar. Default is None (the whole file is loaded at once).
+    overwrite : bool, optional
+        Whether to compute the sidecar again if it is newer than the .h5 file. Default is False.
+
+    Returns
+    -------
+    Path
+        The path of the sidecar, an .npz file holding 'classes' (the index of the winning channel plus 1),
+        'max_probability' (the quantised maximum probability), 'scale' (the factor converting thresholds to
+        quantisation steps) and 'n_channels'.
+
+    Raises
+    ------
+    FileNotFoundError
+        If neither the file nor its sidecar exist.
+    ValueError
+        If the file does not contain 'exported_data'.
+    """
+    sidecar_path = get_sidecar_path(file_path)
+    if not Path(file_path).exists():
+        if sidecar_path.exists():
+            return sidecar_path
+        msg = f"File at {file_path} does not exist"
+        raise FileNotFoundError(msg)
+    if not overwrite and sidecar_path.exists() and sidecar_path.stat().st_mtime >= Path(file_path).stat().st_mtime:
+        return sidecar_path
+
+    engine = get_engine()
+    with open_probabilities(file_path) as f:
+        data = f["exported_data"]
+        scale = get_scale(data)
+        # Thresholds are given in probabilities, which may differ from the stored values (see `get_value_scale`)
+        threshold_scale = scale * get_value_scale(data)
+        n_channels = data.shape[-1]
+        classes = np.empty(data.shape[:-1], dtype=np.uint8)
+        max_probability = np.empty(data.shape[:-1], dtype=np.uint16)
+        if max_memory_mb is None:
+            winners, best = engine.find_winners(engine.read(data))
+            np.copyto(classes, winners)
+            quantise(best, scale, max_probability)
+        else:
+            height = data.shape[-3]
+            rows = get_block_rows(data, max_memory_mb)
+            for page in np.ndindex(*data.shape[:-3]):
+                for start in range(0, height, rows):
+                    selection = (*page, slice(start, min(start + rows, height)))
+                    winners, best = engine.find_winners(engine.read(data, selection))
+                    np.copyto(classes[selection], winners)
+                    quantise(best, scale, max_probability[selection])
+
+    # Write to a temporary file first so that an interrupted write never leaves a truncated sidecar
+    tmp_path = sidecar_path.with_name(f".{sidecar_path.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open("wb") as f:
+            np.savez(
+                f,
+                classes=classes,
+                max_probability=max_probability,
+                scale=np.float64(threshold_scale),
+                n_channels=np.int64(n_channels),
+            )
+        tmp_path.replace(sidecar_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return sidecar_path
+
+
+def count_pixels(classes: np.ndarray, max_probability: np.ndarray, n_channels: int) -> np.ndarray:
+    """
+    Count the pixels of each winning channel at each quantised maximum probability.
+
+    Parameters
+    ----------
+    classes : np.ndarray
+        The index of the winning channel plus 1 of each pixel.
+    max_probability : np.ndarray
+        The quantised maximum probability of each pixel.
+    n_channels : int
+        The number of channels.
+
+    Returns
+    -------
+    np.ndarray
+        An int64 array of shape (n_channels + 1, LEVELS + 1) whose element [c, q] is the number of pixels won by
+        channel c - 1 with the quantised maximum probability q.
+    """
+    histogram = np.zeros((n_channels + 1) * (LEVELS + 1), dtype=np.int64)
+    flat_classes = classes.reshape(-1)
+    flat_max = max_probability.reshape(-1)
+    for start in range(0, flat_classes.size, HISTOGRAM_CHUNK_PIXELS):
+        stop = start + HISTOGRAM_CHUNK_PIXELS
+        # Class and probability fit together in a uint32: the histogram of both is a single bincount
+        codes = flat_classes[start:stop].astype(np.uint32)
+        codes <<= LEVEL_BITS
+        codes |= flat_max[start:stop]
+        histogram += np.bincount(codes, minlength=histogram.size)[: histogram.size]
+    return histogram.reshape(n_channels + 1, LEVELS + 1)
+
+
+def sweep_thresholds(
+    file_path: str,
+    thresholds: Iterable[float],
+    below_threshold_color: list | None = None,
+    channel_colors: list | None = None,
+    *,
+    counts: bool = False,
+    max_memory_mb: float | None = None,
+) -> dict:
+    """
+    Color a probability file, or count its pixels, for several thresholds.
+
+    The sidecar of the file is computed on first use (see `compute_sidecar`) and reused by the next calls, so that
+    the probabilities are read once for any number of thresholds and calls.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .h5 file. Once its sidecar exists, the .h5 file may be deleted.
+    thresholds : Iterable[float]
+        The thresholds to apply. Pixels with maximum value greater than a threshold are assigned to their channel.
+    below_threshold_color : list, optional
+        RGB color for values below the threshold. Required unless counts is True.
+    channel_colors : list, optional
+        List of RGB colors for each channel. Required unless counts is True.
+    counts : bool, optional
+        Whether to return the number of pixels of each class rather than color images. Default is False.
+    max_memory_mb : float, optional
+        The memory budget used to compute the sidecar, see `compute_sidecar`. Default is None.
+
+    Returns
+    -------
+    dict
+        For each threshold, the color image in BGR format like `color_treshold_probabilities`, or with counts,
+        an int64 array whose element 0 is the number of pixels below the threshold and element i + 1 the number of
+        pixels assigned to channel i.
+
+    Raises
+    ------
+    FileNotFoundError
+        If neither the file nor its sidecar exist.
+    ValueError
+        If the colors are missing or not in the correct format, or if the length of channel_colors does not match
+        the number of channels in the data.
+    """
+    thresholds = list(thresholds)
+    if not counts:
+        if below_threshold_color is None or channel_colors is None:
+            msg = "below_threshold_color and channel_colors are required to color the images"
+            raise ValueError(msg)
+        check_colors(below_threshold_color, channel_colors)
+
+    with np.load(compute_sidecar(file_path, max_memory_mb=max_memory_mb)) as sidecar:
+        classes = sidecar["classes"]
+        max_probability = sidecar["max_probability"]
+        scale = float(sidecar["scale"])
+        n_channels = int(sidecar["n_channels"])
+
+    if counts:
+        # Pixels above a threshold t are the ones whose quantised maximum is greater than t * scale
+        tails = np.zeros((n_channels + 1, LEVELS + 2), dtype=np.int64)
+        tails[:, :-1] = np.cumsum(count_pixels(classes, max_probability, n_channels)[:, ::-1], axis=1)[:, ::-1]
+        results = {}
+        for threshold in thresholds:
+            first_above = int(np.clip(np.floor(threshold * scale) + 1, 0, LEVELS + 1))
+            result = tails[:, first_above].copy()
+            result[0] = classes.size - result[1:].sum()
+            results[threshold] = result
+        return results
+
+    if len(channel_colors) != n_channels:
+        msg = (
+            "The length of channel_colors must be equal to the number of channels in the data (there must be as many "
+            f"colors as labels annotated in the Ilastik project). Expected {n_channels}, got {len(channel_colors)}"
+        )
+        raise ValueError(msg)
+
+    palette = get_palette(below_threshold_color, channel_colors)
+    engine = get_engine()
+    mask = engine.buffer("mask", classes.shape, np.bool_)
+    thresholded = engine.buffer("classes", classes.shape, np.uint8)
+    results = {}
+    for threshold in thresholds:
+        np.greater(max_probability, threshold * scale, out=mask)
+        np.multiply(classes, mask, out=thresholded)
+        results[threshold] = np.take(palette, thresholded, axis=0)
+    return results
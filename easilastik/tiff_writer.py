@@ -0,0 +1,215 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""Write uncompressed striped TIFF images row block by row block, without holding the whole image in memory."""
+
+from __future__ import annotations
+
+import struct
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    import numpy as np
+
+
+# Classic TIFF files cannot address more than 4 GB, leave some room for the directories
+CLASSIC_TIFF_MAX_BYTES = 2**32 - 2**26
+
+# TIFF tags and field types
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+SHORT, LONG, LONG8 = 3, 4, 16
+TYPE_FORMATS = {SHORT: "H", LONG: "I", LONG8: "Q"}
+
+
+class StripedTiffWriter:
+    """
+    Write an 8-bit TIFF image (or a stack of images) strip by strip.
+
+    Rows are appended in order with `write_rows`, in blocks of any height. Only the rows of the current incomplete
+    strip are kept in memory. When a page is complete, its directory is written and the next rows go to the next
+    page. BigTIFF is used automatically when the file would exceed the 4 GB limit of classic TIFF.
+
+    Parameters
+    ----------
+    path : str
+        The path of the TIFF file to write.
+    width : int
+        The width of the images in pixels.
+    height : int
+        The height of the images in pixels.
+    samples : int, optional
+        The number of channels, 1 (grayscale) or 3 (RGB). Default is 3.
+    pages : int, optional
+        The number of images in the stack. Default is 1.
+    rows_per_strip : int, optional
+        The number of rows of each strip. Default is 64.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        height: int,
+        *,
+        samples: int = 3,
+        pages: int = 1,
+        rows_per_strip: int = 64,
+    ) -> None:
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.pages = pages
+        self.rows_per_strip = min(rows_per_strip, height)
+        self.bigtiff = width * height * samples * pages > CLASSIC_TIFF_MAX_BYTES
+
+        self._file = self.path.open("wb")
+        self._pending = []
+        self._pending_rows = 0
+        self._page_rows = 0
+        self._page = 0
+        self._strip_offsets = []
+        self._strip_byte_counts = []
+
+        if self.bigtiff:
+            self._file.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+            self._next_ifd_pointer = 8
+        else:
+            self._file.write(b"II" + struct.pack("<HI", 42, 0))
+            self._next_ifd_pointer = 4
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """
+        Append rows to the image.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            A uint8 array of shape (n_rows, width, samples), or (n_rows, width) for grayscale images.
+
+        Raises
+        ------
+        ValueError
+            If the rows do not have the shape of the image, or if more rows than the image height are written.
+        """
+        grayscale_rows = self.samples == 1 and rows.shape[1:] == (self.width,)
+        if rows.shape[1:] != (self.width, self.samples) and not grayscale_rows:
+            msg = f"Expected rows of shape (n, {self.width}, {self.samples}), got {rows.shape}"
+            raise ValueError(msg)
+
+        start = 0
+        while start < len(rows):
+            if self._page >= self.pages:
+                msg = f"All the {self.pages} pages of {self.path} have already been written."
+                raise ValueError(msg)
+            strip_rows = min(self.height - self._page_rows, self.rows_per_strip)
+            taken = min(strip_rows - self._pending_rows, len(rows) - start)
+            self._pending.append(rows[start : start + taken].tobytes())
+            self._pending_rows += taken
+            start += taken
+            if self._pending_rows == strip_rows:
+                self._flush_strip()
+
+    def close(self) -> None:
+        """
+        Finish the file.
+
+        Raises
+        ------
+        ValueError
+            If fewer rows than expected were written.
+        """
+        if self._file.closed:
+            return
+        self._file.close()
+        if self._page < self.pages:
+            msg = f"{self.path} is incomplete: {self._page}/{self.pages} pages written."
+            raise ValueError(msg)
+
+    def _flush_strip(self) -> None:
+        """Write the current strip, and the page directory if the page is complete."""
+        data = b"".join(self._pending)
+        self._strip_offsets.append(self._file.tell())
+        self._strip_byte_counts.append(len(data))
+        self._file.write(data)
+        self._page_rows += self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+
+        if self._page_rows == self.height:
+            self._write_ifd()
+            self._page += 1
+            self._page_rows = 0
+            self._strip_offsets = []
+            self._strip_byte_counts = []
+
+    def _write_ifd(self) -> None:
+        """Write the directory of the current page and link it from the previous one."""
+        offset_type = LONG8 if self.bigtiff else LONG
+        entries = [
+            (IMAGE_WIDTH, LONG, [self.width]),
+            (IMAGE_LENGTH, LONG, [self.height]),
+            (BITS_PER_SAMPLE, SHORT, [8] * self.samples),
+            (COMPRESSION, SHORT, [1]),
+            (PHOTOMETRIC, SHORT, [2 if self.samples == 3 else 1]),
+            (STRIP_OFFSETS, offset_type, self._strip_offsets),
+            (SAMPLES_PER_PIXEL, SHORT, [self.samples]),
+            (ROWS_PER_STRIP, LONG, [self.rows_per_strip]),
+            (STRIP_BYTE_COUNTS, offset_type, self._strip_byte_counts),
+            (PLANAR_CONFIGURATION, SHORT, [1]),
+        ]
+        count_format, offset_format, inline_size = ("Q", "Q", 8) if self.bigtiff else ("I", "I", 4)
+
+        # Values which do not fit in a directory entry are written before the directory
+        entry_bytes = []
+        for tag, field_type, values in entries:
+            data = struct.pack(f"<{len(values)}{TYPE_FORMATS[field_type]}", *values)
+            if len(data) <= inline_size:
+                value = data.ljust(inline_size, b"\0")
+            else:
+                if self._file.tell() % 2:
+                    self._file.write(b"\0")
+                value = struct.pack(f"<{offset_format}", self._file.tell())
+                self._file.write(data)
+            entry_bytes.append(struct.pack(f"<HH{count_format}", tag, field_type, len(values)) + value)
+
+        if self._file.tell() % 2:
+            self._file.write(b"\0")
+        ifd_offset = self._file.tell()
+        self._file.write(struct.pack("<Q" if self.bigtiff else "<H", len(entries)))
+        self._file.write(b"".join(entry_bytes))
+        next_ifd_pointer = self._file.tell()
+        self._file.write(b"\0" * inline_size)
+
+        # Link the new directory from the header or from the previous directory
+        self._file.seek(self._next_ifd_pointer)
+        self._file.write(struct.pack(f"<{offset_format}", ifd_offset))
+        self._file.seek(0, 2)
+        self._next_ifd_pointer = next_ifd_pointer
+
+    def __enter__(self) -> StripedTiffWriter:  # noqa: PYI034
+        """Return the writer when entering the context."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Finish the file when leaving the context, or only close it if an exception was raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
@@ -0,0 +1,423 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Process images too large for a single Ilastik process as overlapping tiles.
+
+Each oversized image is cut into tiles, extended on each side by a halo at least as wide as the largest filter of the
+project, so that the features, and therefore the predictions, of the pixels at the center of a tile are the same as
+in the whole image. The tiles are processed by Ilastik like any other images, shared between the workers, then their
+halos are cropped and their centers are stitched into the output of the image. The output is written band of tiles
+by band of tiles (or tile by tile for HDF5 files), so that the full resolution output is never held in memory.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.autotune import read_image_header
+from easilastik.errors import BatchError
+from easilastik.metrics import measure
+from easilastik.utils import get_output_path
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    import numpy as np
+
+    from easilastik.metrics import RunMetrics
+    from easilastik.session import IlastikSession
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# The filters of Ilastik are truncated at 3.5 sigma, and the structure tensor smooths its result with half its scale
+FILTER_RADIUS = 3.5
+OUTER_SCALE = 0.5
+
+# Largest scale offered by Ilastik, assumed when the project cannot be read
+DEFAULT_MAX_SCALE = 10.0
+
+# Output formats which can be stitched
+TILED_FORMATS = ("png", "tif", "tiff", "hdf5", "compressed hdf5")
+
+TILES_DIR_PREFIX = ".easilastik-tiles-"
+
+# Largest number of pixels OpenCV decodes, unless OPENCV_IO_MAX_IMAGE_PIXELS is set before it is imported
+OPENCV_MAX_PIXELS = 2**30
+
+
+def get_halo(model_path: str) -> int:
+    """
+    Return the width of the halo needed around the tiles for the features of a project.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to the Ilastik project file.
+
+    Returns
+    -------
+    int
+        The radius in pixels of the largest filter selected in the project, or of the largest filter offered by
+        Ilastik if the project cannot be read.
+    """
+    max_scale = DEFAULT_MAX_SCALE
+    try:
+        import h5py  # noqa: PLC0415
+        import numpy as np  # noqa: PLC0415
+
+        with h5py.File(model_path, "r") as f:
+            scales = np.asarray(f["FeatureSelections/Scales"][()], dtype=float)
+            selected = np.asarray(f["FeatureSelections/SelectionMatrix"][()], dtype=bool).any(axis=0)
+            if selected.any():
+                max_scale = float(scales[selected].max())
+    except (OSError, KeyError, ValueError, IndexError):
+        logger.debug("Could not read the scales of the project %s, assuming %s.", model_path, DEFAULT_MAX_SCALE)
+    return math.ceil(max_scale * FILTER_RADIUS * (1 + OUTER_SCALE))
+
+
+def is_oversized(image_path: str, tile_size: int) -> bool:
+    """Return whether an image is higher or wider than tile_size, according to its header."""
+    shape = read_image_header(str(image_path))
+    return shape is not None and max(shape[:2]) > tile_size
+
+
+def get_tiles(height: int, width: int, tile_size: int, halo: int) -> list:
+    """
+    Cut an image into tiles.
+
+    Parameters
+    ----------
+    height : int
+        The height of the image.
+    width : int
+        The width of the image.
+    tile_size : int
+        The side of the center of the tiles, the last ones of each row and column being smaller.
+    halo : int
+        The number of pixels added on each side of the center of a tile, within the image.
+
+    Returns
+    -------
+    list
+        The rows of tiles, each one being a list of tuples ((y0, y1, x0, x1), (ty0, ty1, tx0, tx1)): the bounds
+        of the center of the tile and of the tile with its halo, in the image.
+    """
+    rows = []
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        row = []
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            bounds = (max(0, y0 - halo), min(height, y1 + halo), max(0, x0 - halo), min(width, x1 + halo))
+            row.append(((y0, y1, x0, x1), bounds))
+        rows.append(row)
+    return rows
+
+
+def write_tiles(image_path: str, tile_size: int, halo: int, tile_dir: str) -> tuple[tuple, list, list]:
+    """
+    Cut an image into tiles written as PNG files.
+
+    Parameters
+    ----------
+    image_path : str
+        The path of the image.
+    tile_size : int
+        The side of the center of the tiles.
+    halo : int
+        The width of the halo of the tiles.
+    tile_dir : str
+        The folder where the tiles are written.
+
+    Returns
+    -------
+    tuple[tuple, list, list]
+        The height and width of the image, its tiles (see `get_tiles`) and the paths of the tiles, row by row.
+
+    Raises
+    ------
+    ValueError
+        If the image cannot be read, e.g. because it has more pixels than OpenCV decodes.
+    """
+    import cv2  # noqa: PLC0415
+
+    try:
+        image = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
+    except cv2.error:
+        # Depending on the version, OpenCV raises an error or returns None for images above its pixel limit
+        image = None
+    if image is None:
+        max_pixels = int(os.environ.get("OPENCV_IO_MAX_IMAGE_PIXELS", OPENCV_MAX_PIXELS))
+        if (shape := read_image_header(image_path)) is not None and shape[0] * shape[1] > max_pixels:
+            msg = (
+                f"Could not read {image_path}: its {shape[0]} x {shape[1]} pixels exceed the {max_pixels} pixels "
+                "OpenCV decodes. Set the OPENCV_IO_MAX_IMAGE_PIXELS environment variable to a larger value before "
+                "starting Python to tile it."
+            )
+            raise ValueError(msg)
+        msg = f"Could not read {image_path}"
+        raise ValueError(msg)
+
+    height, width = image.shape[:2]
+    tiles = get_tiles(height, width, tile_size, halo)
+    tile_paths = []
+    for row, tile_row in enumerate(tiles):
+        for column, (_, (ty0, ty1, tx0, tx1)) in enumerate(tile_row):
+            # The tiles are only read once by Ilastik, they are barely compressed
+            tile_path = Path(tile_dir) / f"{Path(image_path).stem}_{row:04d}_{column:04d}.png"
+            if not cv2.imwrite(str(tile_path), image[ty0:ty1, tx0:tx1], [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+                msg = f"Could not write {tile_path}"
+                raise OSError(msg)
+            tile_paths.append(str(tile_path))
+    return (height, width), tiles, tile_paths
+
+
+def read_tile_output(output_path: str, output_format: str) -> np.ndarray:
+    """
+    Read the output of a tile.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output.
+    output_format : str
+        The format of the output.
+
+    Returns
+    -------
+    np.ndarray
+        The output, with axes (y, x, channels) and its colors in RGB order.
+
+    Raises
+    ------
+    ValueError
+        If the output cannot be read.
+    """
+    if output_format in {"hdf5", "compressed hdf5"}:
+        import h5py  # noqa: PLC0415
+
+        with h5py.File(output_path, "r") as f:
+            return f["exported_data"][()]
+
+    import cv2  # noqa: PLC0415
+
+    output = cv2.imread(output_path, cv2.IMREAD_UNCHANGED)
+    if output is None:
+        msg = f"Could not read {output_path}"
+        raise ValueError(msg)
+    if output.ndim == 2:
+        return output[..., None]
+    # OpenCV reads the colors in BGR order
+    return cv2.cvtColor(output, cv2.COLOR_BGR2RGB if output.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+
+
+def stitch_tiles(
+    tiles: list,
+    tile_outputs: list,
+    output_path: str,
+    output_format: str,
+    shape: tuple,
+) -> None:
+    """
+    Crop the halos of the outputs of the tiles and write their centers into a single output.
+
+    Parameters
+    ----------
+    tiles : list
+        The tiles, as returned by `get_tiles`.
+    tile_outputs : list
+        The paths of the outputs of the tiles, row by row.
+    output_path : str
+        The path of the output of the image.
+    output_format : str
+        The format of the output, one of `TILED_FORMATS`.
+    shape : tuple
+        The height and width of the image.
+
+    Raises
+    ------
+    ValueError
+        If an output cannot be read, or if the outputs of a 'tif' or 'tiff' format are not 8-bit images with 1
+        or 3 channels.
+    """
+    import numpy as np  # noqa: PLC0415
+
+    _, width = shape
+    outputs = iter(tile_outputs)
+    hdf5 = output_format in {"hdf5", "compressed hdf5"}
+    writer = None
+    with contextlib.ExitStack() as stack:
+        for tile_row in tiles:
+            band = None
+            band_y0, band_y1 = tile_row[0][0][:2]
+            for (y0, y1, x0, x1), (ty0, _, tx0, _) in tile_row:
+                center = read_tile_output(next(outputs), output_format)[y0 - ty0 : y1 - ty0, x0 - tx0 : x1 - tx0]
+                if writer is None:
+                    # The writer is opened once the type of the outputs is known
+                    writer = stack.enter_context(open_writer(output_path, output_format, shape, center))
+                if hdf5:
+                    # HDF5 datasets are written tile by tile
+                    writer["exported_data"][y0:y1, x0:x1] = center
+                    continue
+                if band is None:
+                    band = np.empty((band_y1 - band_y0, width, center.shape[-1]), dtype=center.dtype)
+                band[:, x0:x1] = center
+            if band is not None:
+                writer.write_rows(band)
+
+
+def open_writer(output_path: str, output_format: str, shape: tuple, center: np.ndarray) -> object:
+    """
+    Open the output of a tiled image for writing.
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the output.
+    output_format : str
+        The format of the output, one of `TILED_FORMATS`.
+    shape : tuple
+        The height and width of the image.
+    center : np.ndarray
+        The center of the first tile, with the number of channels and the data type of the output.
+
+    Returns
+    -------
+    object
+        An h5py.File with an empty 'exported_data' dataset for HDF5 formats, else a `StripedPngWriter` or a
+        `StripedTiffWriter`. It is a context manager.
+
+    Raises
+    ------
+    ValueError
+        If the output is a TIFF file and center is not an 8-bit image with 1 or 3 channels.
+    """
+    import numpy as np  # noqa: PLC0415
+
+    height, width = shape
+    channels, dtype = center.shape[-1], center.dtype
+    if output_format in {"hdf5", "compressed hdf5"}:
+        import h5py  # noqa: PLC0415
+
+        f = h5py.File(output_path, "w")
+        compression = "gzip" if output_format == "compressed hdf5" else None  # noqa: PLR2004
+        f.create_dataset("exported_data", shape=(height, width, channels), dtype=dtype, compression=compression)
+        return f
+    if output_format == "png":  # noqa: PLR2004
+        from easilastik.encoder import StripedPngWriter  # noqa: PLC0415
+
+        return StripedPngWriter(output_path, width, height, channels=channels, dtype=dtype)
+    if dtype != np.uint8 or channels not in {1, 3}:
+        msg = f"Only 8-bit outputs with 1 or 3 channels can be stitched as TIFF, got {center.shape} of {dtype}"
+        raise ValueError(msg)
+
+    from easilastik.tiff_writer import StripedTiffWriter  # noqa: PLC0415
+
+    return StripedTiffWriter(output_path, width, height, samples=channels)
+
+
+def run_tiled(  # noqa: PLR0913
+    image_paths: list,
+    model_path: str,
+    result_base_path: str,
+    ilastik_script_path: str | None,
+    export_source: str,
+    output_format: str,
+    *,
+    tile_size: int,
+    halo: int | None = None,
+    session: IlastikSession | None = None,
+    workers: int | str = 1,
+    threads_per_worker: int | None = None,
+    ram_per_worker_mb: int | None = None,
+    on_output: Callable[[str], object] | None = None,
+    metrics: RunMetrics | None = None,
+) -> None:
+    """
+    Process images as tiles and stitch the outputs of the tiles.
+
+    The tiles of each image are written in a temporary folder of result_base_path, processed by `process_images`
+    (shared between the workers), then stitched into the output of the image and deleted.
+
+    Parameters
+    ----------
+    image_paths : list
+        The paths of the images.
+    model_path : str
+        The path to the Ilastik project file.
+    result_base_path : str
+        The base path where the results are saved.
+    ilastik_script_path : str | None
+        The path to the Ilastik script, None with a session.
+    export_source : str
+        The type of data to export.
+    output_format : str
+        The format of the output files, one of `TILED_FORMATS`.
+    tile_size : int
+        The side of the center of the tiles.
+    halo : int, optional
+        The width of the halo of the tiles. Default is the radius of the largest filter of the project (see
+        `get_halo`).
+    session, workers, threads_per_worker, ram_per_worker_mb, metrics
+        See `process_images`.
+    on_output : Callable[[str], object], optional
+        Called with the path of the output of each image once it is stitched.
+
+    Raises
+    ------
+    BatchError
+        If some images could not be processed, once the other ones are done. The `errors` attribute maps each
+        failed image to its error.
+    """
+    from easilastik.run_ilastik import process_images  # noqa: PLC0415
+
+    halo = get_halo(model_path) if halo is None else halo
+    errors = {}
+    for image_path in image_paths:
+        output_path = get_output_path(result_base_path, image_path, export_source, output_format)
+        try:
+            with tempfile.TemporaryDirectory(prefix=TILES_DIR_PREFIX, dir=result_base_path) as tile_dir:
+                with measure(metrics, "tiling", str(image_path)):
+                    shape, tiles, tile_paths = write_tiles(image_path, tile_size, halo, tile_dir)
+                logger.info("Processing %s as %d tiles with a halo of %d pixels.", image_path, len(tile_paths), halo)
+
+                tile_result_path = str(Path(tile_dir) / "results") + os.sep
+                Path(tile_result_path).mkdir()
+                process_images(
+                    tile_paths,
+                    model_path,
+                    tile_result_path,
+                    ilastik_script_path,
+                    export_source,
+                    output_format,
+                    session=session,
+                    workers=workers,
+                    threads_per_worker=threads_per_worker,
+                    ram_per_worker_mb=ram_per_worker_mb,
+                    metrics=metrics,
+                )
+                tile_outputs = [
+                    get_output_path(tile_result_path, path, export_source, output_format) for path in tile_paths
+                ]
+                with measure(metrics, "stitching", str(image_path)):
+                    stitch_tiles(tiles, tile_outputs, output_path, output_format, shape)
+        except Exception as error:  # noqa: BLE001
+            logger.error("Error during the tiled conversion of %s: %s", image_path, error)  # noqa: TRY400
+            errors[str(image_path)] = error
+            # Do not leave a partial output, which could be taken for a complete one
+            Path(output_path).unlink(missing_ok=True)
+            continue
+        if on_output is not None:
+            on_output(output_path)
+
+    if errors:
+        msg = f"Error during the tiled conversion of {len(errors)}/{len(image_paths)} images. See console output."
+        raise BatchError(msg, errors)
@@ -1,17 +1,77 @@
 # Copyright (C) 2026 Titouan Le Gourrierec
 """Utility functions for EasIlastik package."""
 
+from __future__ import annotations
+
+import logging
+import os
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.discovery import IMAGE_EXTENSIONS, get_images, iter_images
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
 
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
 
-def get_image_paths(image_folder: str) -> list:
+# Extension added by Ilastik to the output filename format, for the formats written as a single file per image
+OUTPUT_EXTENSIONS = {
+    "bmp": ".bmp",
+    "gif": ".gif",
+    "hdr": ".hdr",
+    "jpeg": ".jpeg",
+    "jpg": ".jpg",
+    "pbm": ".pbm",
+    "pgm": ".pgm",
+    "png": ".png",
+    "pnm": ".pnm",
+    "ppm": ".ppm",
+    "ras": ".ras",
+    "tif": ".tif",
+    "tiff": ".tiff",
+    "xv": ".xv",
+    "multipage tiff": ".tiff",
+    "hdf5": ".h5",
+    "compressed hdf5": ".h5",
+}
+
+# Maximum length of a command line on Windows, and room left for what the Ilastik launcher adds to it
+WINDOWS_MAX_COMMAND_LENGTH = 32767
+COMMAND_LENGTH_MARGIN = 4096
+
+
+def get_image_paths(
+    image_folder: str,
+    *,
+    extensions: Iterable[str] | None = IMAGE_EXTENSIONS,
+    recursive: bool = False,
+    ignore: Iterable[str] = (),
+    index_path: str | None = None,
+    order: str | None = None,
+) -> list:
     """
     Get a list of image file paths from the specified folder.
 
+    Hidden files, subfolders and files whose extension is not in extensions (by default, HDF5 files) are skipped.
+
     Parameters
     ----------
     image_folder : str
         The path to the folder containing the images.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files to keep. Default is the image formats read by Ilastik, see `iter_images`.
+    recursive : bool, optional
+        Whether to list the images of the subfolders as well. Default is False.
+    ignore : Iterable[str], optional
+        Glob patterns of the files and folders to skip.
+    index_path : str, optional
+        The path of an index of the folders, to list only the folders which changed since the previous call.
+    order : str, optional
+        "name" to sort the paths, or "size" to put the largest images first. Default is the order of the folders.
 
     Returns
     -------
@@ -19,4 +79,175 @@ def get_image_paths(image_folder: str) -> list:
         A list of paths to the image
 
     """
-    return list(Path(image_folder).glob("*"))
+    return get_images(
+        image_folder, extensions=extensions, recursive=recursive, ignore=ignore, index_path=index_path, order=order
+    )
+
+
+def get_input_paths(input_path: str, extensions: Iterable[str] | None = IMAGE_EXTENSIONS) -> list:
+    """
+    Get the list of images to process from an image file or folder.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the folder to process, see `iter_images`. Default is the image formats read
+        by Ilastik as a single 2D image (`IMAGE_EXTENSIONS`).
+
+    Returns
+    -------
+    list
+        The paths of the images in the folder, or a list holding only input_path if it is a file.
+    """
+    if not Path(input_path).is_dir():
+        return [input_path]
+    image_paths = get_image_paths(input_path, extensions=extensions)
+    if not image_paths:
+        warn_no_images(input_path, extensions)
+    return image_paths
+
+
+def iter_input_paths(input_path: str, extensions: Iterable[str] | None = IMAGE_EXTENSIONS) -> Iterator[str]:
+    """
+    Iterate over the images to process from an image file or folder, without listing the whole folder at once.
+
+    Parameters
+    ----------
+    input_path : str
+        The path to the image file or folder to be processed.
+    extensions : Iterable[str] | None, optional
+        The extensions of the files of the folder to process, see `get_input_paths`.
+
+    Yields
+    ------
+    str
+        The paths of the images of the folder (see `get_image_paths`), or only input_path if it is a file.
+    """
+    if not Path(input_path).is_dir():
+        yield input_path
+        return
+    found = False
+    for path, _, _ in iter_images(input_path, extensions=extensions):
+        found = True
+        yield path
+    if not found:
+        warn_no_images(input_path, extensions)
+
+
+def warn_no_images(folder: str, extensions: Iterable[str] | None) -> None:
+    """Log a warning if a folder without images holds files whose extension was filtered out."""
+    if extensions is None:
+        return
+    with os.scandir(folder) as entries:
+        skipped = next((entry.name for entry in entries if not entry.name.startswith(".") and entry.is_file()), None)
+    if skipped is not None:
+        logger.warning(
+            "No images found in %s: its files (e.g. %s) have none of the extensions %s. Pass their extension in "
+            "extensions to process these files.",
+            folder,
+            skipped,
+            sorted(extensions),
+        )
+
+
+def get_output_filename_format(result_base_path: str, export_source: str) -> str:
+    """
+    Build the value of Ilastik's `--output_filename_format` argument.
+
+    Parameters
+    ----------
+    result_base_path : str
+        The base path where the results will be saved.
+    export_source : str
+        The type of data to export (e.g. "Simple Segmentation").
+
+    Returns
+    -------
+    str
+        The output filename format, where `{nickname}` is replaced by Ilastik with the name of each input image.
+    """
+    return result_base_path + "{nickname}_" + export_source.replace(" ", "_")
+
+
+def get_output_path(result_base_path: str, input_path: str, export_source: str, output_format: str) -> str | None:
+    """
+    Return the path of the file written by Ilastik for an input image.
+
+    Parameters
+    ----------
+    result_base_path : str
+        The base path where the results are saved.
+    input_path : str
+        The path of the input image.
+    export_source : str
+        The type of data exported (e.g. "Simple Segmentation").
+    output_format : str
+        The format of the output files.
+
+    Returns
+    -------
+    str | None
+        The path of the output file, or None if the format is written as several files (e.g. "png sequence").
+    """
+    extension = OUTPUT_EXTENSIONS.get(output_format)
+    if extension is None:
+        return None
+    nickname = Path(input_path).stem
+    return get_output_filename_format(result_base_path, export_source).replace("{nickname}", nickname) + extension
+
+
+def get_max_command_length() -> int:
+    """
+    Return the maximum size of the arguments of a new process.
+
+    Returns
+    -------
+    int
+        The size in bytes available for the arguments: ARG_MAX minus the size of the environment (which shares the
+        same space) and a safety margin, or the command line limit on Windows.
+    """
+    if os.name == "nt":  # noqa: PLR2004
+        return WINDOWS_MAX_COMMAND_LENGTH - COMMAND_LENGTH_MARGIN
+    try:
+        arg_max = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        arg_max = 2**17
+    # Each string is stored with its terminating null byte and a pointer to it
+    env_size = sum(len(os.fsencode(key)) + len(os.fsencode(value)) + 2 + 8 for key, value in os.environ.items())
+    return max(COMMAND_LENGTH_MARGIN, arg_max - env_size - COMMAND_LENGTH_MARGIN)
+
+
+def split_command_line(args: list, paths: list, max_length: int | None = None) -> Iterator[list]:
+    """
+    Split a list of files between several command lines short enough to be executed.
+
+    Parameters
+    ----------
+    args : list
+        The command line without the files.
+    paths : list
+        The paths of the files to append to the command line.
+    max_length : int, optional
+        The maximum size in bytes of a command line. Default is `get_max_command_length()`.
+
+    Yields
+    ------
+    list
+        Consecutive groups of paths, as many as possible in each one. Everything is yielded as a single group when
+        it fits in one command line.
+    """
+    if max_length is None:
+        max_length = get_max_command_length()
+    base_length = sum(len(os.fsencode(str(arg))) + 1 + 8 for arg in args)
+    batch, length = [], base_length
+    for path in paths:
+        path_length = len(os.fsencode(str(path))) + 1 + 8
+        if batch and length + path_length > max_length:
+            yield batch
+            batch, length = [], base_length
+        batch.append(path)
+        length += path_length
+    if batch:
+        yield batch
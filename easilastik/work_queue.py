@@ -0,0 +1,625 @@
+# Copyright (C) 2026 Titouan Le Gourrierec
+"""
+Share the processing of images between several machines through a folder of job files.
+
+A coordinator enqueues the images, in batches, as job files in a queue folder on a filesystem shared by all the
+machines (e.g. NFS). Workers, started on any machine with `python -m easilastik.work_queue QUEUE_DIR` (or the
+`easilastik-worker` command), claim the jobs one at a time, run Ilastik and the thresholding, and record the outcome.
+No broker is needed: each state of a job is a subfolder of the queue folder, and a job changes state by an atomic
+rename, so that a job is claimed by a single worker.
+
+- pending/: the jobs waiting for a worker.
+- leased/: the jobs being processed, named after the worker holding them. The worker renews its lease by updating
+  the modification time of the file; a lease not renewed for `lease_seconds` (e.g. because the worker or its machine
+  died) is put back in pending/, at most `max_attempts` times.
+- done/ and failed/: the finished jobs, the failed ones with their error.
+
+The clocks of the machines must be synchronized (e.g. by NTP), the expiry of the leases being computed from the
+modification time of the files.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from easilastik.errors import BatchError
+from easilastik.find_ilastik import find_ilastik
+from easilastik.parallel import collect_errors
+from easilastik.run_ilastik import check_arguments, get_probability_processor, process_images
+from easilastik.stream import iter_batches
+from easilastik.utils import get_input_paths
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+CONFIG_NAME = "queue.json"
+STATES = ("pending", "leased", "done", "failed")
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5.0
+
+
+def get_worker_id() -> str:
+    """
+    Return an identifier of the current process, unique among the machines sharing a queue.
+
+    Returns
+    -------
+    str
+        The host name and the process ID, usable in a file name.
+    """
+    return re.sub(r"[^\w.-]", "_", f"{socket.gethostname()}-{os.getpid()}")
+
+
+def write_json(path: Path, data: dict) -> None:
+    """Write a JSON file atomically, so that it is never read half written."""
+    tmp_path = path.with_name(f".{path.name}.{get_worker_id()}.tmp")
+    tmp_path.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+    tmp_path.replace(path)
+
+
+class Lease:
+    """
+    A job claimed by a worker.
+
+    Parameters
+    ----------
+    queue : WorkQueue
+        The queue of the job.
+    path : Path
+        The path of the job file in leased/.
+    job : dict
+        The job, as written by `WorkQueue.enqueue`.
+    """
+
+    def __init__(self, queue: WorkQueue, path: Path, job: dict) -> None:
+        self.queue = queue
+        self.path = path
+        self.job = job
+        self.lost = False
+
+    def renew(self) -> bool:
+        """
+        Extend the lease by `lease_seconds`.
+
+        Returns
+        -------
+        bool
+            False if the lease expired and the job was put back in the queue, in which case the worker should stop
+            processing it.
+        """
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            self.lost = True
+        return not self.lost
+
+    @contextlib.contextmanager
+    def keep_alive(self) -> Iterator[Lease]:
+        """Renew the lease in a background thread while the job is processed."""
+        stop = threading.Event()
+
+        def renew_periodically() -> None:
+            while not stop.wait(self.queue.lease_seconds / 3):
+                if not self.renew():
+                    logger.warning("The lease of job %s expired while it was processed.", self.job["id"])
+                    return
+
+        thread = threading.Thread(target=renew_periodically, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self) -> bool:
+        """
+        Move the job to done/.
+
+        Returns
+        -------
+        bool
+            False if the lease was lost, the job being then processed again by another worker.
+        """
+        return self._finish("done")
+
+    def fail(self, error: BaseException) -> bool:
+        """
+        Move the job to failed/ with its error.
+
+        Parameters
+        ----------
+        error : BaseException
+            The error raised while processing the job.
+
+        Returns
+        -------
+        bool
+            False if the lease was lost, the job being then processed again by another worker.
+        """
+        return self._finish("failed", error=f"{type(error).__name__}: {error}", worker=self.path.stem.split("@")[1])
+
+    def release(self) -> bool:
+        """
+        Put the job back in pending/, e.g. when the worker is stopped before finishing it.
+
+        Returns
+        -------
+        bool
+            False if the lease was already lost.
+        """
+        return self._finish("pending")
+
+    def _finish(self, state: str, **fields: object) -> bool:
+        """Move the job file to a state, the rename failing if the lease was lost."""
+        new_path = self.queue.get_path(state, self.job["id"])
+        try:
+            self.path.replace(new_path)
+        except FileNotFoundError:
+            self.lost = True
+            logger.warning("The lease of job %s was lost, another worker processes it again.", self.job["id"])
+            return False
+        if fields:
+            write_json(new_path, {**self.job, **fields})
+        return True
+
+
+class WorkQueue:
+    """
+    A queue of jobs stored as files in a folder shared by the workers.
+
+    Parameters
+    ----------
+    queue_dir : str
+        The folder of the queue, created if needed.
+    lease_seconds : float, optional
+        The number of seconds after which a job whose lease was not renewed is put back in the queue. Default is
+        300. Like max_attempts, it is saved in the queue folder by the first process opening it, and the other
+        processes use the saved value.
+    max_attempts : int, optional
+        The number of expired leases after which a job is moved to failed/ instead of being put back in the queue.
+        Default is 3.
+    """
+
+    def __init__(
+        self,
+        queue_dir: str,
+        *,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ) -> None:
+        self.queue_dir = Path(queue_dir)
+        for state in STATES:
+            (self.queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+        config_path = self.queue_dir / CONFIG_NAME
+        if not config_path.exists():
+            write_json(config_path, {"lease_seconds": lease_seconds, "max_attempts": max_attempts})
+        config = json.loads(config_path.read_text(encoding="utf-8"))
+        self.lease_seconds = config["lease_seconds"]
+        self.max_attempts = config["max_attempts"]
+
+    def get_path(self, state: str, job_id: str, worker_id: str | None = None) -> Path:
+        """
+        Return the path of a job file.
+
+        Parameters
+        ----------
+        state : str
+            The state of the job, one of STATES.
+        job_id : str
+            The identifier of the job.
+        worker_id : str, optional
+            The worker holding the job, for leased jobs.
+
+        Returns
+        -------
+        Path
+            The path of the job file.
+        """
+        name = job_id if worker_id is None else f"{job_id}@{worker_id}"
+        return self.queue_dir / state / f"{name}.json"
+
+    def list_jobs(self, state: str) -> list:
+        """
+        List the job files of a state.
+
+        Parameters
+        ----------
+        state : str
+            The state of the jobs, one of STATES.
+
+        Returns
+        -------
+        list
+            The paths of the job files, sorted by name, i.e. in the order of their enqueueing.
+        """
+        return sorted(self.queue_dir.joinpath(state).glob("*.json"))
+
+    def status(self) -> dict:
+        """
+        Count the jobs of each state.
+
+        Returns
+        -------
+        dict
+            The number of jobs of each state.
+        """
+        return {state: len(self.list_jobs(state)) for state in STATES}
+
+    def enqueue(  # noqa: PLR0913
+        self,
+        input_path: str,
+        model_path: str,
+        result_base_path: str,
+        export_source: str = "Simple Segmentation",
+        output_format: str = "png",
+        *,
+        batch_size: int = 1,
+        threshold: float | None = None,
+        below_threshold_color: list | None = None,
+        channel_colors: list | None = None,
+        deletion: bool = True,
+        max_memory_mb: float | None = None,
+        threshold_workers: int = 1,
+    ) -> list:
+        """
+        Add the images of a file or folder to the queue.
+
+        All the paths must be valid on the machines of the workers, they are saved as absolute paths.
+
+        Parameters
+        ----------
+        input_path : str
+            The path to the image file or folder to be processed.
+        model_path : str
+            The path to the Ilastik project file.
+        result_base_path : str
+            The base path where the results are saved.
+        export_source : str, optional
+            The type of data to export, see `run_ilastik`. Ignored if threshold is provided.
+        output_format : str, optional
+            The format of the output files, see `run_ilastik`. Ignored if threshold is provided.
+        batch_size : int, optional
+            The number of images of each job, processed by a single Ilastik process. Default is 1. Larger batches
+            save the loading of the project for each image, smaller ones balance the work better between workers.
+        threshold : float, optional
+            If provided, the probabilities are exported and colored like `run_ilastik_probabilities` does, with
+            below_threshold_color, channel_colors, deletion, max_memory_mb and threshold_workers.
+        below_threshold_color : list, optional
+            The color for pixels where the maximum value is below the threshold.
+        channel_colors : list, optional
+            The colors for the channels.
+        deletion : bool, optional
+            Whether to delete each probability file once colored. Default is True.
+        max_memory_mb : float, optional
+            The memory budget of the coloring, see `process_single_file`. Default is None.
+        threshold_workers : int, optional
+            The number of probability files colored concurrently by a worker. Default is 1.
+
+        Returns
+        -------
+        list
+            The identifiers of the new jobs.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the input_path does not exist.
+        ValueError
+            If batch_size is less than 1, or if the export_source, the output_format or the colors are not valid.
+        """
+        if batch_size < 1:
+            msg = f"batch_size must be a positive integer, got {batch_size}"
+            raise ValueError(msg)
+        if threshold is not None:
+            export_source, output_format = "Probabilities", "hdf5"
+            # Check the colors now rather than on every worker
+            get_probability_processor(threshold, below_threshold_color, channel_colors)
+        check_arguments(input_path, export_source, output_format)
+
+        settings = {
+            "model_path": str(Path(model_path).resolve()),
+            "result_base_path": str(Path(result_base_path).resolve()) + os.sep,
+            "export_source": export_source,
+            "output_format": output_format,
+        }
+        if threshold is not None:
+            settings.update(
+                {
+                    "threshold": threshold,
+                    "below_threshold_color": below_threshold_color,
+                    "channel_colors": channel_colors,
+                    "deletion": deletion,
+                    "max_memory_mb": max_memory_mb,
+                    "threshold_workers": threshold_workers,
+                }
+            )
+
+        # Job identifiers sort in the order of their enqueueing, also between calls
+        prefix = f"{time.time_ns():020d}-{get_worker_id()}"
+        image_paths = (str(Path(path).resolve()) for path in get_input_paths(input_path))
+        job_ids = []
+        for index, batch in enumerate(iter_batches(image_paths, batch_size)):
+            job_id = f"{prefix}-{index:06d}"
+            write_json(self.get_path("pending", job_id), {"id": job_id, "inputs": batch, "attempts": 0, **settings})
+            job_ids.append(job_id)
+        logger.info("Enqueued %d jobs in %s.", len(job_ids), self.queue_dir)
+        return job_ids
+
+    def claim(self, worker_id: str) -> Lease | None:
+        """
+        Take the oldest pending job.
+
+        Parameters
+        ----------
+        worker_id : str
+            The identifier of the worker, see `get_worker_id`.
+
+        Returns
+        -------
+        Lease | None
+            The lease of the job, or None if no job is pending.
+        """
+        for pending_path in self.list_jobs("pending"):
+            job_id = pending_path.stem
+            leased_path = self.get_path("leased", job_id, worker_id)
+            try:
+                # The lease starts now, not when the job was enqueued
+                os.utime(pending_path)
+                # Only one of the workers trying to claim the same job succeeds
+                pending_path.replace(leased_path)
+            except FileNotFoundError:
+                continue
+            return Lease(self, leased_path, json.loads(leased_path.read_text(encoding="utf-8")))
+        return None
+
+    def requeue_expired(self) -> int:
+        """
+        Put back in the queue the jobs whose lease expired, or move them to failed/ after max_attempts.
+
+        The jobs left half-requeued in pending/ by a process which died while requeuing them are recovered the same
+        way once they are older than `lease_seconds`.
+
+        Returns
+        -------
+        int
+            The number of expired leases.
+        """
+        now = time.time()
+        expired = 0
+        # Jobs being requeued by a process which died before finishing, recovered like expired leases
+        stale = [
+            (path, path.name[1:].split("@", 1)[0], "a process which died while requeuing it")
+            for path in self.queue_dir.joinpath("pending").glob(".*@*.requeue")
+        ]
+        leased = [(path, *path.stem.split("@", 1)) for path in self.list_jobs("leased")]
+        for path, job_id, worker_id in leased + stale:
+            try:
+                if now - path.stat().st_mtime < self.lease_seconds:
+                    continue
+                # Take the job from its worker first, so that a single process requeues it
+                tmp_path = self.queue_dir / "pending" / f".{job_id}@{get_worker_id()}.requeue"
+                path.replace(tmp_path)
+                # A recent file is not taken for one left by a process which died while requeuing it
+                os.utime(tmp_path)
+                job = json.loads(tmp_path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                continue  # Renewed, finished or requeued by another process in the meantime
+
+            job["attempts"] += 1
+            expired += 1
+            if job["attempts"] >= self.max_attempts:
+                logger.error("Job %s failed: its lease expired %d times.", job_id, job["attempts"])
+                job["error"] = f"Lease expired {job['attempts']} times, last held by {worker_id}"
+                state = "failed"
+            else:
+                logger.warning("The lease of job %s held by %s expired, requeuing it.", job_id, worker_id)
+                state = "pending"
+            tmp_path.write_text(json.dumps(job, indent=2) + "\n", encoding="utf-8")
+            tmp_path.replace(self.get_path(state, job_id))
+        return expired
+
+    def join(self, *, poll_interval: float = POLL_INTERVAL, timeout: float | None = None) -> dict:
+        """
+        Wait until no job is pending or leased, requeuing the expired leases in the meantime.
+
+        Parameters
+        ----------
+        poll_interval : float, optional
+            The number of seconds between two checks. Default is 5.
+        timeout : float, optional
+            The maximum number of seconds to wait. Default is None (no limit).
+
+        Returns
+        -------
+        dict
+            The number of jobs of each state, see `status`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.requeue_expired()
+            status = self.status()
+            if not status["pending"] and not status["leased"]:
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                return status
+            time.sleep(poll_interval)
+
+
+def process_job(job: dict, ilastik_script_path: str) -> None:
+    """
+    Run Ilastik, and the thresholding if requested, on the images of a job.
+
+    Parameters
+    ----------
+    job : dict
+        The job, as written by `WorkQueue.enqueue`.
+    ilastik_script_path : str
+        The path to the Ilastik script.
+
+    Raises
+    ------
+    RuntimeError
+        If there is an error during the Ilastik execution.
+    BatchError
+        If some probability files could not be colored.
+    """
+    Path(job["result_base_path"]).mkdir(parents=True, exist_ok=True)
+    args = (
+        job["inputs"],
+        job["model_path"],
+        job["result_base_path"],
+        ilastik_script_path,
+        job["export_source"],
+        job["output_format"],
+    )
+    if job.get("threshold") is None:
+        process_images(*args)
+        return
+
+    # Only the probability files of the job are colored: the other ones of the folder belong to other workers
+    process_file = get_probability_processor(
+        job["threshold"],
+        job["below_threshold_color"],
+        job["channel_colors"],
+        deletion=job["deletion"],
+        max_memory_mb=job["max_memory_mb"],
+    )
+    submitted = {}
+    with ThreadPoolExecutor(max_workers=job["threshold_workers"]) as executor:
+
+        def on_output(output_path: str) -> None:
+            submitted[executor.submit(process_file, output_path)] = output_path
+
+        process_images(*args, on_output=on_output)
+
+    if errors := collect_errors(list(submitted), submitted):
+        msg = f"Error during the thresholding of {len(errors)} files. See console output for details."
+        raise BatchError(msg, errors)
+
+
+def run_worker(
+    queue_dir: str,
+    ilastik_script_path: str | None = None,
+    *,
+    worker_id: str | None = None,
+    poll_interval: float = POLL_INTERVAL,
+    keep_running: bool = False,
+    failed: list | None = None,
+) -> int:
+    """
+    Process the jobs of a queue until it is empty.
+
+    Parameters
+    ----------
+    queue_dir : str
+        The folder of the queue.
+    ilastik_script_path : str, optional
+        The path to the Ilastik script. If not provided, it will attempt to find the path automatically.
+    worker_id : str, optional
+        The identifier of the worker. Default is the host name and the process ID.
+    poll_interval : float, optional
+        The number of seconds between two checks of the queue when no job is pending. Default is 5.
+    keep_running : bool, optional
+        Whether to wait for new jobs once the queue is empty instead of returning. Default is False: the worker
+        returns once no job is pending or leased by another worker (whose lease may still expire).
+    failed : list, optional
+        Receives the identifiers of the jobs which failed in this worker.
+
+    Returns
+    -------
+    int
+        The number of jobs processed by the worker, including the failed ones.
+    """
+    ilastik_script_path = ilastik_script_path or find_ilastik()
+    if ilastik_script_path is None:
+        logger.error("ilastik_script_path is None. Please provide the path to the Ilastik script.")
+        return 0
+
+    queue = WorkQueue(queue_dir)
+    worker_id = worker_id or get_worker_id()
+    processed = 0
+    while True:
+        queue.requeue_expired()
+        lease = queue.claim(worker_id)
+        if lease is None:
+            if not keep_running and not queue.list_jobs("leased"):
+                break
+            time.sleep(poll_interval)
+            continue
+
+        logger.info("Worker %s processing job %s (%d images).", worker_id, lease.job["id"], len(lease.job["inputs"]))
+        try:
+            with lease.keep_alive():
+                process_job(lease.job, ilastik_script_path)
+        except Exception as error:
+            logger.exception("Error while processing job %s", lease.job["id"])
+            if not lease.lost and lease.fail(error) and failed is not None:
+                failed.append(lease.job["id"])
+        except BaseException:
+            # Stopped by the user or the scheduler: another worker takes the job
+            lease.release()
+            raise
+        else:
+            if lease.lost:
+                # The job was put back in the queue while it was processed, its new holder records the outcome
+                logger.warning("Job %s was processed after its lease was lost, not recording it.", lease.job["id"])
+            else:
+                lease.complete()
+        processed += 1
+
+    logger.info("Worker %s processed %d jobs.", worker_id, processed)
+    return processed
+
+
+def main() -> int:
+    """Run a worker from the command line and return the exit code, 1 if some of its jobs failed."""
+    parser = argparse.ArgumentParser(
+        description="Process the jobs of an EasIlastik queue folder, see `easilastik.work_queue`."
+    )
+    parser.add_argument("queue_dir", help="folder of the queue, shared by the coordinator and the workers")
+    parser.add_argument("--ilastik-script-path", help="path to the Ilastik script, found automatically by default")
+    parser.add_argument("--worker-id", help="identifier of the worker, default is the host name and process ID")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="seconds between two checks")
+    parser.add_argument("--keep-running", action="store_true", help="wait for new jobs once the queue is empty")
+    args = parser.parse_args()
+
+    # Release the current job when the scheduler stops the worker
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(128 + signal.SIGTERM))
+    failed = []
+    run_worker(
+        args.queue_dir,
+        args.ilastik_script_path,
+        worker_id=args.worker_id,
+        poll_interval=args.poll_interval,
+        keep_running=args.keep_running,
+        failed=failed,
+    )
+    if failed:
+        logger.error("%d jobs failed: %s", len(failed), ", ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())